@@ -76,3 +76,10 @@ class ConfigOptionAction(Action):
         if getattr(namespace, self.dest) is None:
             setattr(namespace, self.dest, {})
         merge_into_dict(getattr(namespace, self.dest), value)
+
+
+def positive_int(value):
+    result = int(value)
+    if result < 1:
+        raise ArgumentTypeError('must be at least 1')
+    return result
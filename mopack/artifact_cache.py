@@ -0,0 +1,402 @@
+import functools
+import http.client
+import importlib_metadata as metadata
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import quote, urlparse
+
+from . import archive, log
+
+__all__ = ['ArtifactBackend', 'ArtifactCache', 'artifact_cache_var',
+           'DirectoryBackend', 'HTTPBackend', 'make_backend']
+
+artifact_cache_var = 'MOPACK_ARTIFACT_CACHE'
+
+
+class ArtifactBackend:
+    # The interface for storing artifacts. Backends are registered under the
+    # `mopack.artifact_backends` entry point group, keyed by URL scheme, and
+    # are constructed with the location of the store. Remote backends have
+    # artifacts fetched ahead of time and uploaded in the background.
+
+    remote = False
+
+    def get(self, key, file):
+        # Write the artifact for `key` to `file`, returning False if there's no
+        # such artifact.
+        raise NotImplementedError('ArtifactBackend.get not implemented')
+
+    def put(self, key, file):
+        # Store the contents of `file` as the artifact for `key`.
+        raise NotImplementedError('ArtifactBackend.put not implemented')
+
+    def close(self):
+        pass
+
+
+class DirectoryBackend(ArtifactBackend):
+    # Store artifacts as files in a (possibly shared) directory.
+
+    def __init__(self, location):
+        url = urlparse(location)
+        self.path = url.path if url.scheme == 'file' else location
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key + '.tar.gz')
+
+    def get(self, key, file):
+        try:
+            with open(self._path(key), 'rb') as f:
+                shutil.copyfileobj(f, file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, file):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so that other processes never see a
+        # partial artifact.
+        fd, tmppath = tempfile.mkstemp(prefix='.tmp-',
+                                       dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(file, f)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+
+
+class HTTPBackend(ArtifactBackend):
+    # Store artifacts on an HTTP server: `GET <url>/<key>.tar.gz` fetches an
+    # artifact (returning 404 if it doesn't exist), and `PUT` to the same URL
+    # stores it. Connections are kept alive and reused between requests.
+
+    remote = True
+    timeout = 60
+
+    def __init__(self, location):
+        url = urlparse(location)
+        self.connection_type = (http.client.HTTPSConnection
+                                if url.scheme == 'https'
+                                else http.client.HTTPConnection)
+        self.netloc = url.netloc
+        self.path = url.path.rstrip('/')
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _url(self, key):
+        return '{}/{}.tar.gz'.format(self.path, quote(key))
+
+    def _acquire(self):
+        with self._lock:
+            if self._connections:
+                return self._connections.pop()
+        return self.connection_type(self.netloc, timeout=self.timeout)
+
+    def _release(self, conn):
+        with self._lock:
+            self._connections.append(conn)
+
+    def _request(self, method, key, body=None, headers=None):
+        # Send a request, returning the connection and response; the caller
+        # must release the connection once it has read the response. If a
+        # reused connection was closed by the server, try again with a new
+        # one.
+        headers = dict(headers or {})
+        pos = body.tell() if body is not None else None
+        for retry in (True, False):
+            conn = self._acquire()
+            try:
+                conn.request(method, self._url(key), body, headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                if not retry:
+                    raise
+                if body is not None:
+                    body.seek(pos)
+            except BaseException:
+                conn.close()
+                raise
+
+    def _finish(self, conn, response, expected):
+        data = response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        if response.status not in expected:
+            raise OSError('HTTP {} {}: {}'.format(
+                response.status, response.reason,
+                data.decode('utf-8', 'replace').strip()
+            ))
+
+    def get(self, key, file):
+        conn, response = self._request('GET', key)
+        if response.status == 200:
+            try:
+                shutil.copyfileobj(response, file)
+            except BaseException:
+                conn.close()
+                raise
+        self._finish(conn, response, (200, 404))
+        return response.status == 200
+
+    def put(self, key, file):
+        size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        conn, response = self._request('PUT', key, file, {
+            'Content-Length': str(size),
+            'Content-Type': 'application/gzip',
+        })
+        self._finish(conn, response, (200, 201, 204))
+
+    def close(self):
+        with self._lock:
+            for i in self._connections:
+                i.close()
+            self._connections = []
+
+
+@functools.lru_cache(maxsize=None)
+def _load_backend_type(scheme):
+    return metadata.entry_points(
+        group='mopack.artifact_backends'
+    )[scheme].load()
+
+
+def make_backend(location):
+    # Plain paths (including Windows paths with a drive letter) are stored in
+    # a local directory; otherwise, pick the backend from the URL scheme.
+    scheme = urlparse(location).scheme
+    if len(scheme) < 2:
+        scheme = 'file'
+    try:
+        backend_type = _load_backend_type(scheme)
+    except KeyError:
+        raise ValueError('unknown artifact cache scheme {!r}'.format(scheme))
+    return backend_type(location)
+
+
+def _is_subpath(relpath):
+    return not (os.path.isabs(relpath) or os.path.splitdrive(relpath)[0] or
+                os.path.normpath(relpath).split(os.path.sep)[0] == os.pardir)
+
+
+def _is_text(path):
+    with open(path, 'rb') as f:
+        return b'\0' not in f.read(8192)
+
+
+class ArtifactCache:
+    # A cache of the build outputs of packages, keyed by a hash of everything
+    # that goes into the build. Each artifact is a tarball of the outputs
+    # (stored relative to the package directory) along with a manifest
+    # recording the package directory it was built in. When restoring an
+    # artifact into another package directory, we replace the old package
+    # directory in any text files (e.g. `.pc` files or build scripts) with the
+    # new one.
+
+    manifest_name = '.mopack-artifact.json'
+    version = 1
+
+    # The maximum number of concurrent requests to remote backends.
+    max_requests = 8
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._tmpdir = None
+        self._prefetched = {}
+        self._executor = None
+        self._uploads = []
+
+    def _tempfile(self):
+        with self._lock:
+            if self._tmpdir is None:
+                self._tmpdir = tempfile.TemporaryDirectory(prefix='mopack-')
+        return tempfile.NamedTemporaryFile(dir=self._tmpdir.name, delete=False)
+
+    def _fetch(self, key):
+        f = self._tempfile()
+        try:
+            with f:
+                found = self.backend.get(key, f)
+        except Exception as e:
+            log.warning('unable to fetch artifact {}: {}'.format(key, e))
+            found = False
+        if not found:
+            os.remove(f.name)
+            return None
+        return f.name
+
+    def prefetch(self, keys):
+        # Fetch the artifacts for `keys` from remote backends concurrently so
+        # that restoring them later doesn't need to wait on the network.
+        keys = [i for i in dict.fromkeys(keys) if i not in self._prefetched]
+        if not self.backend.remote or not keys:
+            return
+
+        with ThreadPoolExecutor(min(len(keys), self.max_requests)) as ex:
+            for key, path in zip(keys, ex.map(self._fetch, keys)):
+                self._prefetched[key] = path
+
+    def _upload(self, key, path):
+        try:
+            with open(path, 'rb') as f:
+                self.backend.put(key, f)
+        except Exception as e:
+            log.warning('unable to upload artifact {}: {}'.format(key, e))
+        finally:
+            os.remove(path)
+
+    def flush(self):
+        # Wait for any pending uploads to finish.
+        with self._lock:
+            uploads, self._uploads = self._uploads, []
+        for i in uploads:
+            i.result()
+
+    def close(self):
+        self.flush()
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        self.backend.close()
+        if self._tmpdir:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+        self._prefetched = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def from_env(cls, env=os.environ):
+        location = env.get(artifact_cache_var)
+        if not location:
+            return None
+        return cls(make_backend(location))
+
+    def store(self, key, pkgdir, paths):
+        # Store the files in `paths`, all of which must be inside `pkgdir`.
+        relpaths = [os.path.relpath(i, pkgdir) for i in paths]
+        if not all(_is_subpath(i) for i in relpaths):
+            raise ValueError('artifact paths must be inside package directory')
+
+        manifest = json.dumps({
+            'version': self.version, 'pkgdir': pkgdir, 'paths': relpaths,
+        }).encode('utf-8')
+
+        with self._tempfile() as f:
+            with tarfile.open(fileobj=f, mode='w:gz') as tar:
+                info = tarfile.TarInfo(self.manifest_name)
+                info.size = len(manifest)
+                tar.addfile(info, BytesIO(manifest))
+                for path, relpath in zip(paths, relpaths):
+                    tar.add(path, relpath)
+
+        if self.backend.remote:
+            # Upload the artifact in the background so that we can keep
+            # building other packages in the meantime.
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_requests)
+                self._uploads.append(self._executor.submit(
+                    self._upload, key, f.name
+                ))
+        else:
+            try:
+                with open(f.name, 'rb') as data:
+                    self.backend.put(key, data)
+            finally:
+                os.remove(f.name)
+
+    def restore(self, key, pkgdir):
+        # Restore the artifact for `key` into `pkgdir`, returning False if
+        # there's no such artifact.
+        if key in self._prefetched:
+            path = self._prefetched.pop(key)
+            if path is None:
+                return False
+            try:
+                with open(path, 'rb') as f:
+                    return self._extract(f, pkgdir)
+            finally:
+                os.remove(path)
+
+        with tempfile.TemporaryFile() as f:
+            if not self.backend.get(key, f):
+                return False
+            f.seek(0)
+            return self._extract(f, pkgdir)
+
+    def _extract(self, f, pkgdir):
+        # Extract to a temporary directory first so that we never leave
+        # a partially-restored artifact behind.
+        os.makedirs(pkgdir, exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=pkgdir)
+        try:
+            with archive.open(f, 'r:gz') as arc:
+                arc.extractall(tmpdir)
+            with open(os.path.join(tmpdir, self.manifest_name)) as m:
+                manifest = json.load(m)
+            if manifest['version'] != self.version:
+                return False
+
+            for i in manifest['paths']:
+                if not _is_subpath(i):
+                    raise ValueError('unsafe path in artifact: {!r}'
+                                     .format(i))
+                path = os.path.join(pkgdir, i)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(os.path.join(tmpdir, i), path)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        old_pkgdir = manifest['pkgdir']
+        if old_pkgdir != pkgdir:
+            for i in manifest['paths']:
+                self._relocate(os.path.join(pkgdir, i), old_pkgdir, pkgdir)
+        return True
+
+    @staticmethod
+    def _relocate(path, old, new):
+        old, new = old.encode('utf-8'), new.encode('utf-8')
+
+        if os.path.isdir(path):
+            files = (os.path.join(root, i) for root, _, names in os.walk(path)
+                     for i in names)
+        else:
+            files = [path]
+
+        for i in files:
+            if os.path.islink(i) or not _is_text(i):
+                continue
+            with open(i, 'rb') as f:
+                data = f.read()
+            new_data = data.replace(old, new)
+            if new_data != data:
+                stat = os.stat(i)
+                with open(i, 'wb') as f:
+                    f.write(new_data)
+                # Keep the original mtime so that build systems don't consider
+                # the relocated files to be newer than their outputs.
+                os.utime(i, ns=(stat.st_atime_ns, stat.st_mtime_ns))
@@ -0,0 +1,122 @@
+import argparse
+import http.server
+import os
+import re
+import shutil
+import tempfile
+
+from .artifact_cache import DirectoryBackend
+
+__all__ = ['ArtifactServer', 'main']
+
+_path_ex = re.compile(r'^/([0-9a-f]{2,})\.tar\.gz$')
+
+
+class ArtifactRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Use HTTP/1.1 so that clients can keep their connections alive.
+    protocol_version = 'HTTP/1.1'
+
+    def _key(self):
+        m = _path_ex.match(self.path)
+        if not m:
+            self.send_error(404)
+            return None
+        return m.group(1)
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        key = self._key()
+        if key is None:
+            return
+
+        with tempfile.TemporaryFile() as f:
+            if not self.server.backend.get(key, f):
+                # Missing artifacts are expected, so keep the connection open.
+                self._send_empty(404)
+                return
+
+            size = f.seek(0, os.SEEK_END)
+            f.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/gzip')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_PUT(self):
+        key = self._key()
+        if key is None:
+            return
+
+        try:
+            size = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
+
+        with tempfile.TemporaryFile() as f:
+            while size > 0:
+                chunk = self.rfile.read(min(size, 65536))
+                if not chunk:
+                    self.send_error(400, 'incomplete request body')
+                    return
+                f.write(chunk)
+                size -= len(chunk)
+            f.seek(0)
+            self.server.backend.put(key, f)
+        self._send_empty(201)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ArtifactServer(http.server.ThreadingHTTPServer):
+    # A simple reference implementation of the artifact cache protocol,
+    # storing artifacts in a local directory. This is mainly intended for
+    # testing; it performs no authentication.
+
+    daemon_threads = True
+
+    def __init__(self, address, path, verbose=False):
+        self.backend = DirectoryBackend(path)
+        self.verbose = verbose
+        super().__init__(address, ArtifactRequestHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m mopack.artifact_server',
+        description='Serve a directory as a mopack artifact cache.'
+    )
+    parser.add_argument('directory', help='directory to store artifacts in')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='host to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log each request')
+    args = parser.parse_args(args)
+
+    with ArtifactServer((args.host, args.port), args.directory,
+                        args.verbose) as server:
+        print('serving artifacts from {} at {}'.format(args.directory,
+                                                       server.url),
+              flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
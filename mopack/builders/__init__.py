@@ -1,3 +1,4 @@
+import functools
 import importlib_metadata as metadata
 import os
 import shutil
@@ -5,14 +6,21 @@ from typing import Dict
 
 from .. import types
 from ..base_options import BaseOptions, OptionsHolder
+from ..compiler_cache import get_compiler_cache
 from ..freezedried import GenericFreezeDried
 from ..path import Path
 from ..placeholder import MaybePlaceholderString
 
 
+@functools.lru_cache(maxsize=None)
+def _load_builder_type(type):
+    # Looking up entry points is fairly slow, so only do it once per type.
+    return metadata.entry_points(group='mopack.builders')[type].load()
+
+
 def _get_builder_type(type, field='type'):
     try:
-        return metadata.entry_points(group='mopack.builders')[type].load()
+        return _load_builder_type(type)
     except KeyError:
         raise types.FieldValueError('unknown builder {!r}'.format(type), field)
 
@@ -51,6 +59,20 @@ class Builder(OptionsHolder):
     def path_values(self, metadata, parent_values):
         return {}
 
+    @staticmethod
+    def _jobs_args(jobs):
+        return ['-j{}'.format(jobs)] if jobs else []
+
+    def _compiler_cache(self, metadata):
+        return get_compiler_cache(self._common_options, metadata.pkgdir)
+
+    def _build_env(self, metadata, path_values):
+        # Get the environment to build with, including any settings for the
+        # compiler cache.
+        env = self._full_env.value(path_values)
+        cache = self._compiler_cache(metadata)
+        return cache.env(env) if cache else env
+
     def filter_linkage(self, linkage):
         return linkage
 
@@ -6,7 +6,6 @@ from .. import types
 from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
 from ..log import LogFile
-from ..path import pushd
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'libdir', 'includedir')
@@ -54,28 +53,28 @@ class B2Builder(DirectoryBuilder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         b2 = get_cmd(env, 'B2', 'b2')
-        with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(self.directory.string(path_values)):
-                logfile.check_call(
-                    b2 + self._builddir_args(path_values['builddir']) +
-                    self.extra_args.args(path_values),
-                    env=env
-                )
+        with LogFile.open(metadata.pkgdir, self.name) as logfile, \
+             logfile.jobs() as jobs:
+            logfile.check_call(
+                b2 + self._jobs_args(jobs) +
+                self._builddir_args(path_values['builddir']) +
+                self.extra_args.args(path_values),
+                env=env, cwd=self.directory.string(path_values)
+            )
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         b2 = get_cmd(env, 'B2', 'b2')
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(self.directory.string(path_values)):
-                logfile.check_call(
-                    b2 + ['install'] +
-                    self._builddir_args(path_values['builddir']) +
-                    self._install_args(self._common_options.deploy_dirs) +
-                    self.extra_args.args(path_values),
-                    env=env
-                )
+            logfile.check_call(
+                b2 + ['install'] +
+                self._builddir_args(path_values['builddir']) +
+                self._install_args(self._common_options.deploy_dirs) +
+                self.extra_args.args(path_values),
+                env=env, cwd=self.directory.string(path_values)
+            )
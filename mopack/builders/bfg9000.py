@@ -7,7 +7,7 @@ from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
 from ..log import LogFile
 from ..objutils import Unset
-from ..path import Path, pushd
+from ..path import Path
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'bindir', 'libdir',
@@ -79,15 +79,17 @@ class Bfg9000Builder(ConfiguringBuilder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         bfg9000 = get_cmd(env, 'BFG9000', 'bfg9000')
+        cache = self._compiler_cache(metadata)
+        if cache:
+            env = cache.compiler_env(env)
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(self.directory.string(path_values)):
-                logfile.check_call(
-                    bfg9000 + ['configure', path_values['builddir']] +
-                    self._toolchain_args(self._this_options.toolchain) +
-                    self._install_args(self._common_options.deploy_dirs) +
-                    self.extra_args.args(path_values),
-                    env=env
-                )
+            logfile.check_call(
+                bfg9000 + ['configure', path_values['builddir']] +
+                self._toolchain_args(self._this_options.toolchain) +
+                self._install_args(self._common_options.deploy_dirs) +
+                self.extra_args.args(path_values),
+                env=env, cwd=self.directory.string(path_values)
+            )
         super().build(metadata, pkg)
@@ -7,7 +7,7 @@ from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
 from ..log import LogFile
 from ..objutils import Unset
-from ..path import Path, pushd
+from ..path import Path
 from ..shell import ShellArguments
 
 # XXX: Handle exec-prefix, which CMake doesn't work with directly.
@@ -75,16 +75,17 @@ class CMakeBuilder(ConfiguringBuilder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         cmake = get_cmd(env, 'CMAKE', 'cmake')
+        cache = self._compiler_cache(metadata)
+        os.makedirs(path_values['builddir'], exist_ok=True)
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(path_values['builddir'], makedirs=True, exist_ok=True):
-                logfile.check_call(
-                    cmake + [self.directory.string(path_values),
-                             '-G', 'Ninja'] +
-                    self._toolchain_args(self._this_options.toolchain) +
-                    self._install_args(self._common_options.deploy_dirs) +
-                    self.extra_args.args(path_values),
-                    env=env
-                )
+            logfile.check_call(
+                cmake + [self.directory.string(path_values), '-G', 'Ninja'] +
+                self._toolchain_args(self._this_options.toolchain) +
+                self._install_args(self._common_options.deploy_dirs) +
+                (cache.cmake_args(env) if cache else []) +
+                self.extra_args.args(path_values),
+                env=env, cwd=path_values['builddir']
+            )
         super().build(metadata, pkg)
@@ -8,7 +8,7 @@ from .. import types
 from ..freezedried import GenericFreezeDried
 from ..log import LogFile
 from ..objutils import Unset
-from ..path import Path, pushd
+from ..path import Path
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'bindir', 'libdir',
@@ -69,17 +69,23 @@ class CustomBuilder(DirectoryBuilder):
         T.build_commands(_cmds_type)
         T.deploy_commands(_cmds_type)
 
-    def _execute(self, logfile, commands, path_values):
-        env = self._full_env.value(path_values)
+    def _execute(self, logfile, commands, env, path_values, cwd):
+        # Track the working directory ourselves rather than calling `chdir`,
+        # since other packages may be building concurrently.
         for line in commands:
             line = line.args(path_values)
             if line[0] == 'cd':
                 with logfile.synthetic_command(line):
                     if len(line) != 2:
                         raise RuntimeError('invalid command format')
-                    os.chdir(line[1])
+                    newdir = os.path.join(cwd, line[1])
+                    if not os.path.isdir(newdir):
+                        raise FileNotFoundError(
+                            'No such directory: {!r}'.format(line[1])
+                        )
+                    cwd = newdir
             else:
-                logfile.check_call(line, env=env)
+                logfile.check_call(line, env=env, cwd=cwd)
 
     def path_bases(self):
         if self.outdir:
@@ -101,17 +107,25 @@ class CustomBuilder(DirectoryBuilder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
+        env = self._build_env(metadata, path_values)
+        cache = self._compiler_cache(metadata)
+        if cache:
+            env = cache.compiler_env(env)
+
+        directory = self.directory.string(path_values)
+        os.makedirs(directory, exist_ok=True)
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(self.directory.string(path_values), makedirs=True,
-                       exist_ok=True):
-                self._execute(logfile, self.build_commands, path_values)
+            self._execute(logfile, self.build_commands, env, path_values,
+                          directory)
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
         directory = (path_values[self.outdir + 'dir'] if self.outdir else
                      self.directory.string(path_values))
+        env = self._full_env.value(path_values)
+        os.makedirs(directory, exist_ok=True)
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(directory, makedirs=True, exist_ok=True):
-                self._execute(logfile, self.deploy_commands, path_values)
+            self._execute(logfile, self.deploy_commands, env, path_values,
+                          directory)
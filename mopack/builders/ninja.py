@@ -3,7 +3,6 @@ from .. import types
 from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
 from ..log import LogFile
-from ..path import pushd
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'bindir', 'libdir',
@@ -39,18 +38,19 @@ class NinjaBuilder(DirectoryBuilder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         ninja = get_cmd(env, 'NINJA', 'ninja')
-        with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(self.directory.string(path_values)):
-                logfile.check_call(ninja, env=env)
+        with LogFile.open(metadata.pkgdir, self.name) as logfile, \
+             logfile.jobs() as jobs:
+            logfile.check_call(ninja + self._jobs_args(jobs), env=env,
+                               cwd=self.directory.string(path_values))
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
 
-        env = self._full_env.value(path_values)
+        env = self._build_env(metadata, path_values)
         ninja = get_cmd(env, 'NINJA', 'ninja')
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(self.directory.string(path_values)):
-                logfile.check_call(ninja + ['install'], env=env)
+            logfile.check_call(ninja + ['install'], env=env,
+                               cwd=self.directory.string(path_values))
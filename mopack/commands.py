@@ -1,10 +1,17 @@
 import os
 import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from functools import partial
 
 from . import log
+from .artifact_cache import ArtifactCache
 from .config import PlaceholderPackage
+from .download_cache import DownloadCache, GitMirrorCache
 from .exceptions import ConfigurationError
-from .metadata import Metadata
+from .jobserver import JobServer
+from .linkage_cache import LinkageCache
+from .metadata import Metadata, retry_if_changed
 from .origins import BatchPackage
 
 mopack_dirname = 'mopack'
@@ -25,34 +32,62 @@ def clean(pkgdir):
     shutil.rmtree(pkgdir)
 
 
-def _do_fetch(config, old_metadata, pkgdir):
-    child_configs = []
-    for pkg in config.packages.values():
-        # If we have a placeholder package, a parent config has a definition
-        # for it, so skip it.
-        if pkg is PlaceholderPackage:
-            continue
+def _clean_pre(old_metadata, pkg):
+    # Clean out the old package sources if needed. Returns True if the package
+    # will need to fetch its sources anew.
+    if pkg.name in old_metadata.packages:
+        return old_metadata.packages[pkg.name].clean_pre(old_metadata, pkg)
+    return True
 
-        # Clean out the old package sources if needed.
-        if pkg.name in old_metadata.packages:
-            old_metadata.packages[pkg.name].clean_pre(old_metadata, pkg)
 
-        # Fetch the new package and check for child mopack configs.
-        try:
-            # XXX: Since this is a new package, maybe it would be more sensible
-            # to pass the *new* metadata object to it. However, in the current
-            # implementation, the new metadata object hasn't been created yet.
-            # Currently, this doesn't cause any real issues though, since the
-            # pkgdir should be the same either way, and fetch() shouldn't need
-            # any other info.
-            child_config = pkg.fetch(old_metadata, config)
-        except Exception:
-            pkg.clean_pre(old_metadata, None, quiet=True)
-            raise
+def _do_fetch(config, old_metadata, pkgdir, executor=None):
+    # If we have a placeholder package, a parent config has a definition for
+    # it, so skip it.
+    packages = [pkg for pkg in config.packages.values()
+                if pkg is not PlaceholderPackage]
+
+    if executor:
+        # Start fetching the sources for every package at this level at once.
+        # Child configs are still loaded below one at a time and in order, so
+        # the final package list is the same as for a serial fetch.
+        fresh = [_clean_pre(old_metadata, pkg) for pkg in packages]
+        prefetches = [executor.submit(pkg.prefetch, old_metadata)
+                      for pkg in packages]
+
+    child_configs = []
+    try:
+        for i, pkg in enumerate(packages):
+            if executor:
+                prefetches[i].result()
+            else:
+                _clean_pre(old_metadata, pkg)
+
+            # Fetch the new package and check for child mopack configs.
+            try:
+                # XXX: Since this is a new package, maybe it would be more
+                # sensible to pass the *new* metadata object to it. However, in
+                # the current implementation, the new metadata object hasn't
+                # been created yet. Currently, this doesn't cause any real
+                # issues though, since the pkgdir should be the same either
+                # way, and fetch() shouldn't need any other info.
+                child_config = pkg.fetch(old_metadata, config)
+            except Exception:
+                pkg.clean_pre(old_metadata, None, quiet=True)
+                raise
+
+            if child_config:
+                child_configs.append(child_config)
+                _do_fetch(child_config, old_metadata, pkgdir, executor)
+    except Exception:
+        if executor:
+            # Clean up any later packages that we've already fetched, just as
+            # if we'd never gotten to them.
+            for j in range(i + 1, len(packages)):
+                prefetches[j].result()
+                if fresh[j]:
+                    packages[j].clean_pre(old_metadata, None, quiet=True)
+        raise
 
-        if child_config:
-            child_configs.append(child_config)
-            _do_fetch(child_config, old_metadata, pkgdir)
     config.add_children(child_configs)
 
 
@@ -65,12 +100,14 @@ def _fill_metadata(config, pkgdir):
     return metadata
 
 
-def fetch(config, pkgdir):
+def fetch(config, pkgdir, jobs=1):
     log.LogFile.clean_logs(pkgdir)
 
     old_metadata = Metadata.try_load(pkgdir)
     try:
-        _do_fetch(config, old_metadata, pkgdir)
+        with (ThreadPoolExecutor(jobs) if jobs > 1 else
+              nullcontext()) as executor:
+            _do_fetch(config, old_metadata, pkgdir, executor)
     except ConfigurationError:
         raise
     except Exception:
@@ -96,28 +133,17 @@ def fetch(config, pkgdir):
     return metadata
 
 
-def resolve(config, pkgdir):
-    if not config:
-        log.info('no inputs')
-        return
-
-    metadata = fetch(config, pkgdir)
-
-    packages, batch_packages = [], {}
-    for pkg in metadata.packages.values():
-        if isinstance(pkg, BatchPackage):
-            batch_packages.setdefault(type(pkg), []).append(pkg)
-        else:
-            packages.append(pkg)
-
+def _resolve_serially(metadata, batch_packages, packages):
     for t, pkgs in batch_packages.items():
         try:
             t.resolve_all(metadata, pkgs)
         except Exception:
             for i in pkgs:
                 i.clean_post(metadata, None, quiet=True)
+            metadata.mark_dirty(*pkgs)
             metadata.save()
             raise
+        metadata.mark_dirty(*pkgs)
 
     for pkg in packages:
         try:
@@ -127,10 +153,155 @@ def resolve(config, pkgdir):
             pkg.resolve(metadata)
         except Exception:
             pkg.clean_post(metadata, None, quiet=True)
+            metadata.mark_dirty(pkg)
             metadata.save()
             raise
+        metadata.mark_dirty(pkg)
+
+
+def _resolve_concurrently(metadata, batch_packages, packages, jobs):
+    # Each batch origin gets a single task to resolve all of its packages at
+    # once, and every other package gets a task of its own.
+    tasks = [(pkgs, partial(t.resolve_all, metadata, pkgs))
+             for t, pkgs in batch_packages.items()]
+    tasks.extend(([pkg], partial(pkg.resolve, metadata)) for pkg in packages)
+
+    task_index = {pkg.name: i for i, (pkgs, _) in enumerate(tasks)
+                  for pkg in pkgs}
+    waiting_on = []
+    for i, (pkgs, _) in enumerate(tasks):
+        deps = set()
+        for pkg in pkgs:
+            deps.update(task_index[dep] for dep in
+                        pkg.dependency_names(metadata)
+                        if dep in task_index)
+        deps.discard(i)
+        waiting_on.append(deps)
+
+    # Saving the metadata reads the state of each package that's changed
+    # since the last save, so write out every package before any of them
+    # start resolving. Later saves will then only read the packages that have
+    # already finished, which we mark as changed on this thread.
+    if any(pkg.needs_dependencies for pkgs, _ in tasks for pkg in pkgs):
+        metadata.save()
+    unsaved = False
+
+    pending = list(range(len(tasks)))
+    running = {}
+    finished = set()
+    errors = {}
+    with ThreadPoolExecutor(jobs) as executor:
+        while pending or running:
+            if not errors:
+                ready = [i for i in pending if waiting_on[i] <= finished]
+                if not ready and not running:
+                    # The remaining packages have cyclic dependencies, so just
+                    # resolve them in their original order.
+                    ready = pending[:1]
+
+                for i in ready[:jobs - len(running)]:
+                    pending.remove(i)
+                    pkgs, task = tasks[i]
+                    # Ensure metadata is up-to-date for packages that need it.
+                    if unsaved and any(pkg.needs_dependencies for pkg in pkgs):
+                        metadata.save()
+                        unsaved = False
+
+                    # Computing a package's hashes memoizes them on it and on
+                    # its dependencies, so do that here rather than letting
+                    # tasks modify other packages while they run.
+                    for pkg in pkgs:
+                        pkg.compute_fingerprint(metadata)
+                        if metadata.artifact_cache:
+                            pkg.compute_artifact_key(metadata)
+                    running[executor.submit(task)] = i
+            elif not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                metadata.mark_dirty(*tasks[i][0])
+                unsaved = True
+                if future.exception():
+                    errors[i] = future.exception()
+                else:
+                    finished.add(i)
+
+    if errors:
+        for i in sorted(errors):
+            for pkg in tasks[i][0]:
+                pkg.clean_post(metadata, None, quiet=True)
+        metadata.save()
+        raise errors[min(errors)]
+
+
+def _prepare_linkages(metadata):
+    # Generate any files needed for linkage (e.g. .pc files) now, after the
+    # metadata is saved, so that `mopack linkage` only needs to read them.
+    # This is just an optimization, so if it fails, `mopack linkage` will try
+    # again (and report any errors).
+    for pkg in metadata.packages.values():
+        try:
+            pkg.prepare_linkage(metadata)
+        except Exception as e:
+            log.debug('unable to prepare linkage for {!r}: {}'
+                      .format(pkg.name, e))
+
+
+def _prefetch_artifacts(metadata, packages):
+    keys = [pkg.pending_artifact_key(metadata) for pkg in packages]
+    metadata.artifact_cache.prefetch(i for i in keys if i)
+
+    # Checking which packages are up to date computed their fingerprints, but
+    # these depend on the (post-build) fingerprints of their dependencies, so
+    # forget them until each package is resolved.
+    for pkg in metadata.packages.values():
+        pkg.forget_fingerprint()
+
+
+def _do_resolve(config, pkgdir, jobs):
+    metadata = fetch(config, pkgdir, jobs)
+
+    packages, batch_packages = [], {}
+    for pkg in metadata.packages.values():
+        if isinstance(pkg, BatchPackage):
+            batch_packages.setdefault(type(pkg), []).append(pkg)
+        else:
+            packages.append(pkg)
+
+    # Closing the artifact cache waits for any uploads to finish.
+    with ArtifactCache.from_env() or nullcontext() as artifact_cache:
+        metadata.artifact_cache = artifact_cache
+        if artifact_cache:
+            _prefetch_artifacts(metadata, packages)
+
+        if jobs > 1:
+            _resolve_concurrently(metadata, batch_packages, packages, jobs)
+        else:
+            _resolve_serially(metadata, batch_packages, packages)
+    metadata.artifact_cache = None
 
     metadata.save()
+    _prepare_linkages(metadata)
+    LinkageCache(pkgdir).clear()
+
+
+def resolve(config, pkgdir, jobs=None):
+    if not config:
+        log.info('no inputs')
+        return
+
+    # If `jobs` is set, every command we run shares a pool of that many job
+    # slots, so building several packages at once doesn't oversubscribe the
+    # CPU. Otherwise, packages are resolved one at a time and each build tool
+    # picks its own parallelism.
+    with JobServer(jobs) if jobs else nullcontext() as jobserver:
+        log.LogFile.jobserver = jobserver
+        try:
+            _do_resolve(config, pkgdir, jobs or 1)
+        finally:
+            log.LogFile.jobserver = None
 
 
 def deploy(pkgdir):
@@ -153,22 +324,44 @@ def deploy(pkgdir):
         pkg.deploy(metadata)
 
 
+def _linkages(pkgdir, dependencies, strict):
+    # Check the cache first so that we don't need to load the metadata at all
+    # if we've already computed these linkages.
+    cache = LinkageCache(pkgdir)
+    stamp = cache.stamp()
+    metadata = None
+
+    result = {}
+    for dep in dependencies:
+        linkage = cache.get(dep, stamp, strict)
+        if linkage is None:
+            if metadata is None:
+                metadata = Metadata.try_load(pkgdir, strict)
+            linkage = metadata.get_linkage(dep)
+            cache.put(dep, stamp, linkage, strict)
+        result[str(dep)] = linkage
+    return result
+
+
+def linkages(pkgdir, dependencies, strict=False):
+    return retry_if_changed(_linkages, pkgdir, dependencies, strict)
+
+
 def linkage(pkgdir, dependency, strict=False):
-    metadata = Metadata.try_load(pkgdir, strict)
-    package = metadata.get_package(dependency.package)
-    return package.get_linkage(metadata, dependency.submodules)
+    return linkages(pkgdir, [dependency], strict)[str(dependency)]
 
 
-def list_files(pkgdir, implicit=False, strict=False):
-    metadata = Metadata.try_load(pkgdir, strict)
+def metadata_files(metadata, implicit=False):
     if implicit:
         return metadata.files + metadata.implicit_files
     return metadata.files
 
 
-def list_packages(pkgdir, flat=False):
-    metadata = Metadata.load(pkgdir)
+def list_files(pkgdir, implicit=False, strict=False):
+    return metadata_files(Metadata.try_load(pkgdir, strict), implicit)
 
+
+def package_tree(metadata, flat=False):
     if flat:
         return [PackageTreeItem(pkg, pkg.version(metadata)) for pkg in
                 metadata.packages.values()]
@@ -183,3 +376,28 @@ def list_packages(pkgdir, flat=False):
         else:
             packages.append(item)
     return packages
+
+
+def list_packages(pkgdir, flat=False):
+    return retry_if_changed(lambda: package_tree(Metadata.load(pkgdir), flat))
+
+
+def _get_download_cache():
+    cache = DownloadCache.from_env()
+    if cache is None:
+        raise ValueError('download cache is disabled')
+    return cache
+
+
+def list_cache():
+    return _get_download_cache().entries()
+
+
+def prune_cache(max_size=None):
+    return _get_download_cache().prune(max_size)
+
+
+def clear_cache():
+    cache = _get_download_cache()
+    cache.clear()
+    GitMirrorCache(cache.path).clear()
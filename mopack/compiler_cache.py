@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+
+from .download_cache import default_cache_dir
+from .environment import get_cmd, subprocess_run
+from .platforms import platform_name
+from .shell import quote_native
+
+__all__ = ['CompilerCache', 'compiler_cache_types', 'get_compiler_cache']
+
+# The languages whose compilers we wrap, along with their default compilers
+# (these should match what bfg9000 looks for by default).
+_compiler_vars = {'c': 'CC', 'c++': 'CXX'}
+_cmake_langs = {'c': 'C', 'c++': 'CXX'}
+
+
+def _default_compiler(lang):
+    if platform_name() == 'windows':
+        return 'cl'
+    return {'c': 'cc', 'c++': 'c++'}[lang]
+
+
+class CompilerCache:
+    # A compiler cache (e.g. ccache) used as a launcher for each compilation.
+    # Subclasses define the name of the tool, the environment variable to
+    # override its command, and the one to set the location of the cache.
+
+    name = None
+    cmdvar = None
+    dirvar = None
+    stats_args = []
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def launcher(self, env):
+        return get_cmd(env, self.cmdvar, self.name)
+
+    def env(self, env):
+        # Get the environment to build with, pointing the compiler cache to
+        # our cache directory (unless the user has already chosen one).
+        env = dict(env)
+        env.setdefault(self.dirvar, self.directory)
+        return env
+
+    def compiler_env(self, env):
+        # Get the environment to build with, as with `env` above, but also
+        # wrap the C and C++ compilers with our launcher.
+        launcher = ' '.join(quote_native(i) for i in self.launcher(env))
+        env = self.env(env)
+        for lang, var in _compiler_vars.items():
+            compiler = env.get(var, _default_compiler(lang))
+            if not compiler.startswith(launcher + ' '):
+                env[var] = launcher + ' ' + compiler
+        return env
+
+    def cmake_args(self, env):
+        launcher = ';'.join(self.launcher(env))
+        return ['-DCMAKE_{}_COMPILER_LAUNCHER={}'.format(i, launcher)
+                for i in _cmake_langs.values()]
+
+    def _read_stats(self, output):
+        raise NotImplementedError('CompilerCache._read_stats not implemented')
+
+    def stats(self, env):
+        # Get the total number of cache hits and misses so far, or None if we
+        # can't get them (e.g. if the tool isn't installed).
+        try:
+            output = subprocess_run(
+                self.launcher(env) + self.stats_args, env=self.env(env),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                check=True
+            ).stdout
+            return self._read_stats(output)
+        except (OSError, subprocess.SubprocessError, ValueError, KeyError,
+                TypeError):
+            return None
+
+
+class CCache(CompilerCache):
+    name = 'ccache'
+    cmdvar = 'CCACHE'
+    dirvar = 'CCACHE_DIR'
+    stats_args = ['--print-stats']
+
+    def _read_stats(self, output):
+        stats = {}
+        for line in output.splitlines():
+            k, v = line.split('\t', 1)
+            stats[k] = int(v)
+        return (stats['direct_cache_hit'] + stats['preprocessed_cache_hit'],
+                stats['cache_miss'])
+
+
+class SCCache(CompilerCache):
+    name = 'sccache'
+    cmdvar = 'SCCACHE'
+    dirvar = 'SCCACHE_DIR'
+    stats_args = ['--show-stats', '--stats-format=json']
+
+    def _read_stats(self, output):
+        stats = json.loads(output)['stats']
+        return (sum(stats['cache_hits']['counts'].values()),
+                sum(stats['cache_misses']['counts'].values()))
+
+
+compiler_cache_types = {i.name: i for i in (CCache, SCCache)}
+
+
+def get_compiler_cache(common_options, pkgdir):
+    # Get the compiler cache to use (if any) for the given common options. By
+    # default, the cache goes in the user-level cache directory so that it's
+    # shared by all build directories and survives `mopack clean`; if that's
+    # disabled, it goes in the package directory instead. Relative paths are
+    # relative to the package directory.
+    kind = common_options.compiler_cache
+    if not kind:
+        return None
+
+    directory = common_options.compiler_cache_dir
+    if directory:
+        directory = os.path.join(pkgdir, directory)
+    else:
+        cache_dir = default_cache_dir(common_options.env)
+        directory = (os.path.join(cache_dir, 'compiler', kind) if cache_dir
+                     else os.path.join(pkgdir, 'compiler_cache'))
+    return compiler_cache_types[kind](directory)
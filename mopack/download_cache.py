@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from .platforms import platform_name
+
+__all__ = ['CacheEntry', 'cache_dir_var', 'cache_size_var', 'DownloadCache',
+           'default_cache_dir', 'format_size', 'GitMirrorCache', 'parse_size']
+
+cache_dir_var = 'MOPACK_CACHE_DIR'
+cache_size_var = 'MOPACK_CACHE_SIZE'
+
+_size_ex = re.compile(r'^(\d+)\s*(?:([kmgt])i?)?b?$', re.IGNORECASE)
+_size_units = ['', 'K', 'M', 'G', 'T']
+
+
+def parse_size(value):
+    m = _size_ex.match(value.strip())
+    if not m:
+        raise ValueError('invalid size {!r}'.format(value))
+    size, unit = m.groups()
+    return int(size) * 1024 ** _size_units.index((unit or '').upper())
+
+
+def format_size(size):
+    for unit in _size_units[:-1]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = _size_units[-1]
+    if unit:
+        return '{:.1f} {}iB'.format(size, unit)
+    return '{} B'.format(size)
+
+
+default_max_size = parse_size('2G')
+
+# When this run started. Entries used since then may still be needed by
+# another process running concurrently, so pruning after a download skips them.
+_run_start = time.time()
+
+
+def default_cache_dir(env=os.environ):
+    if cache_dir_var in env:
+        # An empty value disables the cache.
+        return env[cache_dir_var] or None
+
+    platform = platform_name()
+    if platform == 'windows' and env.get('LOCALAPPDATA'):
+        base = env['LOCALAPPDATA']
+    elif platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = env.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'mopack')
+
+
+def _dir_size(path):
+    total = 0
+    for base, dirs, files in os.walk(path):
+        for i in files:
+            try:
+                total += os.lstat(os.path.join(base, i)).st_size
+            except FileNotFoundError:  # pragma: no cover
+                pass
+    return total
+
+
+class CacheEntry:
+    def __init__(self, key, url, checksum, path, size, last_used, *,
+                 kind='download'):
+        self.key = key
+        self.url = url
+        self.checksum = checksum
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        self.kind = kind
+
+    def dehydrate(self):
+        return {'kind': self.kind, 'url': self.url, 'checksum': self.checksum,
+                'path': self.path, 'size': self.size,
+                'last_used': self.last_used}
+
+    def __repr__(self):
+        return '<CacheEntry({!r})>'.format(self.url)
+
+
+class DownloadCache:
+    # A user-level cache of downloaded files, shared by all build directories.
+    # Each file is stored under a key derived from its URL (and checksum, if
+    # any), and the least-recently-used files are evicted once the cache grows
+    # beyond `max_size`. Git mirrors (see `GitMirrorCache`) count towards this
+    # size too, so listing and pruning entries includes them.
+
+    def __init__(self, path, max_size=default_max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @classmethod
+    def from_env(cls, env=os.environ):
+        path = default_cache_dir(env)
+        if path is None:
+            return None
+
+        size = env.get(cache_size_var)
+        return cls(path, parse_size(size) if size else default_max_size)
+
+    @property
+    def _download_dir(self):
+        return os.path.join(self.path, 'downloads')
+
+    def _data_path(self, key):
+        return os.path.join(self._download_dir, key)
+
+    def _info_path(self, key):
+        return os.path.join(self._download_dir, key + '.json')
+
+    @staticmethod
+    def key(url, checksum=None):
+        h = hashlib.sha256(url.encode('utf-8'))
+        if checksum:
+            h.update(b'\0' + checksum.encode('utf-8'))
+        return h.hexdigest()
+
+    def open(self, url, checksum=None):
+        # Open a cached file for reading, or return None if it's not cached.
+        # Once it's open, the file stays readable even if it's evicted.
+        path = self._data_path(self.key(url, checksum))
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            # Mark this entry as recently-used.
+            os.utime(path)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+        return f
+
+    @contextmanager
+    def writer(self, url, checksum=None):
+        key = self.key(url, checksum)
+        os.makedirs(self._download_dir, exist_ok=True)
+
+        # Write to a temporary file first so that other processes never see a
+        # partial download.
+        fd, tmppath = tempfile.mkstemp(prefix='.tmp-',
+                                       dir=self._download_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(tmppath, self._data_path(key))
+        except BaseException:
+            os.remove(tmppath)
+            raise
+
+        with open(self._info_path(key), 'w') as f:
+            json.dump({'url': url, 'checksum': checksum}, f)
+        self.prune(keep_since=_run_start)
+
+    def entries(self):
+        result = self._download_entries() + GitMirrorCache(self.path).entries()
+        result.sort(key=lambda i: i.last_used)
+        return result
+
+    def _download_entries(self):
+        try:
+            names = os.listdir(self._download_dir)
+        except FileNotFoundError:
+            return []
+
+        result = []
+        for key in names:
+            if key.startswith('.') or key.endswith('.json'):
+                continue
+
+            path = self._data_path(key)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # pragma: no cover
+                continue
+
+            try:
+                with open(self._info_path(key)) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                info = {}
+            result.append(CacheEntry(
+                key, info.get('url'), info.get('checksum'), path,
+                stat.st_size, stat.st_mtime
+            ))
+        return result
+
+    def remove(self, entry):
+        if entry.kind == 'git':
+            GitMirrorCache(self.path).remove(entry)
+            return
+
+        for i in (entry.path, self._info_path(entry.key)):
+            try:
+                os.remove(i)
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_size=None, *, keep_since=None):
+        # Remove the least-recently-used entries until the cache fits in
+        # `max_size`. If `keep_since` is set, keep any entries used at or after
+        # that time.
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = self.entries()
+        total = sum(i.size for i in entries)
+        removed = []
+        for i in entries:
+            if total <= max_size:
+                break
+            if keep_since is not None and i.last_used >= keep_since:
+                continue
+            self.remove(i)
+            removed.append(i)
+            total -= i.size
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self._download_dir, ignore_errors=True)
+
+
+# Mirrors currently being updated, and those already updated during this run.
+# These are shared by all `GitMirrorCache` instances so that each mirror is
+# only fetched once, even when packages are fetched concurrently.
+_mirror_lock = threading.Lock()
+_mirror_locks = {}
+_updated_mirrors = set()
+
+
+class GitMirrorCache:
+    # A user-level cache of bare mirrors of git repositories, shared by all
+    # build directories. Clones borrow objects from these mirrors so that only
+    # objects missing from the mirror need to be transferred. Each mirror is
+    # updated at most once per run. Mirrors live alongside the download cache
+    # and share its size limit.
+
+    def __init__(self, path, max_size=default_max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @classmethod
+    def from_env(cls, env=os.environ):
+        path = default_cache_dir(env)
+        if path is None:
+            return None
+
+        size = env.get(cache_size_var)
+        return cls(path, parse_size(size) if size else default_max_size)
+
+    @property
+    def _git_dir(self):
+        return os.path.join(self.path, 'git')
+
+    def mirror_path(self, repository):
+        return os.path.join(self._git_dir,
+                            DownloadCache.key(repository) + '.git')
+
+    @staticmethod
+    def _info_path(path):
+        return path + '.json'
+
+    @staticmethod
+    def _lock(path):
+        with _mirror_lock:
+            return _mirror_locks.setdefault(path, threading.Lock())
+
+    def update(self, repository, logfile, git=None, env=None):
+        if git is None:
+            git = ['git']
+        path = self.mirror_path(repository)
+        with self._lock(path):
+            if path in _updated_mirrors:
+                return path
+
+            if os.path.exists(path):
+                logfile.check_call(git + ['fetch', '--prune'], env=env,
+                                   cwd=path)
+            else:
+                # Clone to a temporary directory first so that other processes
+                # never see a partial mirror.
+                os.makedirs(self._git_dir, exist_ok=True)
+                tmppath = tempfile.mkdtemp(prefix='.tmp-', dir=self._git_dir)
+                try:
+                    logfile.check_call(git + [
+                        'clone', '--mirror', repository, tmppath,
+                    ], env=env)
+                    os.replace(tmppath, path)
+                except OSError:
+                    # Another process created this mirror at the same time.
+                    if not os.path.exists(path):
+                        raise
+                finally:
+                    shutil.rmtree(tmppath, ignore_errors=True)
+
+                with open(self._info_path(path), 'w') as f:
+                    json.dump({'url': repository}, f)
+
+            # Mark this mirror as recently-used.
+            os.utime(path)
+            _updated_mirrors.add(path)
+
+        DownloadCache(self.path, self.max_size).prune(keep_since=_run_start)
+        return path
+
+    def entries(self):
+        try:
+            names = os.listdir(self._git_dir)
+        except FileNotFoundError:
+            return []
+
+        result = []
+        for name in names:
+            if name.startswith('.') or not name.endswith('.git'):
+                continue
+
+            path = os.path.join(self._git_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # pragma: no cover
+                continue
+
+            try:
+                with open(self._info_path(path)) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                info = {}
+            result.append(CacheEntry(
+                name[:-len('.git')], info.get('url'), None, path,
+                _dir_size(path), stat.st_mtime, kind='git'
+            ))
+        return result
+
+    def remove(self, entry):
+        shutil.rmtree(entry.path, ignore_errors=True)
+        try:
+            os.remove(self._info_path(entry.path))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        shutil.rmtree(self._git_dir, ignore_errors=True)
@@ -1,11 +1,13 @@
 import os
 import json
+import signal
 import sys
 
-from . import arguments, commands, config, log, yaml_tools
+from . import arguments, commands, config, log, server, yaml_tools
 from .app_version import version
 from .environment import nested_invoke
 from .dependencies import Dependency
+from .download_cache import format_size, parse_size
 
 logger = log.getLogger(__name__)
 
@@ -23,6 +25,7 @@ project (e.g. by building them).
 linkage_desc = """
 Retrieve information about how to use a dependency. This returns metadata in
 YAML format (or JSON if `--json` is passed) pointing to a pkg-config .pc file.
+If multiple dependencies are passed, the results are keyed by dependency.
 """
 
 deploy_desc = """
@@ -42,6 +45,17 @@ list_packages_desc = """
 List all the package dependencies.
 """
 
+serve_desc = """
+Run a server that keeps the metadata for a package directory loaded in memory.
+While the server is running, `linkage`, `list-files`, and `list-packages`
+commands for that directory are answered by the server.
+"""
+
+cache_desc = """
+Inspect or prune the download cache. This cache is shared by all package
+directories for the current user.
+"""
+
 generate_completion_desc = """
 Generate shell-completion functions for mopack and write them to standard
 output. This requires the Python package `shtab`.
@@ -54,14 +68,23 @@ def resolve(parser, args):
 
     config_data = config.Config(args.file, args.options, args.deploy_dirs)
     os.environ[nested_invoke] = args.directory
-    commands.resolve(config_data, commands.get_package_dir(args.directory))
+    commands.resolve(config_data, commands.get_package_dir(args.directory),
+                     args.jobs)
 
 
 def linkage(parser, args):
     directory = os.environ.get(nested_invoke, args.directory)
+    pkgdir = commands.get_package_dir(directory)
     try:
-        linkage = commands.linkage(commands.get_package_dir(directory),
-                                   args.dependency, strict=args.strict)
+        linkage = server.query(pkgdir, 'linkage', dependencies=[
+            str(i) for i in args.dependency
+        ], strict=args.strict)
+        if linkage is None:
+            linkage = commands.linkages(pkgdir, args.dependency,
+                                        strict=args.strict)
+        # When querying a single dependency, just print its linkage.
+        if len(args.dependency) == 1:
+            linkage = linkage[str(args.dependency[0])]
     except Exception as e:
         if not args.json:
             raise
@@ -86,8 +109,12 @@ def clean(parser, args):
 
 def list_files(parser, args):
     assert nested_invoke not in os.environ
-    files = commands.list_files(commands.get_package_dir(args.directory),
-                                args.include_implicit, args.strict)
+    pkgdir = commands.get_package_dir(args.directory)
+    files = server.query(pkgdir, 'list-files', implicit=args.include_implicit,
+                         strict=args.strict)
+    if files is None:
+        files = commands.list_files(pkgdir, args.include_implicit,
+                                    args.strict)
 
     if args.json:
         print(json.dumps(files))
@@ -121,8 +148,10 @@ def list_packages(parser, args):
 
             list_level(p.children, prefix + next_prefix)
 
-    packages = commands.list_packages(commands.get_package_dir(args.directory),
-                                      args.flat)
+    pkgdir = commands.get_package_dir(args.directory)
+    packages = server.query(pkgdir, 'list-packages', flat=args.flat)
+    if packages is None:
+        packages = commands.list_packages(pkgdir, args.flat)
     if args.flat:
         for p in packages:
             print(pkg_fmt.format(package=p.package, version=get_version(p)))
@@ -130,6 +159,45 @@ def list_packages(parser, args):
         list_level(packages)
 
 
+def serve(parser, args):
+    assert nested_invoke not in os.environ
+
+    # Shut down cleanly when terminated so that we remove our socket.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    with server.Server(commands.get_package_dir(args.directory)) as s:
+        log.info('listening on {}'.format(s.server_address))
+        try:
+            s.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def cache(parser, args):
+    assert nested_invoke not in os.environ
+    if args.clear:
+        commands.clear_cache()
+        return
+
+    if args.prune:
+        entries = commands.prune_cache(args.max_size)
+        log.info('removed {} entr{} ({})'.format(
+            len(entries), 'y' if len(entries) == 1 else 'ies',
+            format_size(sum(i.size for i in entries))
+        ))
+        return
+
+    entries = commands.list_cache()
+    if args.json:
+        print(json.dumps([i.dehydrate() for i in entries]))
+    else:
+        for i in entries:
+            print('{:>10}  {}{}'.format(format_size(i.size), i.url,
+                                        ' (git)' if i.kind == 'git' else ''))
+
+
 def help(parser, args):
     parser.parse_args(args.subcommand + ['--help'])
 
@@ -195,6 +263,10 @@ def main():
                            key=['strict'], const=True, dest='options',
                            help=('return an error during linkage if package ' +
                                  'is not defined'))
+    resolve_p.add_argument('-j', '--jobs', type=arguments.positive_int,
+                           metavar='N',
+                           help=('fetch and build up to N packages at once, ' +
+                                 'running at most N build jobs in total'))
     resolve_p.add_argument('file', nargs='+', metavar='FILE', complete='file',
                            help='the mopack configuration files')
 
@@ -211,9 +283,9 @@ def main():
                            help='display results as JSON')
     linkage_p.add_argument('--strict', action='store_true',
                            help='return an error if package is not defined')
-    linkage_p.add_argument('dependency', type=Dependency,
+    linkage_p.add_argument('dependency', type=Dependency, nargs='+',
                            metavar='DEPENDENCY',
-                           help='the name of the dependency to query')
+                           help='the names of the dependencies to query')
 
     deploy_p = subparsers.add_parser(
         'deploy', description=deploy_desc, help='deploy packages'
@@ -258,6 +330,30 @@ def main():
     list_packages_p.add_argument('--flat', action='store_true',
                                  help='list packages without hierarchy')
 
+    serve_p = subparsers.add_parser(
+        'serve', description=serve_desc,
+        help='serve package data from memory'
+    )
+    serve_p.set_defaults(func=serve)
+    serve_p.add_argument('--directory', default='.', type=os.path.abspath,
+                         metavar='PATH', complete='directory',
+                         help='directory storing local package data')
+
+    cache_p = subparsers.add_parser(
+        'cache', description=cache_desc, help='manage the download cache'
+    )
+    cache_p.set_defaults(func=cache)
+    cache_action = cache_p.add_mutually_exclusive_group()
+    cache_action.add_argument('--prune', action='store_true',
+                              help='remove least-recently-used files')
+    cache_action.add_argument('--clear', action='store_true',
+                              help='remove all files')
+    cache_p.add_argument('--max-size', type=parse_size, metavar='SIZE',
+                         help=('the maximum size of the cache when pruning ' +
+                               '(default: $MOPACK_CACHE_SIZE or 2G)'))
+    cache_p.add_argument('--json', action='store_true',
+                         help='display results as JSON')
+
     help_p = subparsers.add_parser(
         'help', help='show this help message and exit', add_help=False
     )
@@ -127,13 +127,13 @@ class FreezeDried:
 
         return result
 
-    def equal(self, rhs, optional_fields=set()):
+    def equal(self, rhs, optional_fields=set(), skip_fields=set()):
         if type(self) is not type(rhs):
             return False
 
         self_vars, rhs_vars = vars(self), vars(rhs)
         for key in set(self_vars) | set(rhs_vars):
-            if self._skipped_field(key, True):
+            if key in skip_fields or self._skipped_field(key, True):
                 continue
 
             self_val = self_vars.get(key, Unset)
@@ -6,7 +6,7 @@ from itertools import zip_longest
 
 from .iterutils import iterate, list_view
 
-__all__ = ['filter_glob', 'Glob']
+__all__ = ['filter_glob', 'gitignore_pattern', 'Glob']
 
 
 class Glob:
@@ -136,3 +136,16 @@ def filter_glob(patterns, paths, **kwargs):
             if g.match(p, **kwargs):
                 yield p
                 break
+
+
+def gitignore_pattern(pattern):
+    # Convert a glob to an equivalent gitignore-style pattern, e.g. for use
+    # with `git sparse-checkout`. Unlike our globs, gitignore patterns with a
+    # slash in them are always relative to the root, so add an explicit `**`
+    # to relative patterns.
+    pattern = pattern.replace('\\', '/')
+    if pattern in ('', '/'):
+        return '/*'
+    elif pattern.startswith('/') or pattern.startswith('**/'):
+        return pattern
+    return '**/' + pattern
@@ -0,0 +1,103 @@
+import os
+import select
+import threading
+from contextlib import contextmanager
+
+from .platforms import platform_name
+
+__all__ = ['JobServer']
+
+
+class JobServer:
+    # A pool of tokens limiting the number of jobs run at once across all of
+    # our builds. Each child process we run holds a token, which serves as
+    # its "implicit" token in GNU make's jobserver protocol. On POSIX systems,
+    # the pool is a pipe shared with child processes via that protocol, so
+    # that tools which support it (e.g. make) take any extra jobs from the
+    # same pool.
+
+    def __init__(self, jobs):
+        if jobs < 1:
+            raise ValueError('jobs must be at least 1')
+
+        self.jobs = jobs
+        self._local = threading.local()
+
+        if platform_name() == 'windows':
+            self._pipe = None
+            self._tokens = threading.Semaphore(jobs)
+        else:
+            self._pipe = os.pipe()
+            os.write(self._pipe[1], b'+' * jobs)
+
+    @property
+    def pass_fds(self):
+        return self._pipe or ()
+
+    def env(self, env):
+        # Get the environment for a child process, telling any make-compatible
+        # tools where to find our jobserver.
+        if not self._pipe:
+            return env
+
+        auth = '{},{}'.format(*self._pipe)
+        env = dict(env)
+        env['MAKEFLAGS'] = ' '.join(filter(None, [
+            env.get('MAKEFLAGS'), '-j{}'.format(self.jobs),
+            '--jobserver-auth=' + auth, '--jobserver-fds=' + auth,
+        ]))
+        return env
+
+    def _get_token(self, blocking):
+        if not self._pipe:
+            return b'+' if self._tokens.acquire(blocking) else False
+
+        # Child processes may take a token between our `select` and `read`,
+        # in which case we just wait for the next one, as if we were
+        # blocking. This can't deadlock, since other jobs never wait on us.
+        if not blocking and not select.select([self._pipe[0]], [], [], 0)[0]:
+            return False
+        return os.read(self._pipe[0], 1)
+
+    def _put_token(self, token):
+        if not self._pipe:
+            self._tokens.release()
+        else:
+            os.write(self._pipe[1], token)
+
+    @contextmanager
+    def slot(self, extra=False):
+        # Wait for a job slot for the current thread, and then yield the number
+        # of jobs it's allowed to run at once. If `extra` is true, also take
+        # as many other tokens as are available, for tools that can run jobs
+        # in parallel but don't support the jobserver protocol (e.g. ninja).
+        # Nested calls on the same thread reuse the slot we already hold.
+        held = getattr(self._local, 'tokens', None)
+        if held is not None:
+            yield len(held)
+            return
+
+        tokens = self._local.tokens = [self._get_token(True)]
+        try:
+            while extra and len(tokens) < self.jobs:
+                token = self._get_token(False)
+                if token is False:
+                    break
+                tokens.append(token)
+            yield len(tokens)
+        finally:
+            del self._local.tokens
+            for i in tokens:
+                self._put_token(i)
+
+    def close(self):
+        if self._pipe:
+            for i in self._pipe:
+                os.close(i)
+            self._pipe = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .metadata import Metadata
+
+__all__ = ['LinkageCache']
+
+
+class LinkageCache:
+    # An on-disk cache of linkage results for a package directory. Each entry
+    # is stamped with the state of the metadata file it was computed from, so
+    # any change to the metadata (e.g. from `mopack resolve`) invalidates it.
+    # Looking up an entry only needs to stat the metadata file, so cache hits
+    # don't need to load the metadata at all.
+
+    cache_dirname = 'linkage_cache'
+
+    def __init__(self, pkgdir):
+        self.pkgdir = pkgdir
+
+    @property
+    def path(self):
+        return os.path.join(self.pkgdir, self.cache_dirname)
+
+    def stamp(self):
+        return Metadata.stamp(self.pkgdir)
+
+    @staticmethod
+    def key(dependency, strict=False):
+        return hashlib.sha256(json.dumps(
+            [str(dependency), strict]
+        ).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, dependency, strict):
+        return os.path.join(self.path, self.key(dependency, strict) + '.json')
+
+    def get(self, dependency, stamp, strict=False):
+        if stamp is None:
+            return None
+
+        try:
+            with open(self._entry_path(dependency, strict)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('stamp') != stamp:
+            return None
+        return entry.get('linkage')
+
+    def put(self, dependency, stamp, linkage, strict=False):
+        # `stamp` should be taken *before* loading the metadata used to compute
+        # `linkage`; that way, if the metadata changes in the meantime, this
+        # entry will just be invalidated.
+        if stamp is None:
+            return
+
+        # The cache is only an optimization, so ignore any errors writing to
+        # it (e.g. if the package directory is read-only).
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(prefix='.tmp-', dir=self.path)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'dependency': str(dependency), 'strict': strict,
+                               'stamp': stamp, 'linkage': linkage}, f)
+                os.replace(tmppath, self._entry_path(dependency, strict))
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        except OSError:
+            pass
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
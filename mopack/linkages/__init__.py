@@ -1,3 +1,4 @@
+import functools
 import importlib_metadata as metadata
 
 from ..base_options import OptionsHolder
@@ -6,9 +7,15 @@ from ..freezedried import GenericFreezeDried
 from ..types import FieldValueError, wrap_field_error
 
 
+@functools.lru_cache(maxsize=None)
+def _load_linkage_type(type):
+    # Looking up entry points is fairly slow, so only do it once per type.
+    return metadata.entry_points(group='mopack.linkages')[type].load()
+
+
 def _get_linkage_type(type, field='type'):
     try:
-        return metadata.entry_points(group='mopack.linkages')[type].load()
+        return _load_linkage_type(type)
     except KeyError:
         raise FieldValueError('unknown linkage {!r}'.format(type), field)
 
@@ -41,6 +48,11 @@ class Linkage(OptionsHolder):
     def get_linkage(self, metadata, pkg, submodules):
         raise NotImplementedError('Linkage.get_linkage not implemented')
 
+    def prepare(self, metadata, pkg):
+        # Do any work needed by `get_linkage` ahead of time (e.g. generating
+        # files) so that later calls are fast.
+        pass
+
     def __repr__(self):
         return '<{}({!r})>'.format(type(self).__name__, self.name)
 
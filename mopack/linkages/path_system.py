@@ -1,3 +1,4 @@
+import functools
 import os
 import re
 import subprocess
@@ -14,8 +15,9 @@ from ..environment import get_pkg_config, subprocess_run
 from ..freezedried import FreezeDried, GenericFreezeDried
 from ..iterutils import ismapping, issequence, listify, uniques
 from ..package_defaults import DefaultResolver
-from ..path import file_outdated, isfile, Path
-from ..pkg_config import generated_pkg_config_dir, write_pkg_config
+from ..path import file_outdated, Path
+from ..pkg_config import (generated_pkg_config_dir, make_resolver,
+                          PkgConfigFile, write_pkg_config)
 from ..placeholder import placeholder
 from ..shell import ShellArguments, split_paths
 from ..types import mangle_keywords, Unset
@@ -23,6 +25,11 @@ from ..types import mangle_keywords, Unset
 from .. import log
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_regex(ex):
+    return re.compile(ex)
+
+
 # XXX: Getting build configuration like this from the environment is a bit
 # hacky. Maybe there's a better way?
 
@@ -262,16 +269,17 @@ class PathLinkage(Linkage):
                 )
         return list(filtered.keys())
 
-    def _include_dirs(self, headers, include_path, path_vars):
+    def _include_dirs(self, metadata, headers, include_path, path_vars):
         headers = listify(headers, scalar_ok=False)
         include_path = (listify(include_path, scalar_ok=False) or
                         _system_include_path(self._common_options.env))
+        isfile = metadata.directory_cache.isfile
         return self._filter_path(
             lambda p, f: isfile(p.append(f), path_vars),
             include_path, headers, 'header', path_vars
         )
 
-    def _library_dirs(self, libraries, library_path, path_vars):
+    def _library_dirs(self, metadata, libraries, library_path, path_vars):
         library_path = (listify(library_path, scalar_ok=False)
                         or _system_lib_path(self._common_options.env))
         if self._options.common.auto_link and not libraries:
@@ -281,6 +289,7 @@ class PathLinkage(Linkage):
             return library_path
 
         lib_names = _system_lib_names(self._common_options.env)
+        isfile = metadata.directory_cache.isfile
         return self._filter_path(
             lambda p, f: any(isfile(p.append(i.format(f)), path_vars)
                              for i in lib_names),
@@ -291,11 +300,22 @@ class PathLinkage(Linkage):
     @staticmethod
     def _match_line(ex, line):
         if isinstance(ex, str):
-            m = re.search(ex, line)
+            m = _compile_regex(ex).search(line)
             line = m.group(1) if m else None
             return line is not None, line
         else:
-            return True, re.sub(ex[0], ex[1], line)
+            return True, _compile_regex(ex[0]).sub(ex[1], line)
+
+    def _extract_version(self, header):
+        with open(header) as f:
+            for line in f:
+                for ex in self.explicit_version['regex']:
+                    found, line = self._match_line(ex, line)
+                    if not found:
+                        break
+                else:
+                    return line
+        return None
 
     def _get_version(self, metadata, pkg, include_dirs, path_vars):
         if ismapping(self.explicit_version):
@@ -303,14 +323,12 @@ class PathLinkage(Linkage):
             for path in include_dirs:
                 header = path.append(version['file'])
                 try:
-                    with open(header.string(path_vars)) as f:
-                        for line in f:
-                            for ex in version['regex']:
-                                found, line = self._match_line(ex, line)
-                                if not found:
-                                    break
-                            else:
-                                return line
+                    result = metadata.version_cache.get(
+                        header.string(path_vars), version['regex'],
+                        self._extract_version
+                    )
+                    if result is not None:
+                        return result
                 except FileNotFoundError:
                     pass
             return None
@@ -322,12 +340,23 @@ class PathLinkage(Linkage):
     def version(self, metadata, pkg):
         path_values = pkg.path_values(metadata)
         include_dirs = self._include_dirs(
-            self.headers, self.include_path, path_values
+            metadata, self.headers, self.include_path, path_values
         )
         return self._get_version(metadata, pkg, include_dirs, path_values)
 
-    def _write_pkg_config(self, metadata, pkg, submodule=None, version=None,
-                          requires=[], sublinks=None, *, get_version=False):
+    @staticmethod
+    def _read_pkg_config_version(pcname, pcpath):
+        # Read the version from a .pc file we generated earlier, or return
+        # Unset if we can't.
+        try:
+            version = PkgConfigFile.read(pcname, pcpath, {}).version
+        except (OSError, UnicodeDecodeError, ValueError):
+            return Unset
+        return version or None
+
+    def _write_pkg_config(self, metadata, pkg, path_values, submodule=None,
+                          version=None, requires=[], sublinks=None, *,
+                          get_version=False):
         if sublinks is None:
             sublinks = [self]
 
@@ -335,7 +364,6 @@ class PathLinkage(Linkage):
             for i in sublinks:
                 yield from getattr(i, key)
 
-        path_values = pkg.path_values(metadata)
         pkgconfdir = generated_pkg_config_dir(metadata.pkgdir)
         pcname = str(Dependency(pkg.name, submodule))
         pcpath = os.path.join(pkgconfdir, pcname + '.pc')
@@ -345,22 +373,27 @@ class PathLinkage(Linkage):
         pkg_config_path = [pkgconfdir]
         for dep in chain(pkg.get_dependencies(submodule),
                          chain_attr('dependencies')):
-            # XXX: Cache linkage so we don't repeatedly process the same
-            # package.
-            dep_pkg = metadata.get_package(dep.package)
-            linkage = dep_pkg.get_linkage(metadata, dep.submodules)
+            linkage = metadata.get_linkage(dep)
 
             requires.extend(linkage.get('pcnames', []))
             pkg_config_path.extend(linkage.get('pkg_config_path', []))
 
         should_write = file_outdated(pcpath, metadata.path)
-
-        if should_write or get_version:
+        find_version = get_version or (should_write and version is None)
+        if get_version and not should_write:
+            # The .pc file is up to date, so we can read the version from it
+            # instead of looking for it again.
+            saved_version = self._read_pkg_config_version(pcname, pcpath)
+            if saved_version is not Unset:
+                version, find_version = saved_version, False
+
+        if should_write or find_version:
             # Get the version so we can sync it across all submodules.
             include_dirs = self._include_dirs(
-                chain_attr('headers'), chain_attr('include_path'), path_values
+                metadata, chain_attr('headers'), chain_attr('include_path'),
+                path_values
             )
-            if get_version or version is None:
+            if find_version:
                 version = self._get_version(metadata, pkg, include_dirs,
                                             path_values)
 
@@ -368,7 +401,7 @@ class PathLinkage(Linkage):
             # Generate the pkg-config data...
             libraries = list(chain_attr('libraries'))
             library_dirs = self._library_dirs(
-                libraries, chain_attr('library_path'), path_values
+                metadata, libraries, chain_attr('library_path'), path_values
             )
 
             cflags = (
@@ -396,7 +429,8 @@ class PathLinkage(Linkage):
             result['version'] = version
         return result
 
-    def get_linkage(self, metadata, pkg, submodules):
+    def get_linkage(self, metadata, pkg, submodules, quiet=False):
+        path_values = pkg.path_values(metadata)
         if submodules and self.submodule_linkage:
             pkgconfpath, requires = [], []
             version = None
@@ -407,7 +441,8 @@ class PathLinkage(Linkage):
                 sublinks = [self]
             else:
                 sublinks = []
-                data = self._write_pkg_config(metadata, pkg, get_version=True)
+                data = self._write_pkg_config(metadata, pkg, path_values,
+                                              get_version=True)
                 requires.append(data['pcname'])
                 pkgconfpath.extend(data['pkg_config_path'])
                 version = data['version']
@@ -415,18 +450,33 @@ class PathLinkage(Linkage):
             pcnames = []
             for i in submodules:
                 sublink = self._get_submodule_linkage(self._expr_symbols, i)
-                data = self._write_pkg_config(metadata, pkg, i, version,
-                                              requires, sublinks + [sublink])
+                data = self._write_pkg_config(metadata, pkg, path_values, i,
+                                              version, requires,
+                                              sublinks + [sublink])
                 pcnames.append(data['pcname'])
                 pkgconfpath.extend(data['pkg_config_path'])
         else:
-            data = self._write_pkg_config(metadata, pkg)
+            data = self._write_pkg_config(metadata, pkg, path_values)
             pcnames = [data['pcname']]
             pkgconfpath = data['pkg_config_path']
 
         return self._linkage(submodules, pcnames=pcnames,
                              pkg_config_path=uniques(pkgconfpath))
 
+    def prepare(self, metadata, pkg):
+        # Generate the .pc files for this package and all of its declared
+        # submodules in one pass, sharing the work common to all of them.
+        if isinstance(pkg.submodules, dict) and self.submodule_linkage:
+            submodules = list(pkg.submodules)
+        elif pkg.submodule_required:
+            # We don't know which submodules will be used, and there's no base
+            # .pc file to generate.
+            return
+        else:
+            submodules = None
+        # Any problems will be reported when the linkage is actually used.
+        self.get_linkage(metadata, pkg, submodules, quiet=True)
+
 
 class _SystemSubmoduleLinkage(_PathSubmoduleLinkage):
     def __init__(self, *args, pcname=None, **kwargs):
@@ -460,6 +510,16 @@ class SystemLinkage(PathLinkage):
 
     def version(self, metadata, pkg):
         pkg_config = get_pkg_config(self._common_options.env)
+
+        # Try reading the .pc file ourselves first so that we don't need to
+        # run pkg-config.
+        resolver = make_resolver(pkg_config, self._common_options.env,
+                                 metadata.pkgdir)
+        if resolver:
+            version = resolver.modversion(self.pcname)
+            if version is not None:
+                return version
+
         try:
             # XXX: Make sure this works when submodules are required.
             return subprocess_run(
@@ -470,7 +530,7 @@ class SystemLinkage(PathLinkage):
         except (OSError, subprocess.CalledProcessError):
             return super().version(metadata, pkg)
 
-    def get_linkage(self, metadata, pkg, submodules):
+    def get_linkage(self, metadata, pkg, submodules, quiet=False):
         if submodules and self.submodule_linkage:
             pcnames = [] if pkg.submodule_required else [self.pcname]
             for i in submodules:
@@ -483,6 +543,12 @@ class SystemLinkage(PathLinkage):
         env = self._common_options.env
         pkg_config = get_pkg_config(env)
         if pcnames:
+            # As above, try finding the .pc files ourselves first.
+            resolver = make_resolver(pkg_config, env, metadata.pkgdir)
+            if resolver and resolver.exists(pcnames):
+                return self._linkage(submodules, pcnames=pcnames,
+                                     pkg_config_path=[])
+
             try:
                 subprocess_run(
                     pkg_config + ['--print-errors'] + pcnames, text=True,
@@ -499,7 +565,10 @@ class SystemLinkage(PathLinkage):
                 stderr = e.stderr.strip()
                 if stderr:
                     msg += ':\n' + textwrap.indent(stderr, ' ' * 2)
-                log.warning(msg)
+                if quiet:
+                    log.debug(msg)
+                else:
+                    log.warning(msg)
             except OSError:
                 pass
         return super().get_linkage(metadata, pkg, submodules)
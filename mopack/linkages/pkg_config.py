@@ -10,6 +10,7 @@ from ..freezedried import FreezeDried, GenericFreezeDried
 from ..iterutils import listify
 from ..package_defaults import DefaultResolver
 from ..path import Path
+from ..pkg_config import make_resolver
 from ..shell import join_paths
 from ..objutils import Unset
 
@@ -117,6 +118,14 @@ class PkgConfigLinkage(Linkage):
         env = ChainMap({'PKG_CONFIG_PATH': join_paths(pkgconfpath)},
                        self._common_options.env)
 
+        # Try reading the .pc file ourselves first so that we don't need to
+        # run pkg-config.
+        resolver = make_resolver(pkg_config, env, metadata.pkgdir)
+        if resolver and self.pcname:
+            version = resolver.modversion(self.pcname)
+            if version is not None:
+                return version
+
         return subprocess_run(
             pkg_config + [self.pcname, '--modversion'], text=True, check=True,
             stdout=subprocess.PIPE, env=env
@@ -140,8 +149,7 @@ class PkgConfigLinkage(Linkage):
             sublinks = []
 
         for dep in pkg.get_dependencies(submodules):
-            dep_pkg = metadata.get_package(dep.package)
-            linkage = dep_pkg.get_linkage(metadata, dep.submodules)
+            linkage = metadata.get_linkage(dep)
             pkgconfpath.extend(linkage.get('pkg_config_path', []))
 
         pcnames = listify(self.pcname)
@@ -5,7 +5,7 @@ import shlex
 import subprocess
 import textwrap
 import warnings
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from logging import (getLogger, critical, error, warning, info,  # noqa: F401
                      debug, CRITICAL, ERROR, WARNING, INFO, DEBUG)
 
@@ -112,6 +112,7 @@ warnings.showwarning = _showwarning
 
 class LogFile:
     verbose = False
+    jobserver = None
 
     def __init__(self, file):
         self.file = file
@@ -147,6 +148,17 @@ class LogFile:
     def close(self):
         self.file.close()
 
+    def jobs(self):
+        # Reserve as many job slots as we can for a parallel build tool that
+        # doesn't support the jobserver protocol, yielding how many jobs it may
+        # run at once (or None if there's no jobserver).
+        if self.jobserver:
+            return self.jobserver.slot(extra=True)
+        return nullcontext()
+
+    def message(self, message):
+        self._print_verbose(message, flush=True)
+
     def check_call(self, args, *, env, **kwargs):
         command = ' '.join(shlex.quote(i) for i in args)
         if 'stdin' in kwargs:
@@ -154,16 +166,22 @@ class LogFile:
             command += ' < {}'.format(getattr(stdin, 'name', stdin))
         self._print_verbose('$ ' + command, flush=True)
 
+        jobserver = self.jobserver
+        if jobserver:
+            env = jobserver.env(env)
+            kwargs['pass_fds'] = jobserver.pass_fds
+
         proc = None
         try:
-            proc = subprocess.Popen(
-                args, text=True, stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT, env=nest_env(env), **kwargs
-            )
-            with proc.stdout:
-                while proc.poll() is None:
-                    self._print_verbose(proc.stdout.readline(), end='')
-                self._print_verbose(proc.stdout.read(), end='')
+            with jobserver.slot() if jobserver else nullcontext():
+                proc = subprocess.Popen(
+                    args, text=True, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, env=nest_env(env), **kwargs
+                )
+                with proc.stdout:
+                    while proc.poll() is None:
+                        self._print_verbose(proc.stdout.readline(), end='')
+                    self._print_verbose(proc.stdout.read(), end='')
         except Exception as e:
             print(str(e), file=self.file)
             raise type(e)("Command '{}' failed:\n{}".format(
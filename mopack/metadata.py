@@ -1,36 +1,265 @@
+import hashlib
+import io
 import json
 import os
+import pickle
+import tempfile
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from urllib.parse import quote
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .app_version import version as app_version
 from .config import Options
-from .freezedried import DictToList, auto_dehydrate, rehydrate
+from .freezedried import auto_dehydrate, rehydrate
 from .origins import Package
 from .origins.system import fallback_system_package
+from .path import DirectoryCache
+from .version_cache import VersionCache
 from .yaml_tools import MarkedJSONEncoder
 
-_PackageList = DictToList[Package, lambda x: x.name]
+_unloaded = object()
 
 
 class MetadataVersionError(RuntimeError):
     pass
 
 
+class MetadataChangedError(RuntimeError):
+    pass
+
+
+def retry_if_changed(fn, *args, retries=3, **kwargs):
+    # Packages are loaded lazily, so a writer may remove the records for the
+    # index we read before we get to them. In that case, try again; `fn` should
+    # load the metadata itself so that it reads the new index.
+    for i in range(retries):
+        try:
+            return fn(*args, **kwargs)
+        except MetadataChangedError:
+            if i == retries - 1:
+                raise
+
+
+class _LazyPackages(MutableMapping):
+    # A mapping of package names to packages that only loads each package
+    # when it's first looked up. This way, commands like `mopack linkage` only
+    # need to rehydrate the packages they actually use.
+
+    def __init__(self, names, load):
+        self._items = dict.fromkeys(names, _unloaded)
+        self._load = load
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if value is _unloaded:
+            value = self._items[key] = self._load(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+
+    def __delitem__(self, key):
+        del self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '<{}({!r})>'.format(type(self).__name__, list(self._items))
+
+
+def _sync_dir(path):
+    # Make sure a rename in `path` survives a crash. Not every platform lets
+    # us open a directory, but those that don't need this anyway.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # pragma: no cover
+        return
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path, data):
+    # Write to a temporary file and then move it into place so that readers
+    # never see a partially-written file, even if we crash partway through.
+    fd, tmppath = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+@contextmanager
+def _write_lock(path):
+    # Only one process can write the metadata at a time. Readers never take
+    # this lock; they rely on the index being replaced atomically instead.
+    with open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _dump_package(package):
+    return json.dumps(auto_dehydrate(package, Package), cls=MarkedJSONEncoder,
+                      sort_keys=True)
+
+
+def _record_filename(name, record):
+    return '{}-{}.json'.format(
+        quote(name, safe=''),
+        hashlib.sha256(record.encode('utf-8')).hexdigest()[:16]
+    )
+
+
+# Binary records hold a pickled copy of a package, which loads much faster
+# than rehydrating its JSON record field by field. Since pickles depend on the
+# exact layout of our classes, they're only used by the same version of mopack
+# that wrote them; otherwise, we fall back to the JSON records.
+binary_version = 1
+
+
+def _binary_filename(filename):
+    return os.path.splitext(filename)[0] + '.pickle'
+
+
+def _binary_header():
+    return ('mopack', binary_version, app_version)
+
+
+def _shared_objects(options):
+    # Packages share the metadata's options (and the environment held in
+    # them), so binary records store references to these instead of copies.
+    return {'options': options, 'env': options.common.env}
+
+
+class _BinaryPickler(pickle.Pickler):
+    def __init__(self, file, options):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._shared = {id(v): k for k, v in _shared_objects(options).items()}
+
+    def persistent_id(self, obj):
+        return self._shared.get(id(obj))
+
+
+class _BinaryUnpickler(pickle.Unpickler):
+    def __init__(self, file, options):
+        super().__init__(file)
+        self._shared = _shared_objects(options)
+
+    def persistent_load(self, pid):
+        try:
+            return self._shared[pid]
+        except KeyError:
+            raise pickle.UnpicklingError('unknown persistent id {!r}'
+                                         .format(pid))
+
+
+def _dump_binary(package, options):
+    f = io.BytesIO()
+    pickler = _BinaryPickler(f, options)
+    pickler.dump(_binary_header())
+    pickler.dump(package)
+    return f.getvalue()
+
+
+def _load_binary(f, options):
+    unpickler = _BinaryUnpickler(f, options)
+    if unpickler.load() != _binary_header():
+        return None
+    return unpickler.load()
+
+
 class Metadata:
+    # The metadata is stored as a small index file holding the options and a
+    # table of package records in `packages_dirname`. Records are named after
+    # their contents and never modified, so saving only needs to write the
+    # packages that have changed and then atomically replace the index. This
+    # way, a reader always sees a consistent snapshot (and a crash leaves the
+    # previous one in place) without having to wait on a writer.
+
     metadata_filename = 'mopack.json'
-    version = 4
+    packages_dirname = 'metadata'
+    lock_filename = 'mopack.lock'
+    version = 5
+
+    # Whether to store (and load) binary copies of package records.
+    binary_records = True
 
     def __init__(self, pkgdir, options=None, files=None, implicit_files=None):
-        self.pkgdir = pkgdir
-        self.options = options or Options.default()
-        self.files = files or []
-        self.implicit_files = implicit_files or []
+        self._init_state(pkgdir, options or Options.default(), files or [],
+                         implicit_files or [])
         self.packages = {}
+        self._records = {}
+
+    def _init_state(self, pkgdir, options, files, implicit_files):
+        # Set up everything but the packages, which `load()` fills in lazily.
+        self.pkgdir = pkgdir
+        self.options = options
+        self.files = files
+        self.implicit_files = implicit_files
+        self.directory_cache = DirectoryCache()
+        self.version_cache = VersionCache(pkgdir)
+        self.artifact_cache = None
+        self._linkages = {}
+        self._dirty = set()
 
     @property
     def path(self):
         return os.path.join(self.pkgdir, self.metadata_filename)
 
+    @property
+    def packages_path(self):
+        return os.path.join(self.pkgdir, self.packages_dirname)
+
+    @classmethod
+    def stamp(cls, pkgdir):
+        # Get a cheap fingerprint of the saved metadata for `pkgdir` that
+        # changes whenever it's rewritten, or None if there is no metadata.
+        # Saving replaces the index with a new file, so we include its inode in
+        # case its size and modification time are unchanged. We also include
+        # the modification time of the records directory, which changes
+        # whenever records are added or removed.
+        try:
+            stat = os.stat(os.path.join(pkgdir, cls.metadata_filename))
+        except FileNotFoundError:
+            return None
+
+        try:
+            records_mtime = os.stat(os.path.join(
+                pkgdir, cls.packages_dirname
+            )).st_mtime_ns
+        except FileNotFoundError:
+            records_mtime = None
+        return [stat.st_ino, stat.st_mtime_ns, stat.st_size, records_mtime]
+
     def add_package(self, package):
         self.packages[package.name] = package
+        self.mark_dirty(package)
+
+    def mark_dirty(self, *packages):
+        # Note that these packages have changed, so that the next save writes
+        # new records for them. Any other package keeps its existing record.
+        self._dirty.update(i.name for i in packages)
 
     def get_package(self, name):
         if name in self.packages:
@@ -45,10 +274,75 @@ class Metadata:
                              .format(name))
         return package
 
+    def get_linkage(self, dependency):
+        # Linkage results only depend on the metadata, so remember them. That
+        # way, dependencies shared by several packages only get processed once.
+        key = str(dependency)
+        if key not in self._linkages:
+            package = self.get_package(dependency.package)
+            self._linkages[key] = package.get_linkage(self,
+                                                      dependency.submodules)
+        return self._linkages[key]
+
+    def _save_packages(self):
+        os.makedirs(self.packages_path, exist_ok=True)
+
+        records = {}
+        for name in self.packages:
+            if name in self._records and name not in self._dirty:
+                # This package hasn't changed since we last saved (or loaded)
+                # it, so we don't need to serialize it again.
+                records[name] = self._records[name]
+                continue
+
+            record = _dump_package(self.packages[name])
+            filename = _record_filename(name, record)
+            path = os.path.join(self.packages_path, filename)
+            if filename != self._records.get(name):
+                if not os.path.exists(path):
+                    _write_atomic(path, record)
+                if self.binary_records:
+                    self._save_binary(path, self.packages[name])
+            records[name] = filename
+        return records
+
+    def _save_binary(self, path, package):
+        binpath = _binary_filename(path)
+        if not os.path.exists(binpath):
+            _write_atomic(binpath, _dump_binary(package, self.options))
+
+    def _read_index(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _collect_garbage(self, records, old_state):
+        # Remove any records that aren't referenced by the new index. We also
+        # keep the ones from the previous index so that readers that loaded it
+        # just before we replaced it can still find its records.
+        keep = set(records.values())
+        if old_state and old_state.get('version') == self.version:
+            keep.update(old_state['metadata']['packages'].values())
+
+        for i in os.listdir(self.packages_path):
+            if os.path.splitext(i)[0] + '.json' not in keep:
+                try:
+                    os.remove(os.path.join(self.packages_path, i))
+                except FileNotFoundError:  # pragma: no cover
+                    pass
+
     def save(self):
         os.makedirs(self.pkgdir, exist_ok=True)
-        with open(os.path.join(self.path), 'w') as f:
-            json.dump({
+        with _write_lock(os.path.join(self.pkgdir, self.lock_filename)):
+            old_state = self._read_index()
+            records = self._save_packages()
+            _sync_dir(self.packages_path)
+
+            # Write the index last; replacing it is what commits the new
+            # records.
+            _write_atomic(self.path, json.dumps({
                 'version': self.version,
                 'config_files': {
                     'explicit': self.files,
@@ -56,9 +350,41 @@ class Metadata:
                 },
                 'metadata': {
                     'options': self.options.dehydrate(),
-                    'packages': auto_dehydrate(self.packages, _PackageList),
+                    'packages': records,
                 }
-            }, f, cls=MarkedJSONEncoder)
+            }, cls=MarkedJSONEncoder))
+            _sync_dir(self.pkgdir)
+
+            self._records = records
+            self._dirty.clear()
+            self._collect_garbage(records, old_state)
+
+    def _load_binary(self, path):
+        try:
+            with open(_binary_filename(path), 'rb') as f:
+                return _load_binary(f, self.options)
+        except Exception:
+            # Binary records are just a faster copy of the JSON records, so if
+            # we can't read one for any reason, use the JSON record instead.
+            return None
+
+    def _load_package(self, name, version):
+        path = os.path.join(self.packages_path, self._records[name])
+        if self.binary_records and version == self.version:
+            package = self._load_binary(path)
+            if package is not None:
+                return package
+
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            raise MetadataChangedError(
+                'metadata for {!r} changed while loading package {!r}; try '
+                'again'.format(self.pkgdir, name)
+            )
+        return rehydrate(record, Package, _options=self.options,
+                         _global_version=version)
 
     @classmethod
     def load(cls, pkgdir, strict=False):
@@ -87,20 +413,31 @@ class Metadata:
                 if 'usage' in pkg:
                     pkg['linkage'] = pkg.pop('usage')
 
-        metadata = Metadata.__new__(Metadata)
-        metadata.pkgdir = pkgdir
-        metadata.files = state['config_files']['explicit']
-        metadata.implicit_files = state['config_files']['implicit']
-
-        metadata.options = Options.rehydrate(
-            data['options'], _global_version=version
-        )
+        options = Options.rehydrate(data['options'], _global_version=version)
         if strict:
-            metadata.options.common.strict = True
+            options.common.strict = True
+
+        metadata = Metadata.__new__(Metadata)
+        metadata._init_state(pkgdir, options,
+                             state['config_files']['explicit'],
+                             state['config_files']['implicit'])
 
-        metadata.packages = rehydrate(data['packages'], _PackageList,
-                                      _options=metadata.options,
-                                      _global_version=version)
+        # Packages are only rehydrated when they're first used.
+        if version < 5:
+            # v5 moves each package into its own record, named after its
+            # contents.
+            saved = {i['name']: i for i in data['packages']}
+            metadata._records = {}
+            metadata.packages = _LazyPackages(saved, lambda name: rehydrate(
+                saved[name], Package, _options=metadata.options,
+                _global_version=version
+            ))
+        else:
+            metadata._records = data['packages']
+            metadata.packages = _LazyPackages(
+                metadata._records,
+                lambda name: metadata._load_package(name, version)
+            )
 
         return metadata
 
@@ -53,8 +53,11 @@ def memoize(fn):
     return wrapper
 
 
+memoize_method_prefix = '_memoize_cache_'
+
+
 def memoize_method(fn):
-    cachename = '_memoize_cache_{}'.format(fn.__name__)
+    cachename = memoize_method_prefix + fn.__name__
 
     @functools.wraps(fn)
     def wrapper(self, *args, **kwargs):
@@ -4,6 +4,7 @@ from copy import deepcopy
 from . import types
 from .base_options import BaseOptions
 from .builders import BuilderOptions, make_builder_options
+from .compiler_cache import compiler_cache_types
 from .environment import Environment, env_as_flag
 from .freezedried import DictToList, FreezeDried
 from .objutils import memoize_method
@@ -76,7 +77,7 @@ class ExprSymbols(dict):
 class CommonOptions(FreezeDried, BaseOptions):
     _context = 'while adding common options'
     type = 'common'
-    _version = 2
+    _version = 3
 
     @staticmethod
     def upgrade(config, version):
@@ -84,12 +85,18 @@ class CommonOptions(FreezeDried, BaseOptions):
         if version < 2:  # pragma: no cover
             config['auto_link'] = False
 
+        # v3 adds `compiler_cache` and `compiler_cache_dir`.
+        if version < 3:
+            config.update(compiler_cache=None, compiler_cache_dir=None)
+
         return config
 
     def __init__(self, deploy_dirs=None):
         self.strict = Unset
         self.target_platform = Unset
         self.auto_link = Unset
+        self.compiler_cache = Unset
+        self.compiler_cache_dir = Unset
         self.env = {}
         self.deploy_dirs = deploy_dirs or {}
         self._finalized = False
@@ -108,7 +115,8 @@ class CommonOptions(FreezeDried, BaseOptions):
                     env[k] = v
         return env
 
-    def __call__(self, *, strict=None, target_platform=Unset, env=None):
+    def __call__(self, *, strict=None, target_platform=Unset,
+                 compiler_cache=Unset, compiler_cache_dir=Unset, env=None):
         if self._finalized:
             raise RuntimeError('options are already finalized')
 
@@ -117,6 +125,12 @@ class CommonOptions(FreezeDried, BaseOptions):
             T.strict(types.boolean)
         if self.target_platform is Unset:
             T.target_platform(types.maybe(types.string))
+        if self.compiler_cache is Unset:
+            T.compiler_cache(types.maybe_raw(
+                types.constant(*compiler_cache_types)
+            ))
+        if self.compiler_cache_dir is Unset:
+            T.compiler_cache_dir(types.maybe_raw(types.string))
         T.env(types.maybe(types.dict_of(types.string, types.string)),
               reducer=self._fill_env)
 
@@ -140,6 +154,10 @@ class CommonOptions(FreezeDried, BaseOptions):
             self.strict = False
         if not self.target_platform:
             self.target_platform = platform_name()
+        if self.compiler_cache is Unset:
+            self.compiler_cache = None
+        if self.compiler_cache_dir is Unset:
+            self.compiler_cache_dir = None
         self._fill_env(self.env, os.environ)
         # Set `auto_link` from the environment. XXX: This is a bit awkward and
         # could probably use a better method.
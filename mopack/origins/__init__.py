@@ -1,4 +1,7 @@
+import functools
+import hashlib
 import importlib_metadata as metadata
+import json
 import os
 import warnings
 from typing import Dict, List, Union
@@ -10,14 +13,22 @@ from ..dependencies import Dependency
 from ..freezedried import GenericFreezeDried
 from ..iterutils import iterate, listify
 from ..linkages import Linkage, make_linkage
+from ..objutils import memoize_method_prefix
 from ..package_defaults import DefaultResolver
 from ..types import (FieldKeyError, FieldValueError, try_load_config,
                      wrap_field_error, Unset)
+from ..yaml_tools import MarkedJSONEncoder
+
+
+@functools.lru_cache(maxsize=None)
+def _load_origin_type(origin):
+    # Looking up entry points is fairly slow, so only do it once per type.
+    return metadata.entry_points(group='mopack.origins')[origin].load()
 
 
 def _get_origin_type(origin, field='origin'):
     try:
-        return metadata.entry_points(group='mopack.origins')[origin].load()
+        return _load_origin_type(origin)
     except KeyError:
         raise FieldValueError('unknown origin {!r}'.format(origin), field)
 
@@ -32,6 +43,7 @@ class Package(OptionsHolder):
     _default_genus = 'origin'
     _type_field = 'origin'
     _get_type = _get_origin_type
+    _transient_fields = {'_fingerprint', '_artifact_key'}
 
     Options = None
 
@@ -129,6 +141,12 @@ class Package(OptionsHolder):
         return (self.clean_pre(metadata, new_package, quiet),
                 self.clean_post(metadata, new_package, quiet))
 
+    def prefetch(self, metadata):
+        # Perform any slow work needed before `fetch()` (e.g. downloading
+        # sources). This may run concurrently with other packages' prefetches,
+        # so it must not touch any shared state, such as the parent config.
+        pass
+
     def fetch(self, metadata, parent_config):
         pass  # pragma: no cover
 
@@ -143,6 +161,76 @@ class Package(OptionsHolder):
             metadata, self, self._check_submodules(submodules)
         )
 
+    def prepare_linkage(self, metadata):
+        self.linkage.prepare(metadata, self)
+
+    def dependency_names(self, metadata):
+        # Get the names of all the packages that need to be resolved before
+        # this one: its own dependencies (for all of its submodules), plus any
+        # packages defined in its mopack config.
+        submodules = (list(self.submodules)
+                      if isinstance(self.submodules, dict) else None)
+        result = {i.package for i in self.get_dependencies(submodules)}
+        result.update(i.name for i in metadata.packages.values()
+                      if i.parent == self.name)
+        return result
+
+    def _fingerprint_data(self, metadata, portable=False):
+        config = self.dehydrate()
+        for i in ('resolved', 'fingerprint'):
+            config.pop(i, None)
+        if portable:
+            # The location of the config file doesn't affect the build.
+            config.pop('config_file', None)
+        return {'config': config}
+
+    def _compute_hash(self, metadata, attr, portable):
+        if not hasattr(self, attr):
+            # Guard against cyclic dependencies.
+            setattr(self, attr, None)
+
+            dependencies = {}
+            for i in sorted(self.dependency_names(metadata)):
+                dep = metadata.packages.get(i)
+                dependencies[i] = (dep._compute_hash(metadata, attr, portable)
+                                   if dep else None)
+
+            data = self._fingerprint_data(metadata, portable)
+            data['dependencies'] = dependencies
+            setattr(self, attr, hashlib.sha256(json.dumps(
+                data, sort_keys=True, cls=MarkedJSONEncoder
+            ).encode('utf-8')).hexdigest())
+        return getattr(self, attr)
+
+    def compute_fingerprint(self, metadata):
+        # Get a hash of everything that affects the result of resolving this
+        # package, including the fingerprints of its dependencies. This is
+        # only computed once per package object.
+        return self._compute_hash(metadata, '_fingerprint', False)
+
+    def forget_fingerprint(self):
+        # Discard our memoized fingerprint so that the next call to
+        # `compute_fingerprint` sees the current state of the package.
+        self.__dict__.pop('_fingerprint', None)
+
+    def compute_artifact_key(self, metadata):
+        # Like `compute_fingerprint`, but only depending on things that are the
+        # same for any build directory (e.g. the contents of source files
+        # rather than their modification times).
+        return self._compute_hash(metadata, '_artifact_key', True)
+
+    def pending_artifact_key(self, metadata):
+        # Get the key of the artifact that resolving this package would use,
+        # or None if it wouldn't use one.
+        return None
+
+    def __getstate__(self):
+        # Don't pickle any state that's only used while resolving, including
+        # memoized results, which may not hold the next time we run.
+        return {k: v for k, v in vars(self).items()
+                if k not in self._transient_fields and
+                not k.startswith(memoize_method_prefix)}
+
     def __repr__(self):
         return '<{}({!r})>'.format(type(self).__name__, self.name)
 
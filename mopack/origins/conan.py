@@ -10,7 +10,6 @@ from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
 from ..iterutils import uniques
 from ..objutils import Unset
-from ..path import pushd
 from ..shell import ShellArguments
 
 
@@ -150,13 +149,12 @@ class ConanPackage(ManagedBinaryPackage, BatchPackage):
         # the same command in Conan 1.x and 2.x and still get the generated
         # files in the right place. Maybe it would be better to use different
         # command arguments depending on Conan's version.
-        with log.LogFile.open(metadata.pkgdir, 'conan') as logfile, \
-             pushd(conandir):
+        with log.LogFile.open(metadata.pkgdir, 'conan') as logfile:
             logfile.check_call(
                 conan + ['install'] +
                 cls._build_opts(uniques(options.build + build)) +
                 options.extra_args.args() + ['--', conandir],
-                env=env
+                env=env, cwd=conandir
             )
 
         super(ConanPackage, cls).resolve_all(metadata, packages)
@@ -1,9 +1,11 @@
+import hashlib
 import os
 import shutil
 import subprocess
+import tempfile
+import time
 import warnings
 from contextlib import contextmanager
-from io import BytesIO
 from typing import Dict, List, Union
 from urllib.request import urlopen
 
@@ -13,29 +15,88 @@ from . import UnmanagedPackage, dependencies_type
 from .submodules import *
 from .. import archive, log, types
 from ..builders import Builder, make_builder
+from ..compiler_cache import get_compiler_cache
 from ..config import ChildConfig
+from ..download_cache import DownloadCache, format_size, GitMirrorCache
 from ..environment import get_cmd
 from ..freezedried import GenericFreezeDried
-from ..glob import filter_glob
+from ..glob import filter_glob, gitignore_pattern
 from ..iterutils import flatten, isiterable, listify
 from ..linkages import make_linkage
 from ..log import LogFile
 from ..objutils import memoize_method, Unset
 from ..options import DuplicateSymbolError
 from ..package_defaults import DefaultResolver
-from ..path import Path, pushd
+from ..path import Path
 from ..placeholder import MaybePlaceholderString
+from ..platforms import peak_memory
 from ..shell import detect_version
 from ..types import FieldValueError
 from ..yaml_tools import to_parse_error
 
 
+# Environment variables that commonly affect how a package is built.
+# Fingerprints and artifact keys only include these (along with the package's
+# and builders' own `env`), since the rest of the environment varies between
+# users, machines, and even shell sessions.
+_build_env = {
+    # Compilers and build tools
+    'AR', 'AS', 'CC', 'CPP', 'CXX', 'LD', 'NM', 'RANLIB', 'STRIP', 'WINDRES',
+    'B2', 'BFG9000', 'CMAKE', 'NINJA', 'PKG_CONFIG',
+    # Compiler flags
+    'ARFLAGS', 'ASFLAGS', 'CFLAGS', 'CPPFLAGS', 'CXXFLAGS', 'LDFLAGS',
+    'LDLIBS',
+    # Search paths
+    'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'LIBRARY_PATH', 'INCLUDE',
+    'LIB', 'LIBPATH', 'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_PATH',
+    'PKG_CONFIG_SYSROOT_DIR',
+    # Compiler caches
+    'CCACHE', 'SCCACHE',
+}
+
+
+def _source_state(srcdir, exclude=(), contents=False):
+    # Hash the name, size, and mtime of every file under `srcdir` (skipping
+    # any directories in `exclude` and version control metadata). This lets
+    # us detect when any of the sources have changed without reading them. If
+    # `contents` is true, hash the contents of each file instead of its mtime
+    # so that identical copies of the sources get the same hash.
+    exclude = {os.path.normcase(os.path.abspath(i)) for i in exclude}
+    state = hashlib.sha256()
+    for root, dirs, files in os.walk(srcdir):
+        dirs[:] = sorted(i for i in dirs if i != '.git' and (
+            os.path.normcase(os.path.abspath(os.path.join(root, i)))
+            not in exclude
+        ))
+        for i in sorted(files):
+            path = os.path.join(root, i)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state.update('{}\0{}\0'.format(
+                os.path.relpath(path, srcdir), stat.st_size
+            ).encode('utf-8', 'surrogateescape'))
+            if contents:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(65536), b''):
+                        state.update(chunk)
+            else:
+                state.update('{}\0'.format(stat.st_mtime_ns).encode('utf-8'))
+    return state.hexdigest()
+
+
 @GenericFreezeDried.fields(rehydrate={
     'env': Dict[str, MaybePlaceholderString],
     'submodules': Union[str, Dict[str, UnmanagedSubmoduleProps]],
     'builders': List[Builder]
-}, skip_compare={'pkg_default', 'pending_builders', 'pending_linkage'})
+}, skip_compare={'pkg_default', 'pending_builders', 'pending_linkage',
+                 'fingerprint'})
 class SDistPackage(UnmanagedPackage):
+    _transient_fields = UnmanagedPackage._transient_fields | {
+        '_prefetch_error'
+    }
+
     # TODO: Remove `usage` after v0.2 is released.
     def __init__(self, name, *, env=None, dependencies=Unset, submodules=Unset,
                  submodule_required=Unset, build=Unset, linkage=Unset,
@@ -73,6 +134,7 @@ class SDistPackage(UnmanagedPackage):
 
         self.pending_builders = build
         self.pending_linkage = linkage
+        self.fingerprint = None  # Set in resolve().
 
     @property
     def _finalized(self):
@@ -257,6 +319,31 @@ class SDistPackage(UnmanagedPackage):
         del self.pending_linkage
         return config
 
+    def _fetch_sources(self, metadata):
+        pass
+
+    def prefetch(self, metadata):
+        # Save any errors so that they're raised from `fetch()` instead. That
+        # way, errors are reported in the same order as with a serial fetch.
+        try:
+            self._fetch_sources(metadata)
+            self._prefetch_error = None
+        except Exception as e:
+            self._prefetch_error = e
+
+    def _ensure_sources(self, metadata):
+        if hasattr(self, '_prefetch_error'):
+            error = self._prefetch_error
+            del self._prefetch_error
+            if error:
+                raise error
+        else:
+            self._fetch_sources(metadata)
+
+    def fetch(self, metadata, parent_config):
+        self._ensure_sources(metadata)
+        return self._find_mopack(parent_config, self._srcdir(metadata))
+
     def _needs_clean(self, new_package):
         # We need to clean this package if there are any differences. Unset
         # optional fields aren't real differences though: they get filled in by
@@ -267,6 +354,9 @@ class SDistPackage(UnmanagedPackage):
 
     def clean_post(self, metadata, new_package, quiet=False):
         if self == new_package:
+            # Since our builds are still valid for the new package, pass our
+            # fingerprint on so that it can tell if it needs to rebuild.
+            new_package.fingerprint = self.fingerprint
             return False
 
         if not quiet:
@@ -275,12 +365,112 @@ class SDistPackage(UnmanagedPackage):
             i.clean(metadata, self)
         return True
 
+    def _fingerprint_data(self, metadata, portable=False):
+        result = super()._fingerprint_data(metadata, portable)
+
+        options = self._options.dehydrate()
+        common = options['common']
+        common['env'] = {k: v for k, v in common['env'].items()
+                         if k in _build_env}
+        if portable:
+            # The location of the compiler cache doesn't affect the build.
+            common.pop('compiler_cache_dir', None)
+        result['options'] = options
+
+        srcdir = self._srcdir(metadata)
+        result['sources'] = (
+            _source_state(srcdir, [metadata.pkgdir], contents=portable)
+            if srcdir else None
+        )
+        if not portable:
+            # Record which of our build outputs exist so that we rebuild if
+            # one that the last build produced is removed. Not every builder
+            # creates all of its outputs (e.g. custom builders that build in
+            # the source directory), so we can't just require all of them.
+            result['outputs'] = {i: os.path.exists(i)
+                                 for i in self._build_outputs(metadata)}
+        return result
+
+    def _build_outputs(self, metadata):
+        base_values = self.path_values(metadata, with_builders=False)
+        return [v for k, v in self.path_values(metadata).items()
+                if k not in base_values]
+
+    def _restore_artifact(self, metadata, cache, key):
+        try:
+            return cache.restore(key, metadata.pkgdir)
+        except Exception as e:
+            log.warning('unable to restore artifact for {!r}: {}'
+                        .format(self.name, e))
+            return False
+
+    def _store_artifact(self, metadata, cache, key):
+        try:
+            cache.store(key, metadata.pkgdir, self._build_outputs(metadata))
+        except Exception as e:
+            log.warning('unable to store artifact for {!r}: {}'
+                        .format(self.name, e))
+
+    @contextmanager
+    def _report_compiler_cache(self, metadata):
+        # Log how many compilations hit the compiler cache during our build.
+        # The cache may be shared with other builds, so these numbers are only
+        # approximate when building concurrently.
+        cache = get_compiler_cache(self._common_options, metadata.pkgdir)
+        if not cache or not self.builders:
+            yield
+            return
+
+        env = self._common_options.env
+        before = cache.stats(env)
+        yield
+        after = cache.stats(env)
+        if before and after:
+            with LogFile.open(metadata.pkgdir, self.name) as logfile:
+                logfile.message(
+                    'compiler cache ({}): {} hits, {} misses'.format(
+                        cache.name, after[0] - before[0], after[1] - before[1]
+                    )
+                )
+
+    def _up_to_date(self, metadata):
+        return self.compute_fingerprint(metadata) == self.fingerprint
+
+    def pending_artifact_key(self, metadata):
+        if not self._build_outputs(metadata) or self._up_to_date(metadata):
+            return None
+        return self.compute_artifact_key(metadata)
+
     def resolve(self, metadata):
-        log.pkg_resolve(self.name)
-        for i in self.builders:
-            i.build(metadata, self)
+        if self._up_to_date(metadata):
+            log.pkg_resolve(self.name, 'already up to date')
+            super().resolve(metadata)
+            return
+
+        # Forget our old fingerprint until we've finished building so that an
+        # interrupted build isn't considered up to date.
+        self.fingerprint = None
+
+        # Only use the artifact cache if our builders produce any outputs.
+        cache = (metadata.artifact_cache if self._build_outputs(metadata)
+                 else None)
+        key = self.compute_artifact_key(metadata) if cache else None
+        if cache and self._restore_artifact(metadata, cache, key):
+            log.pkg_resolve(self.name, 'from artifact cache')
+        else:
+            log.pkg_resolve(self.name)
+            with self._report_compiler_cache(metadata):
+                for i in self.builders:
+                    i.build(metadata, self)
+            if cache:
+                self._store_artifact(metadata, cache, key)
         super().resolve(metadata)
 
+        # Record the state of our sources *after* building, since in-source
+        # builds add their outputs to the source directory.
+        self.forget_fingerprint()
+        self.fingerprint = self.compute_fingerprint(metadata)
+
     def deploy(self, metadata):
         if self.should_deploy:
             log.pkg_deploy(self.name)
@@ -291,7 +481,7 @@ class SDistPackage(UnmanagedPackage):
 @GenericFreezeDried.fields(rehydrate={'path': Path})
 class DirectoryPackage(SDistPackage):
     origin = 'directory'
-    _version = 4
+    _version = 5
 
     @staticmethod
     def upgrade(config, version):
@@ -307,6 +497,10 @@ class DirectoryPackage(SDistPackage):
         if version < 4:
             migrate_saved_submodules(config)
 
+        # v5 adds the `fingerprint` field.
+        if version < 5:
+            config['fingerprint'] = None
+
         return config
 
     def __init__(self, name, *, path, **kwargs):
@@ -318,17 +512,20 @@ class DirectoryPackage(SDistPackage):
     def _srcdir(self, metadata):
         return self.path.string({'cfgdir': self.config_dir})
 
-    def fetch(self, metadata, parent_config):
-        path = self.path.string({'cfgdir': self.config_dir})
-        log.pkg_fetch(self.name, 'from {}'.format(path))
-        return self._find_mopack(parent_config, path)
+    def _fetch_sources(self, metadata):
+        log.pkg_fetch(self.name, 'from {}'.format(self._srcdir(metadata)))
 
 
-@GenericFreezeDried.fields(rehydrate={'path': Path},
-                           skip_compare={'guessed_srcdir'})
+_download_chunk_size = 1024 * 1024
+_checksum_algorithms = ('sha256', 'sha512')
+
+
+@GenericFreezeDried.fields(rehydrate={'path': Path}, skip_compare={
+    'guessed_srcdir', 'verified_checksum',
+})
 class TarballPackage(SDistPackage):
     origin = 'tarball'
-    _version = 4
+    _version = 6
 
     @staticmethod
     def upgrade(config, version):
@@ -344,15 +541,25 @@ class TarballPackage(SDistPackage):
         if version < 4:
             migrate_saved_submodules(config)
 
+        # v5 adds the `sha256`, `sha512`, and `verified_checksum` fields.
+        if version < 5:
+            config.update(sha256=None, sha512=None, verified_checksum=None)
+
+        # v6 adds the `fingerprint` field.
+        if version < 6:
+            config['fingerprint'] = None
+
         return config
 
-    def __init__(self, name, *, path=None, url=None, files=None, srcdir=None,
-                 patch=None, **kwargs):
+    def __init__(self, name, *, path=None, url=None, sha256=None, sha512=None,
+                 files=None, srcdir=None, patch=None, **kwargs):
         super().__init__(name, **kwargs)
 
         T = types.TypeCheck(locals(), self._expr_symbols)
         T.path(types.maybe(types.any_path('cfgdir')))
         T.url(types.maybe(types.url))
+        T.sha256(types.maybe(types.hex_string(64)))
+        T.sha512(types.maybe(types.hex_string(128)))
         T.files(types.list_of(types.string, listify=True))
         T.srcdir(types.maybe(types.path_fragment))
         T.patch(types.maybe(types.any_path('cfgdir')))
@@ -360,6 +567,15 @@ class TarballPackage(SDistPackage):
         if (self.path is None) == (self.url is None):
             raise TypeError('exactly one of `path` or `url` must be specified')
         self.guessed_srcdir = None  # Set in fetch().
+        self.verified_checksum = None  # Set in fetch().
+
+    @property
+    def checksum(self):
+        # Get the strongest checksum for this package as `algorithm:digest`.
+        for i in reversed(_checksum_algorithms):
+            if getattr(self, i):
+                return '{}:{}'.format(i, getattr(self, i))
+        return None
 
     def _base_srcdir(self, metadata):
         return os.path.join(metadata.pkgdir, 'src', self.name)
@@ -370,9 +586,116 @@ class TarballPackage(SDistPackage):
             return os.path.join(self._base_srcdir(metadata), srcdir)
         return None
 
-    def _urlopen(self, url):
+    def _hashers(self):
+        return {i: hashlib.new(i) for i in _checksum_algorithms
+                if getattr(self, i)}
+
+    def _verify(self, hashers, where):
+        for algorithm, h in hashers.items():
+            expected = getattr(self, algorithm)
+            if h.hexdigest() != expected:
+                raise ValueError('{} mismatch for {}: expected {}, got {}'
+                                 .format(algorithm, where, expected,
+                                         h.hexdigest()))
+        self.verified_checksum = self.checksum
+
+    def _download(self, url, dest, hashers=None):
+        if hashers is None:
+            hashers = {}
+
+        start = time.monotonic()
+        size = 0
         with urlopen(url) as f:
-            return BytesIO(f.read())
+            while True:
+                chunk = f.read(_download_chunk_size)
+                if not chunk:
+                    break
+                for h in hashers.values():
+                    h.update(chunk)
+                dest.write(chunk)
+                size += len(chunk)
+
+        elapsed = time.monotonic() - start
+        rate = format_size(int(size / elapsed)) if elapsed else '-'
+        peak = peak_memory()
+        peak = format_size(peak) if peak is not None else 'unknown'
+        log.debug('downloaded {} ({}) in {:.2f}s ({}/s; peak memory: {})'
+                  .format(url, format_size(size), elapsed, rate, peak))
+
+    def _download_tempfile(self, url):
+        hashers = self._hashers()
+        f = tempfile.TemporaryFile()
+        try:
+            self._download(url, f, hashers)
+            self._verify(hashers, url)
+            f.seek(0)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def _urlopen(self, url):
+        # Stream the download to disk rather than holding the whole archive in
+        # memory, and verify its checksum as we go.
+        # Only cache downloads with a checksum; otherwise, we couldn't tell
+        # if the file at this URL changed.
+        checksum = self.checksum
+        cache = DownloadCache.from_env() if checksum else None
+        if cache is None:
+            return self._download_tempfile(url)
+
+        f = cache.open(url, checksum)
+        if f is not None:
+            # Files in the cache were verified when they were added.
+            self.verified_checksum = checksum
+            return f
+
+        hashers = self._hashers()
+        with cache.writer(url, checksum) as f:
+            self._download(url, f, hashers)
+            self._verify(hashers, url)
+        f = cache.open(url, checksum)
+        if f is None:
+            # Someone removed our download from the cache already (e.g. by
+            # clearing it), so just download it again.
+            return self._download_tempfile(url)
+        return f
+
+    def _open(self, path):
+        # Verify local archives in a separate pass before extracting them,
+        # rather than hashing as we extract. Otherwise, we'd write the contents
+        # of an unverified archive into our source directory, and zip files
+        # are read out of order anyway. Since the file is local, the extra read
+        # is cheap (and usually served from the OS's cache).
+        f = open(path, 'rb')
+        hashers = self._hashers()
+        if hashers:
+            try:
+                while True:
+                    chunk = f.read(_download_chunk_size)
+                    if not chunk:
+                        break
+                    for h in hashers.values():
+                        h.update(chunk)
+                self._verify(hashers, path)
+                f.seek(0)
+            except BaseException:
+                f.close()
+                raise
+        return f
+
+    def _needs_clean(self, new_package):
+        if ( self.verified_checksum and
+             isinstance(new_package, TarballPackage) and
+             self.verified_checksum == new_package.checksum ):
+            # We've already extracted an archive with the same checksum, so it
+            # doesn't matter where the new package gets its archive from.
+            return not self.equal(new_package, skip_fields={
+                'path', 'url', 'sha256', 'sha512',
+            }, optional_fields={
+                'dependencies', 'builders', 'linkage', 'submodules'
+            })
+        return super()._needs_clean(new_package)
 
     def clean_pre(self, metadata, new_package, quiet=False):
         if not self._needs_clean(new_package):
@@ -380,6 +703,7 @@ class TarballPackage(SDistPackage):
             # guessed srcdir on to the new package instance. That way, we don't
             # have to re-extract the tarball to get the guessed srcdir.
             new_package.guessed_srcdir = self.guessed_srcdir
+            new_package.verified_checksum = self.verified_checksum
             return False
 
         if not quiet:
@@ -387,51 +711,55 @@ class TarballPackage(SDistPackage):
         shutil.rmtree(self._base_srcdir(metadata), ignore_errors=True)
         return True
 
-    def fetch(self, metadata, parent_config):
+    def _fetch_sources(self, metadata):
         base_srcdir = self._base_srcdir(metadata)
+        if os.path.exists(base_srcdir):
+            log.pkg_fetch(self.name, 'already fetched')
+            return
+
+        path_bases = {'cfgdir': self.config_dir}
+        where = self.url or self.path.string(path_bases)
+        log.pkg_fetch(self.name, 'from {}'.format(where))
+
+        with (self._urlopen(self.url) if self.url else
+              self._open(self.path.string(path_bases))) as f:
+            with archive.open(f) as arc:
+                names = arc.getnames()
+                self.guessed_srcdir = (names[0].split('/', 1)[0]
+                                       if names else None)
+                if self.files:
+                    # XXX: This doesn't extract parents of our globs, so
+                    # owners/permissions won't be applied to them...
+                    filtered = filter_glob(self.files, names)
+                    arc.extractall(base_srcdir, members=filtered)
+                else:
+                    arc.extractall(base_srcdir)
+
+        if self.patch:
+            env = self._expr_symbols['env'].value(
+                self.path_values(metadata, with_builders=False)
+            )
+            patch_cmd = get_cmd(env, 'PATCH', 'patch')
+            patch = self.patch.string(path_bases)
+            log.pkg_patch(self.name, 'with {}'.format(patch))
+            with LogFile.open(metadata.pkgdir, self.name) as logfile, \
+                 open(patch) as f:
+                logfile.check_call(patch_cmd + ['-p1'], stdin=f, env=env,
+                                   cwd=self._srcdir(metadata))
+
+    def fetch(self, metadata, parent_config):
         try:
-            if os.path.exists(base_srcdir):
-                log.pkg_fetch(self.name, 'already fetched')
-            else:
-                path_bases = {'cfgdir': self.config_dir}
-                where = self.url or self.path.string(path_bases)
-                log.pkg_fetch(self.name, 'from {}'.format(where))
-
-                with (self._urlopen(self.url) if self.url else
-                      open(self.path.string(path_bases), 'rb')) as f:
-                    with archive.open(f) as arc:
-                        names = arc.getnames()
-                        self.guessed_srcdir = (names[0].split('/', 1)[0]
-                                               if names else None)
-                        if self.files:
-                            # XXX: This doesn't extract parents of our globs,
-                            # so owners/permissions won't be applied to them...
-                            filtered = filter_glob(self.files, names)
-                            arc.extractall(base_srcdir, members=filtered)
-                        else:
-                            arc.extractall(base_srcdir)
-
-                if self.patch:
-                    env = self._expr_symbols['env'].value(
-                        self.path_values(metadata, with_builders=False)
-                    )
-                    patch_cmd = get_cmd(env, 'PATCH', 'patch')
-                    patch = self.patch.string(path_bases)
-                    log.pkg_patch(self.name, 'with {}'.format(patch))
-                    with LogFile.open(metadata.pkgdir, self.name) as logfile, \
-                         open(patch) as f, \
-                         pushd(self._srcdir(metadata)):
-                        logfile.check_call(patch_cmd + ['-p1'], stdin=f,
-                                           env=env)
-            return self._find_mopack(parent_config, self._srcdir(metadata))
+            self._ensure_sources(metadata)
         except subprocess.SubprocessError:
             self._find_mopack(parent_config, self._srcdir(metadata))
             raise
+        return self._find_mopack(parent_config, self._srcdir(metadata))
 
 
 class GitPackage(SDistPackage):
     origin = 'git'
-    _version = 4
+    _version = 6
+    _transient_fields = SDistPackage._transient_fields | {'_update_rev'}
 
     @staticmethod
     def upgrade(config, version):
@@ -447,10 +775,18 @@ class GitPackage(SDistPackage):
         if version < 4:
             migrate_saved_submodules(config)
 
+        # v5 adds the `partial` and `sparse` fields.
+        if version < 5:
+            config.update(partial=False, sparse=[])
+
+        # v6 adds the `fingerprint` field.
+        if version < 6:
+            config['fingerprint'] = None
+
         return config
 
     def __init__(self, name, *, repository, tag=None, branch=None, commit=None,
-                 srcdir='.', **kwargs):
+                 srcdir='.', partial=False, sparse=None, **kwargs):
         super().__init__(name, **kwargs)
 
         T = types.TypeCheck(locals(), self._expr_symbols)
@@ -459,6 +795,8 @@ class GitPackage(SDistPackage):
             desc='a repository'
         ))
         T.srcdir(types.maybe(types.path_fragment))
+        T.partial(types.boolean)
+        T.sparse(types.list_of(types.string, listify=True))
 
         rev = {}
         T.tag(types.maybe(types.string), dest=rev)
@@ -489,16 +827,84 @@ class GitPackage(SDistPackage):
             git + ['version'], text=True, check=True, stdout=subprocess.PIPE
         ).stdout)
 
+    def _reference_args(self, git, env, logfile):
+        # Borrow objects from a shared mirror of remote repositories so that
+        # each build directory doesn't need to download them all again. Local
+        # repositories are cheap enough to clone directly. Mirrors hold every
+        # object in the repository, so shallow clones (of a tag or commit),
+        # partial clones, and sparse clones skip them; otherwise, we'd
+        # download far more than the clone itself needs.
+        if ( isinstance(self.repository, Path) or self.rev[0] != 'branch' or
+             self.partial or self.sparse ):
+            return []
+        cache = GitMirrorCache.from_env()
+        if cache is None:
+            return []
+
+        mirror = cache.update(self.repository, logfile, git, env)
+        return ['--reference', mirror, '--dissociate']
+
     def clean_pre(self, metadata, new_package, quiet=False):
         if not self._needs_clean(new_package):
             return False
 
+        if ( isinstance(new_package, GitPackage) and
+             self.repository == new_package.repository and
+             self.partial == new_package.partial and
+             self.sparse == new_package.sparse ):
+            # The new package uses the same repository, so we can keep our
+            # checkout and just update it to the new revision in fetch().
+            if self.rev == new_package.rev:
+                return False
+            new_package._update_rev = True
+            return True
+
         if not quiet:
             log.pkg_clean(self.name, 'sources')
         shutil.rmtree(self._base_srcdir(metadata), ignore_errors=True)
         return True
 
-    def fetch(self, metadata, parent_config):
+    def _update_checkout(self, git, env, logfile, base_srcdir):
+        detached_args = ['-c', 'advice.detachedHead=false']
+        log.pkg_fetch(self.name, 'updating to {} {}'.format(*self.rev))
+        if self.rev[0] == 'branch':
+            # Track only the new branch, just like a `--single-branch` clone.
+            logfile.check_call(git + [
+                'remote', 'set-branches', 'origin', self.rev[1],
+            ], env=env, cwd=base_srcdir)
+            logfile.check_call(git + ['fetch', 'origin'], env=env,
+                               cwd=base_srcdir)
+            logfile.check_call(git + [
+                'checkout', '-B', self.rev[1], '--track',
+                'origin/' + self.rev[1],
+            ], env=env, cwd=base_srcdir)
+        elif self.rev[0] == 'tag':
+            logfile.check_call(git + [
+                'fetch', '--depth=1', 'origin', 'tag', self.rev[1],
+            ], env=env, cwd=base_srcdir)
+            logfile.check_call(git + detached_args + [
+                'checkout', self.rev[1],
+            ], env=env, cwd=base_srcdir)
+        elif self.rev[0] == 'commit':
+            try:
+                logfile.check_call(git + [
+                    'fetch', '--depth=1', 'origin', self.rev[1],
+                ], env=env, cwd=base_srcdir)
+            except subprocess.CalledProcessError:
+                # Not every server allows fetching arbitrary commits, so fetch
+                # the full history of every branch instead. (An "infinite"
+                # depth also unshallows our checkout if needed.)
+                logfile.check_call(git + [
+                    'fetch', '--depth=2147483647', 'origin',
+                    '+refs/heads/*:refs/remotes/origin/*',
+                ], env=env, cwd=base_srcdir)
+            logfile.check_call(git + detached_args + [
+                'checkout', self.rev[1],
+            ], env=env, cwd=base_srcdir)
+        else:  # pragma: no cover
+            raise ValueError('unknown revision type {!r}'.format(self.rev[0]))
+
+    def _fetch_sources(self, metadata):
         path_values = self.path_values(metadata, with_builders=False)
         base_srcdir = self._base_srcdir(metadata)
 
@@ -506,37 +912,48 @@ class GitPackage(SDistPackage):
         git = get_cmd(env, 'GIT', 'git')
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
             if os.path.exists(base_srcdir):
-                if self.rev[0] == 'branch':
-                    with pushd(base_srcdir):
-                        logfile.check_call(git + ['pull'], env=env)
+                if getattr(self, '_update_rev', False):
+                    self._update_checkout(git, env, logfile, base_srcdir)
+                elif self.rev[0] == 'branch':
+                    logfile.check_call(git + ['pull'], env=env,
+                                       cwd=base_srcdir)
             else:
                 detached_args = ['-c', 'advice.detachedHead=false']
                 log.pkg_fetch(self.name, 'from {}'.format(self.repository))
+                clone_args = self._reference_args(git, env, logfile)
+                if self.partial:
+                    clone_args.append('--filter=blob:none')
+                if self.sparse:
+                    clone_args.append('--sparse')
+
                 if self.rev[0] == 'branch':
                     logfile.check_call(git + [
                         'clone', self.repository, base_srcdir,
                         '--single-branch', '--branch', self.rev[1],
-                    ], env=env)
+                    ] + clone_args, env=env)
                 elif self.rev[0] == 'tag':
                     logfile.check_call(git + detached_args + [
                         'clone', self.repository, base_srcdir, '--depth=1',
                         '--branch', self.rev[1],
-                    ], env=env)
+                    ] + clone_args, env=env)
                 elif self.rev[0] == 'commit':
                     if self._git_version(git) in SpecifierSet('>=2.49.0'):
                         logfile.check_call(git + detached_args + [
                             'clone', self.repository, base_srcdir, '--depth=1',
                             '--revision', self.rev[1],
-                        ], env=env)
+                        ] + clone_args, env=env)
                     else:
                         logfile.check_call(git + [
                             'clone', self.repository, base_srcdir,
-                        ], env=env)
-                        with pushd(base_srcdir):
-                            logfile.check_call(git + ['checkout', self.rev[1]],
-                                               env=env)
+                        ] + clone_args, env=env)
+                        logfile.check_call(git + ['checkout', self.rev[1]],
+                                           env=env, cwd=base_srcdir)
                 else:  # pragma: no cover
                     raise ValueError('unknown revision type {!r}'
                                      .format(self.rev[0]))
 
-        return self._find_mopack(parent_config, self._srcdir(metadata))
+                if self.sparse:
+                    patterns = [gitignore_pattern(i) for i in self.sparse]
+                    logfile.check_call(git + [
+                        'sparse-checkout', 'set', '--no-cone', '--',
+                    ] + patterns, env=env, cwd=base_srcdir)
@@ -7,8 +7,8 @@ from .freezedried import FreezeDried
 from .iterutils import ismapping
 from .placeholder import PlaceholderString, placeholder_type
 
-__all__ = ['exists', 'file_outdated', 'isdir', 'isfile', 'islink', 'issemiabs',
-           'Path', 'pushd']
+__all__ = ['DirectoryCache', 'exists', 'file_outdated', 'isdir', 'isfile',
+           'islink', 'issemiabs', 'Path', 'pushd']
 
 
 @contextmanager
@@ -63,6 +63,50 @@ islink = _wrap_ospath(os.path.islink)
 issemiabs = _wrap_ospath(_issemiabs)
 
 
+class DirectoryCache:
+    # Answer questions about whether files exist by listing each directory
+    # once and remembering its contents. This is much faster than calling
+    # `isfile` when probing for many files across the same directories, but
+    # it won't notice any changes made to a directory after it's been listed.
+
+    def __init__(self):
+        self._dirs = {}
+
+    def _listing(self, dirname):
+        # Return the entries of `dirname` by name, along with the set of their
+        # case-folded names.
+        if dirname not in self._dirs:
+            try:
+                with os.scandir(dirname) as entries:
+                    listing = {i.name: i for i in entries}
+            except OSError:
+                listing = {}
+            self._dirs[dirname] = (listing,
+                                   {i.casefold() for i in listing})
+        return self._dirs[dirname]
+
+    def isfile(self, path, bases={}):
+        if isinstance(path, Path):
+            path = path.string(bases)
+        dirname, basename = os.path.split(path)
+        if not basename:
+            return False
+
+        listing, folded = self._listing(dirname)
+        entry = listing.get(basename)
+        if entry is not None:
+            try:
+                return entry.is_file()
+            except OSError:
+                return False
+
+        # On case-insensitive filesystems, `basename` might name a file under
+        # a different case, so ask the filesystem about any possible matches.
+        if basename.casefold() in folded:
+            return os.path.isfile(path)
+        return False
+
+
 @placeholder_type
 class Path(FreezeDried):
     def __init__(self, path, base=None):
@@ -1,7 +1,36 @@
+import json
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
 
+from .environment import subprocess_run
 from .iterutils import issequence
-from .shell import quote_posix, quote_str, ShellArguments
+from .shell import quote_posix, quote_str, ShellArguments, split_paths
+
+_pc_line_ex = re.compile(r'^([A-Za-z0-9_.]+)\s*([:=])\s*(.*)$')
+_pc_variable_ex = re.compile(r'\$(?:\$|\{([^}]*)\})')
+_requires_ex = re.compile(
+    r'([^\s,<>=!]+)(?:\s*(<=|>=|!=|=|<|>)\s*([^\s,]+))?'
+)
+_version_part_ex = re.compile(r'[0-9]+|[A-Za-z]+')
+
+_version_ops = {
+    '=': lambda x: x == 0,
+    '!=': lambda x: x != 0,
+    '<': lambda x: x < 0,
+    '<=': lambda x: x <= 0,
+    '>': lambda x: x > 0,
+    '>=': lambda x: x >= 0,
+}
+
+# pkg-config's default search path, keyed by the pkg-config command.
+_default_search_paths = {}
+
+# The loaded .pc file indexes, keyed by package directory.
+_indexes = {}
 
 
 def _write_variable(out, name, value):
@@ -54,3 +83,359 @@ def write_pkg_config(out, name, *, desc='mopack-generated package',
     _write_field(out, 'Requires', requires, var_symbols)
     _write_field(out, 'Cflags', cflags, var_symbols)
     _write_field(out, 'Libs', libs, var_symbols)
+
+
+def compare_versions(lhs, rhs):
+    # Compare two versions like pkg-config (and RPM) does: split each version
+    # into runs of digits or letters and compare them piece by piece, with
+    # numbers always newer than letters.
+    lparts = _version_part_ex.findall(lhs)
+    rparts = _version_part_ex.findall(rhs)
+    for lpart, rpart in zip(lparts, rparts):
+        if lpart.isdigit() != rpart.isdigit():
+            return 1 if lpart.isdigit() else -1
+        if lpart.isdigit():
+            lpart, rpart = lpart.lstrip('0'), rpart.lstrip('0')
+            if len(lpart) != len(rpart):
+                return 1 if len(lpart) > len(rpart) else -1
+        if lpart != rpart:
+            return 1 if lpart > rpart else -1
+    return (len(lparts) > len(rparts)) - (len(lparts) < len(rparts))
+
+
+def _parse_requires(value):
+    return [(name, op, version) for name, op, version in
+            _requires_ex.findall(value)]
+
+
+class PkgConfigFile:
+    def __init__(self, name, path, variables, fields):
+        self.name = name
+        self.path = path
+        self.variables = variables
+        self.fields = fields
+
+    @property
+    def version(self):
+        return self.fields.get('Version')
+
+    @property
+    def requires(self):
+        return (_parse_requires(self.fields.get('Requires', '')) +
+                _parse_requires(self.fields.get('Requires.private', '')))
+
+    @classmethod
+    def read(cls, name, path, env=os.environ):
+        # Variables can be overridden from the environment, as with
+        # `PKG_CONFIG_FOO_PREFIX` for the `prefix` variable of `foo`.
+        def env_name(s):
+            return re.sub(r'[^A-Za-z0-9]', '_', s).upper()
+
+        override_prefix = 'PKG_CONFIG_{}_'.format(env_name(name))
+
+        variables = {
+            'pcfiledir': os.path.dirname(path),
+            'pc_sysrootdir': env.get('PKG_CONFIG_SYSROOT_DIR', '/'),
+        }
+        fields = {}
+
+        def expand(value):
+            def replace(m):
+                if m.group(1) is None:
+                    return '$'
+                try:
+                    return variables[m.group(1)]
+                except KeyError:
+                    raise ValueError('variable {!r} not defined in {!r}'
+                                     .format(m.group(1), path))
+            return _pc_variable_ex.sub(replace, value)
+
+        with open(path) as f:
+            text = f.read()
+
+        for line in re.sub(r'\\\r?\n', ' ', text).splitlines():
+            line = re.sub(r'(?<!\\)#.*', '', line).replace('\\#', '#')
+            m = _pc_line_ex.match(line.strip())
+            if not m:
+                continue
+
+            key, kind, value = m.groups()
+            if kind == '=':
+                if key in variables:
+                    raise ValueError((
+                        'duplicate definition of variable {!r} in {!r}'
+                    ).format(key, path))
+                override = env.get(override_prefix + env_name(key))
+                variables[key] = (override if override is not None
+                                  else expand(value))
+            else:
+                fields[key] = expand(value)
+
+        for i in ('Name', 'Description', 'Version'):
+            if i not in fields:
+                raise ValueError('missing {!r} field in {!r}'.format(i, path))
+        return cls(name, path, variables, fields)
+
+
+class PkgConfigResolver:
+    # Answer pkg-config queries in-process by reading .pc files directly. This
+    # only covers the queries mopack itself needs to make, and any query it
+    # can't answer (e.g. because a package is missing or its .pc file is
+    # invalid) should be passed along to pkg-config for a definitive answer.
+
+    def __init__(self, search_path, env=os.environ, index=None):
+        self.search_path = search_path
+        self.env = env
+        self.index = index
+        self._files = {}
+
+    def _lookup(self, name):
+        if self.index is not None:
+            return self.index.lookup(self.search_path, name)
+
+        for path in self.search_path:
+            filename = os.path.join(path, name + '.pc')
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def _find(self, name):
+        names = [name]
+        if ( 'PKG_CONFIG_DISABLE_UNINSTALLED' not in self.env and
+             not name.endswith('-uninstalled') ):
+            names.insert(0, name + '-uninstalled')
+
+        for i in names:
+            filename = self._lookup(i)
+            if filename is not None:
+                try:
+                    return PkgConfigFile.read(name, filename, self.env)
+                except (OSError, UnicodeDecodeError, ValueError):
+                    return None
+        return None
+
+    def find(self, name):
+        if name not in self._files:
+            self._files[name] = self._find(name)
+        return self._files[name]
+
+    def modversion(self, name):
+        pc = self.find(name)
+        return pc.version if pc else None
+
+    def exists(self, names):
+        # Check that the packages `names`, and all the packages they require,
+        # can be found (and satisfy any version requirements).
+        seen = set()
+        pending = [(i, None, None) for i in names]
+        while pending:
+            name, op, version = pending.pop()
+            pc = self.find(name)
+            if pc is None:
+                return False
+            if op and not _version_ops[op](compare_versions(pc.version,
+                                                            version)):
+                return False
+            if name not in seen:
+                seen.add(name)
+                pending.extend(pc.requires)
+        return True
+
+
+def _list_pc_files(path):
+    # Return the names of all the .pc files in `path`, along with the stamp of
+    # `path` when we listed it (or None if it doesn't exist).
+    try:
+        stamp = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            names = [i.name[:-3] for i in entries if i.name.endswith('.pc')]
+    except OSError:
+        return None, []
+    return stamp, names
+
+
+class PkgConfigIndex:
+    # An index of the .pc files in each directory of pkg-config's search path
+    # (and of pkg-config's default search path itself), saved in the package
+    # directory. This lets us find a package with a dict lookup rather than
+    # probing every directory for it. Each directory's listing is stamped with
+    # its mtime, so adding or removing a .pc file invalidates it; we only index
+    # file names, so the .pc files themselves are still read fresh each time.
+
+    index_filename = 'pkg_config_index.json'
+    version = 1
+
+    # Directory mtimes can be coarse, so a listing taken within this many
+    # seconds of its directory's last change might miss a file added in the
+    # same tick. We still use these listings, but don't save them.
+    racy_interval = 2
+
+    def __init__(self, pkgdir=None):
+        self.pkgdir = pkgdir
+        self._dirs = {}
+        self._racy = set()
+        self._default_search_paths = {}
+        self._lookups = {}
+        self._dirty = False
+
+    @property
+    def path(self):
+        if self.pkgdir is None:
+            return None
+        return os.path.join(self.pkgdir, self.index_filename)
+
+    @classmethod
+    def load(cls, pkgdir):
+        index = cls(pkgdir)
+        try:
+            with open(index.path) as f:
+                state = json.load(f)
+            if state['version'] == cls.version:
+                index._dirs = {k: (v['stamp'], v['names'])
+                               for k, v in state['dirs'].items()}
+                index._default_search_paths = state['default_search_paths']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return index
+
+    def save(self):
+        # The index is only an optimization, so ignore any errors writing it
+        # (e.g. if the package directory is read-only). We also don't create
+        # the package directory just to hold the index.
+        if not self._dirty or self.path is None:
+            return
+        if not os.path.isdir(self.pkgdir):
+            return
+
+        state = {
+            'version': self.version,
+            'dirs': {k: {'stamp': v[0], 'names': v[1]}
+                     for k, v in self._dirs.items() if k not in self._racy},
+            'default_search_paths': self._default_search_paths,
+        }
+        try:
+            fd, tmppath = tempfile.mkstemp(prefix='.tmp-', dir=self.pkgdir)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmppath, self.path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        except OSError:
+            return
+        self._dirty = False
+
+    def refresh(self, search_path):
+        # Make sure the listings for each directory in `search_path` are up to
+        # date. This only needs to stat each directory, unless it's changed.
+        changed = False
+        for path in search_path:
+            try:
+                stamp = os.stat(path).st_mtime_ns
+            except OSError:
+                stamp = None
+
+            cached = self._dirs.get(path)
+            if cached is not None and cached[0] == stamp:
+                continue
+
+            now = time.time_ns()
+            stamp, names = _list_pc_files(path)
+            self._dirs[path] = (stamp, sorted(names))
+            if stamp is not None and now - stamp < self.racy_interval * 10**9:
+                self._racy.add(path)
+            else:
+                self._racy.discard(path)
+            self._dirty = changed = True
+
+        if changed:
+            self._lookups.clear()
+
+    def lookup(self, search_path, name):
+        # Find the first .pc file for `name` in `search_path`. `refresh` must
+        # have been called for this search path first.
+        key = tuple(search_path)
+        if key not in self._lookups:
+            files = {}
+            for path in reversed(search_path):
+                files.update((i, os.path.join(path, i + '.pc'))
+                             for i in self._dirs[path][1])
+            self._lookups[key] = files
+        return self._lookups[key].get(name)
+
+    def default_search_path(self, pkg_config, env=os.environ):
+        # Look up pkg-config's default search path. Since this is built into
+        # pkg-config, the saved copy is stamped with the pkg-config executable
+        # it came from.
+        exe = shutil.which(pkg_config[0], path=env.get('PATH'))
+        try:
+            stat = os.stat(exe)
+            stamp = [exe, stat.st_mtime_ns, stat.st_size]
+        except (OSError, TypeError):
+            return default_search_path(pkg_config, env)
+
+        key = json.dumps(pkg_config)
+        cached = self._default_search_paths.get(key)
+        if cached is not None and cached['stamp'] == stamp:
+            return cached['path']
+
+        path = default_search_path(pkg_config, env)
+        if path is not None:
+            self._default_search_paths[key] = {'stamp': stamp, 'path': path}
+            self._dirty = True
+        return path
+
+
+def get_index(pkgdir):
+    # Get the .pc file index for `pkgdir`, loading it the first time.
+    if pkgdir not in _indexes:
+        _indexes[pkgdir] = PkgConfigIndex.load(pkgdir)
+    return _indexes[pkgdir]
+
+
+def default_search_path(pkg_config, env=os.environ):
+    # pkg-config's default search path is built into it, so ask it once for
+    # this path and then remember it. If that fails, return None.
+    key = tuple(pkg_config)
+    if key not in _default_search_paths:
+        try:
+            output = subprocess_run(
+                pkg_config + ['--variable', 'pc_path', 'pkg-config'],
+                text=True, check=True, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, env=env
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            output = None
+        _default_search_paths[key] = (split_paths(output.strip())
+                                      if isinstance(output, str) else None)
+    return _default_search_paths[key]
+
+
+def search_path(pkg_config, env=os.environ, index=None):
+    path = split_paths(env.get('PKG_CONFIG_PATH'))
+    libdir = env.get('PKG_CONFIG_LIBDIR')
+    if libdir is not None:
+        return path + split_paths(libdir)
+
+    if index is not None:
+        default_path = index.default_search_path(pkg_config, env)
+    else:
+        default_path = default_search_path(pkg_config, env)
+    if default_path is None:
+        return None
+    return path + default_path
+
+
+def make_resolver(pkg_config, env=os.environ, pkgdir=None):
+    # Make a resolver for pkg-config queries. If `pkgdir` is set, use (and
+    # update) the .pc file index saved there.
+    index = get_index(pkgdir) if pkgdir is not None else None
+    path = search_path(pkg_config, env, index)
+    if path is None:
+        return None
+
+    if index is not None:
+        index.refresh(path)
+        index.save()
+    return PkgConfigResolver(path, env, index)
@@ -3,6 +3,11 @@ import subprocess
 
 from .objutils import memoize
 
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
 
 @memoize
 def platform_name():
@@ -18,3 +23,12 @@ def platform_name():
             pass
 
     return system
+
+
+def peak_memory():
+    # Get the peak resident memory of this process in bytes, if available.
+    if resource is None:  # pragma: no cover
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports this in bytes; other platforms use kilobytes.
+    return maxrss if platform_name() == 'darwin' else maxrss * 1024
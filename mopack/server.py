@@ -0,0 +1,170 @@
+import json
+import os
+import socket
+import socketserver
+from types import SimpleNamespace
+
+from . import commands
+from .dependencies import Dependency
+from .metadata import Metadata, MetadataChangedError, retry_if_changed
+
+__all__ = ['query', 'Server', 'ServerError', 'socket_filename', 'socket_path',
+           'supported']
+
+socket_filename = 'mopack.sock'
+
+# Unix domain sockets aren't available on all platforms (e.g. older versions
+# of Windows); in that case, the server is unsupported and clients just do the
+# work themselves.
+supported = hasattr(socket, 'AF_UNIX')
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+def socket_path(pkgdir):
+    return os.path.join(pkgdir, socket_filename)
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _dehydrate_tree(items):
+    return [{'name': i.package.name, 'origin': i.package.origin,
+             'version': i.version, 'children': _dehydrate_tree(i.children)}
+            for i in items]
+
+
+def _rehydrate_tree(data):
+    return [commands.PackageTreeItem(
+        SimpleNamespace(name=i['name'], origin=i['origin']), i['version'],
+        _rehydrate_tree(i['children'])
+    ) for i in data]
+
+
+def query(pkgdir, command, **kwargs):
+    # Send a query to the server for `pkgdir`. If no server is running (or it
+    # goes away before responding), return None so that the caller can handle
+    # the query itself.
+    if not supported:
+        return None
+    sock = _connect(socket_path(pkgdir))
+    if sock is None:
+        return None
+
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(dict(kwargs, command=command)).encode('utf-8') +
+                b'\n')
+        f.flush()
+        line = f.readline()
+    if not line:
+        return None
+
+    response = json.loads(line)
+    if 'error' in response:
+        raise ServerError(response['error'])
+
+    result = response['result']
+    if command == 'list-packages':
+        return _rehydrate_tree(result)
+    return result
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Connections are handled one at a time, so don't let a client that stops
+    # talking to us block everyone else.
+    timeout = 10
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                try:
+                    response = {'result': self.server.handle_query(
+                        json.loads(line)
+                    )}
+                except Exception as e:
+                    response = {'error': str(e)}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        except socket.timeout:
+            pass
+
+
+class Server(socketserver.UnixStreamServer if supported else object):
+    # A server that keeps the metadata for a package directory loaded so that
+    # it can answer queries without rehydrating it each time. Queries are
+    # handled one at a time, and the metadata is reloaded whenever the saved
+    # copy changes.
+
+    def __init__(self, pkgdir):
+        if not supported:  # pragma: no cover
+            raise ServerError('servers are not supported on this platform')
+
+        self.pkgdir = pkgdir
+        self._loaded = {}
+
+        path = socket_path(pkgdir)
+        if os.path.exists(path):
+            sock = _connect(path)
+            if sock is not None:
+                sock.close()
+                raise ServerError('server already running for {!r}'
+                                  .format(pkgdir))
+            # The socket is left over from a server that didn't exit cleanly.
+            os.remove(path)
+
+        os.makedirs(pkgdir, exist_ok=True)
+        super().__init__(path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:  # pragma: no cover
+            pass
+
+    def metadata(self, strict=False, required=False):
+        stamp = Metadata.stamp(self.pkgdir)
+        if stamp is None and required:
+            # Let `Metadata.load` report the error.
+            return Metadata.load(self.pkgdir, strict)
+
+        loaded = self._loaded.get(strict)
+        if loaded is None or loaded[0] != stamp:
+            loaded = self._loaded[strict] = (
+                stamp, Metadata.try_load(self.pkgdir, strict)
+            )
+        return loaded[1]
+
+    def handle_query(self, request):
+        return retry_if_changed(self._handle_query, request)
+
+    def _handle_query(self, request):
+        command = request['command']
+        try:
+            if command == 'linkage':
+                metadata = self.metadata(request.get('strict', False))
+                return {str(dep): metadata.get_linkage(dep) for dep in
+                        (Dependency(i) for i in request['dependencies'])}
+            elif command == 'list-files':
+                metadata = self.metadata(request.get('strict', False))
+                return commands.metadata_files(metadata,
+                                               request.get('implicit', False))
+            elif command == 'list-packages':
+                metadata = self.metadata(required=True)
+                return _dehydrate_tree(commands.package_tree(
+                    metadata, request.get('flat', False)
+                ))
+        except MetadataChangedError:
+            # Forget the metadata we've loaded so that we reload it when
+            # trying again.
+            self._loaded.clear()
+            raise
+        raise ValueError('unknown command {!r}'.format(command))
@@ -400,6 +400,19 @@ def url(field, value):
     return value
 
 
+def hex_string(length):
+    ex = re.compile('^[0-9A-Fa-f]{{{}}}$'.format(length))
+
+    def check(field, value):
+        value = string(field, value)
+        if not ex.match(value):
+            raise FieldValueError('expected a {}-digit hex string'
+                                  .format(length), field)
+        return value.lower()
+
+    return check
+
+
 def dependency(field, value):
     with ensure_field_error(field):
         return Dependency(string(field, value))
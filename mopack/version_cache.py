@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import time
+
+__all__ = ['VersionCache']
+
+
+class VersionCache:
+    # An on-disk cache of versions extracted from files (e.g. a header that
+    # `#define`s the version) in a package directory. Each entry is stamped
+    # with the mtime and size of the file it was extracted from, so looking up
+    # a cached version only needs to stat that file, not read it.
+
+    cache_filename = 'version_cache.json'
+    version = 1
+
+    # File mtimes can be coarse, so a file changed within this many seconds
+    # of when we read it might change again without its stamp changing. We
+    # still use versions extracted from these files, but don't save them.
+    racy_interval = 2
+
+    def __init__(self, pkgdir):
+        self.pkgdir = pkgdir
+        self._entries = None
+        self._racy = set()
+
+    @property
+    def path(self):
+        return os.path.join(self.pkgdir, self.cache_filename)
+
+    @staticmethod
+    def key(patterns):
+        return json.dumps(patterns)
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+                self._entries = (state['entries']
+                                 if state['version'] == self.version else {})
+            except (OSError, ValueError, KeyError, TypeError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        # The cache is only an optimization, so ignore any errors writing to
+        # it (e.g. if the package directory is read-only). We also don't
+        # create the package directory just to hold the cache.
+        if not os.path.isdir(self.pkgdir):
+            return
+
+        try:
+            fd, tmppath = tempfile.mkstemp(prefix='.tmp-', dir=self.pkgdir)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'version': self.version, 'entries': {
+                        k: v for k, v in self._entries.items()
+                        if k not in self._racy
+                    }}, f)
+                os.replace(tmppath, self.path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        except OSError:
+            pass
+
+    def get(self, path, patterns, extract):
+        # Get the version in the file at `path` using `patterns`, calling
+        # `extract(path)` to find it if it's not in the cache.
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Let `extract` report any errors.
+            return extract(path)
+
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        key = self.key(patterns)
+        entries = self._load()
+        entry = entries.get(path)
+        if entry is not None and entry['stamp'] == stamp:
+            if key in entry['versions']:
+                return entry['versions'][key]
+        else:
+            entry = {'stamp': stamp, 'versions': {}}
+
+        version = entry['versions'][key] = extract(path)
+        entries[path] = entry
+        if time.time_ns() - stat.st_mtime_ns < self.racy_interval * 10**9:
+            self._racy.add(path)
+        else:
+            self._racy.discard(path)
+            self._save()
+        return version
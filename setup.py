@@ -215,6 +215,11 @@ setup(
             'pkg_config=mopack.linkages.pkg_config:PkgConfigLinkage',
             'system=mopack.linkages.path_system:SystemLinkage',
         ],
+        'mopack.artifact_backends': [
+            'file=mopack.artifact_cache:DirectoryBackend',
+            'http=mopack.artifact_cache:HTTPBackend',
+            'https=mopack.artifact_cache:HTTPBackend',
+        ],
     },
 
     cmdclass=custom_cmds,
@@ -0,0 +1,64 @@
+# Compare how long it takes to save and load metadata with binary package
+# records against using the JSON records alone. Run this via:
+#
+#   $ python -m test.benchmarks.metadata
+
+import argparse
+import tempfile
+import timeit
+
+from mopack.metadata import Metadata
+from mopack.options import Options
+from mopack.origins.system import SystemPackage
+
+
+def make_metadata(pkgdir, count):
+    metadata = Metadata(pkgdir, Options.default())
+    for i in range(count):
+        pkg = SystemPackage('pkg{}'.format(i), _options=metadata.options,
+                            config_file='/path/to/mopack.yml')
+        pkg.resolved = True
+        metadata.add_package(pkg)
+    return metadata
+
+
+def load_all(pkgdir):
+    metadata = Metadata.load(pkgdir)
+    for name in metadata.packages:
+        metadata.get_package(name)
+
+
+def bench(count, binary, repeat):
+    Metadata.binary_records = binary
+    save_times, load_times = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = make_metadata(pkgdir, count)
+            save_times.append(timeit.timeit(metadata.save, number=1))
+            load_times.append(timeit.timeit(lambda: load_all(pkgdir),
+                                            number=1))
+    return min(save_times), min(load_times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('counts', metavar='COUNT', type=int, nargs='*',
+                        default=[10, 100, 1000],
+                        help='numbers of packages to test')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='times to repeat each test')
+    args = parser.parse_args()
+
+    print('{:>8}  {:>6}  {:>10}  {:>10}'.format(
+        'packages', 'format', 'save (ms)', 'load (ms)'
+    ))
+    for count in args.counts:
+        for binary in (False, True):
+            save, load = bench(count, binary, args.repeat)
+            print('{:>8}  {:>6}  {:>10.1f}  {:>10.1f}'.format(
+                count, 'binary' if binary else 'json', save * 1000, load * 1000
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -58,14 +58,26 @@ def slurp(filename):
         return f.read()
 
 
+def slurp_metadata(pkgdir='mopack'):
+    # Read the saved metadata, with each package's record inlined into it.
+    state = json.loads(slurp(os.path.join(pkgdir, 'mopack.json')))
+    state['metadata']['packages'] = [
+        json.loads(slurp(os.path.join(pkgdir, 'metadata', i)))
+        for i in state['metadata']['packages'].values()
+    ]
+    return state
+
+
 def cfg_common_options(*, strict=False, target_platform=platform_name(),
-                       env=mock.ANY, deploy_dirs={}, auto_link=None):
+                       env=mock.ANY, deploy_dirs={}, auto_link=None,
+                       compiler_cache=None, compiler_cache_dir=None):
     if auto_link is None:
         auto_link = auto_link_default
-    return {'_version': 2, 'strict': strict,
+    return {'_version': 3, 'strict': strict,
             'target_platform': target_platform, 'env': env,
             'deploy_dirs': deploy_dirs,
-            'auto_link': auto_link}
+            'auto_link': auto_link, 'compiler_cache': compiler_cache,
+            'compiler_cache_dir': compiler_cache_dir}
 
 
 def cfg_bfg9000_options(toolchain=None):
@@ -111,45 +123,54 @@ def _cfg_package(origin, api_version, name, config_file, *, parent=None,
 
 
 def _cfg_sdist_pkg(origin, api_version, name, config_file, *, dependencies=[],
-                   env={}, builders=[], linkage, **kwargs):
+                   env={}, builders=[], linkage, fingerprint=mock.ANY,
+                   **kwargs):
     result = _cfg_package(origin, api_version, name, config_file, **kwargs)
     result.update({
         'dependencies': dependencies,
         'env': env,
         'builders': builders,
         'linkage': linkage,
+        'fingerprint': fingerprint,
     })
     return result
 
 
 def cfg_directory_pkg(name, config_file, *, path, **kwargs):
-    result = _cfg_sdist_pkg('directory', 4, name, config_file, **kwargs)
+    result = _cfg_sdist_pkg('directory', 5, name, config_file, **kwargs)
     result.update({
         'path': path,
     })
     return result
 
 
-def cfg_tarball_pkg(name, config_file, *, path=None, url=None, files=[],
-                    srcdir=None, guessed_srcdir=None, patch=None, **kwargs):
-    result = _cfg_sdist_pkg('tarball', 4, name, config_file, **kwargs)
+def cfg_tarball_pkg(name, config_file, *, path=None, url=None, sha256=None,
+                    sha512=None, files=[], srcdir=None, guessed_srcdir=None,
+                    verified_checksum=None, patch=None, **kwargs):
+    result = _cfg_sdist_pkg('tarball', 6, name, config_file, **kwargs)
     result.update({
         'path': path,
         'url': url,
+        'sha256': sha256,
+        'sha512': sha512,
         'files': files,
         'srcdir': srcdir,
         'guessed_srcdir': guessed_srcdir,
+        'verified_checksum': verified_checksum,
         'patch': patch,
     })
     return result
 
 
-def cfg_git_pkg(name, config_file, *, repository, rev, srcdir='.', **kwargs):
-    result = _cfg_sdist_pkg('git', 4, name, config_file, **kwargs)
+def cfg_git_pkg(name, config_file, *, repository, rev, srcdir='.',
+                partial=False, sparse=[], **kwargs):
+    result = _cfg_sdist_pkg('git', 6, name, config_file, **kwargs)
     result.update({
         'repository': repository,
         'rev': rev,
         'srcdir': srcdir,
+        'partial': partial,
+        'sparse': sparse,
     })
     return result
 
@@ -1,4 +1,3 @@
-import json
 import os
 from unittest import mock, skipIf
 
@@ -22,7 +21,7 @@ class TestApt(IntegrationTest):
         self.assertPathLinkage('zlib', type='system', version=mock.ANY,
                                libraries=['z'])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
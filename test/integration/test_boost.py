@@ -34,7 +34,7 @@ class TestBoost(IntegrationTest):
             version=version
         )
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
@@ -94,7 +94,7 @@ class TestBoostSource(IntegrationTest):
             version=version
         )
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
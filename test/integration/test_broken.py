@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.path import pushd
@@ -21,7 +20,7 @@ class TestBroken(IntegrationTest):
 
         self.assertLinkage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -61,7 +60,7 @@ class TestBrokenPatch(IntegrationTest):
 
         self.assertLinkage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
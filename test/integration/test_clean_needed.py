@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -29,7 +28,7 @@ class TestCleanNeeded(IntegrationTest):
             ], include_path=[include_greeter, include_hello])
         self.assertPkgConfigLinkage('hello', include_path=[include_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -72,7 +71,7 @@ class TestCleanNeeded(IntegrationTest):
             ], include_path=[include_greeter, include_hello])
         self.assertPkgConfigLinkage('hello', include_path=[include_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -19,3 +19,21 @@ class GenerateCompletionTest(SubprocessTestCase):
     def test_completion(self):
         output = self.assertPopen(mopack_cmd('generate-completion', '-sbash'))
         self.assertRegex(output, r'(?m)^# AUTOMATICALLY GENERATED by .*shtab')
+
+
+class CacheTest(SubprocessTestCase):
+    def setUp(self):
+        self.stage = stage_dir('cache')
+        self.cache_env = {'MOPACK_CACHE_DIR': self.stage}
+
+    def test_list_empty(self):
+        self.assertOutput(mopack_cmd('cache', '--json'), '[]\n',
+                          extra_env=self.cache_env)
+
+    def test_prune_empty(self):
+        self.assertPopen(mopack_cmd('cache', '--prune', '--max-size=1M'),
+                         extra_env=self.cache_env)
+
+    def test_disabled(self):
+        self.assertPopen(mopack_cmd('cache'),
+                         extra_env={'MOPACK_CACHE_DIR': ''}, returncode=1)
@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -22,7 +21,7 @@ class TestConan(IntegrationTest):
             libraries=['zdll' if platform_name() == 'windows' else 'z']
         )
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 conan={'build': ['missing'], 'extra_args': ['-gCMakeDeps']}
@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.platforms import platform_name
@@ -27,7 +26,7 @@ class TestConditional(IntegrationTest):
             include = os.path.join(test_data_dir, 'hello-bfg', 'include')
         self.assertPkgConfigLinkage('hello', include_path=[include])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         if want_tarball:
             hellopkg = cfg_tarball_pkg(
                 'hello', config,
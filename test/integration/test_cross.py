@@ -1,4 +1,3 @@
-import json
 import os
 from unittest import skipIf
 
@@ -37,7 +36,7 @@ class TestCross(IntegrationTest):
             ], include_path=[include_greeter, include_hello])
         self.assertPkgConfigLinkage('hello', include_path=[include_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={'toolchain': toolchain}),
             'packages': [
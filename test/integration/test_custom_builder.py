@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.path import pushd
@@ -22,7 +21,7 @@ class TestCustomBuilder(IntegrationTest):
             os.path.join(self.pkgsrcdir, 'hello', 'hello-bfg', 'include'),
         ])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
@@ -63,7 +62,7 @@ class TestCustomBuilderDeploy(IntegrationTest):
             os.path.join(self.pkgsrcdir, 'hello', 'hello-bfg', 'include'),
         ])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}}
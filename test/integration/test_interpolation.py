@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -21,7 +20,7 @@ class TestInterpolation(IntegrationTest):
             os.path.join(test_data_dir, 'hello-bfg', 'include'),
         ])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -46,7 +45,7 @@ class TestInterpolation(IntegrationTest):
             os.path.join(test_data_dir, 'hello-bfg', 'include'),
         ])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
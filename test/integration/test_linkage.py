@@ -1,4 +1,7 @@
 import os
+import subprocess
+import time
+import unittest
 
 from . import *
 
@@ -24,6 +27,7 @@ class TestLinkage(IntegrationTest):
         }
         self.assertLinkageOutput('hello', expected_output_hello)
         self.assertLinkageOutput('hello', expected_output_hello, ['--strict'])
+        self.assertExists('mopack/linkage_cache')
 
         # Linkage from wrong directory.
         wrongdir = stage_dir(self.name + '-wrongdir')
@@ -56,6 +60,22 @@ class TestLinkage(IntegrationTest):
         )
         self.assertLinkage('fake', extra_args=['--strict'], returncode=1)
 
+        # Linkage for multiple dependencies at once.
+        output = self.assertPopen(mopack_cmd('linkage', '--json', 'hello',
+                                             'fake'))
+        self.assertEqual(json.loads(output), {
+            'hello': {
+                'name': 'hello', 'type': 'pkg_config', 'pcnames': ['hello'],
+                'pkg_config_path': [os.path.join(
+                    self.stage, 'mopack', 'build', 'hello', 'pkgconfig'
+                )],
+            },
+            'fake': {
+                'name': 'fake', 'type': 'system', 'pcnames': ['fake'],
+                'pkg_config_path': [pkgconfdir],
+            },
+        })
+
         # Linkage from wrong directory.
         wrongdir = stage_dir(self.name + '-wrongdir')
         wrongdir_args = ['--directory=' + wrongdir]
@@ -82,3 +102,33 @@ class TestLinkage(IntegrationTest):
         # Linkage for `missing`.
         self.assertLinkage('missing', returncode=1)
         self.assertLinkage('missing', extra_args=['--strict'], returncode=1)
+
+    @unittest.skipIf(platform_name() == 'windows',
+                     'Unix domain sockets not supported')
+    def test_serve(self):
+        config = os.path.join(test_data_dir, 'mopack-tarball.yml')
+        self.assertResolve(config)
+
+        server = subprocess.Popen(mopack_cmd('serve'),
+                                  stderr=subprocess.DEVNULL)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+
+        sock = os.path.join(self.mopackdir, 'mopack.sock')
+        for i in range(50):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.1)
+        self.assertExists(sock)
+
+        self.assertLinkageOutput('hello', {
+            'name': 'hello', 'type': 'pkg_config', 'pcnames': ['hello'],
+            'pkg_config_path': [os.path.join(self.stage, 'mopack', 'build',
+                                             'hello', 'pkgconfig')],
+        })
+        self.assertOutput(mopack_cmd('list-files'), config + '\n')
+        self.assertLinkage('missing', extra_args=['--strict'], returncode=1)
+
+        server.terminate()
+        server.wait()
+        self.assertNotExists(sock)
@@ -30,7 +30,7 @@ class TestLocal(IntegrationTest):
         self.assertEqual(output, [os.path.join(config, 'mopack.yml'),
                                   os.path.join(config, 'mopack-local.yml')])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 conan={'build': ['missing']}
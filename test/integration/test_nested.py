@@ -1,4 +1,3 @@
-import json
 import os
 import sys
 from textwrap import dedent
@@ -42,7 +41,7 @@ class TestNested(IntegrationTest):
             ], include_path=[include_greeter, include_hello])
         self.assertPkgConfigLinkage('hello', include_path=[include_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -112,7 +111,7 @@ class TestNested(IntegrationTest):
             ], include_path=[include_greeter, include_hello])
         self.assertPkgConfigLinkage('hello', include_path=[include_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -34,7 +34,7 @@ class TestQt(IntegrationTest):
 
         self.assertLinkage('Qt5', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
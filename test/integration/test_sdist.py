@@ -1,7 +1,9 @@
 import json
 import os
+import threading
 from unittest import skipIf
 
+from mopack.artifact_server import ArtifactServer
 from mopack.path import pushd
 from mopack.platforms import platform_name
 
@@ -37,7 +39,7 @@ class TestDirectory(SDistTest):
         implicit_cfg = os.path.join(test_data_dir, 'hello-bfg', 'mopack.yml')
         self.check_list_files([config], [implicit_cfg])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -67,7 +69,7 @@ class TestDirectory(SDistTest):
         implicit_cfg = os.path.join(test_data_dir, 'hello-bfg', 'mopack.yml')
         self.check_list_files([config], [implicit_cfg])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -80,6 +82,34 @@ class TestDirectory(SDistTest):
             ],
         })
 
+    def test_resolve_unchanged(self):
+        config = os.path.join(test_data_dir, 'mopack-directory-implicit.yml')
+        cfg_line = r'(?m)^    \$ bfg9000 configure .+\bhello\b.*$'
+        self.assertRegex(self.assertResolve(config), cfg_line)
+        fingerprint = slurp_metadata()['metadata']['packages'][0][
+            'fingerprint'
+        ]
+        self.assertIsNotNone(fingerprint)
+
+        # Resolving again shouldn't rebuild the package.
+        output = self.assertResolve(config)
+        self.assertRegex(output, r'\bhello already up to date\b')
+        self.assertNotRegex(output, cfg_line)
+        self.assertEqual(slurp_metadata()['metadata']['packages'][0][
+            'fingerprint'
+        ], fingerprint)
+        self.assertPkgConfigLinkage('hello', include_path=[
+            os.path.join(test_data_dir, 'hello-bfg', 'include'),
+        ])
+
+    def test_resolve_jobs(self):
+        config = os.path.join(test_data_dir, 'mopack-directory-implicit.yml')
+        output = self.assertResolve(config, ['--jobs=2'])
+        self.assertRegex(output, r'(?m)^    \$ ninja -j2$')
+        self.assertPkgConfigLinkage('hello', include_path=[
+            os.path.join(test_data_dir, 'hello-bfg', 'include'),
+        ])
+
 
 class TestTarball(SDistTest):
     name = 'tarball'
@@ -98,7 +128,7 @@ class TestTarball(SDistTest):
         ])
         self.check_list_files([config])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -123,6 +153,55 @@ class TestTarball(SDistTest):
             self.assertExists(lib_prefix + 'pkgconfig/hello.pc')
 
 
+class TestArtifactCache(SDistTest):
+    name = 'artifact-cache'
+    deploy = True
+
+    def check_resolve(self, location):
+        config = os.path.join(test_data_dir, 'mopack-tarball.yml')
+        cfg_line = r'(?m)^    \$ bfg9000 configure .+\bhello\b.*$'
+        env = dict(test_env, MOPACK_ARTIFACT_CACHE=location)
+        self.assertRegex(self.assertResolve(config, extra_env=env), cfg_line)
+
+        # Resolve again in a new build directory (with the same install
+        # prefix), which should reuse the artifact from the first build.
+        prefix = self.prefix
+        self.setUp()
+        self.prefix = prefix
+        output = self.assertResolve(config, extra_env=env)
+        self.assertRegex(output, r'\bhello from artifact cache\b')
+        self.assertNotRegex(output, cfg_line)
+        self.assertExists('mopack/build/hello/')
+        self.assertPkgConfigLinkage('hello', include_path=[
+            os.path.join(self.pkgsrcdir, 'hello', 'hello-bfg', 'include'),
+        ])
+
+        self.assertPopen(mopack_cmd('deploy'))
+        include_prefix = '' if platform_name() == 'windows' else 'include/'
+        lib_prefix = '' if platform_name() == 'windows' else 'lib/'
+        with pushd(self.prefix):
+            self.assertExists(include_prefix + 'hello.hpp')
+            self.assertExists(lib_prefix + 'pkgconfig/hello.pc')
+
+    def test_resolve(self):
+        self.check_resolve(stage_dir(self.name + '-store', chdir=False))
+
+    def test_resolve_remote(self):
+        server = ArtifactServer(('127.0.0.1', 0), stage_dir(
+            self.name + '-store', chdir=False
+        ))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.addCleanup(stop)
+        self.check_resolve(server.url)
+
+
 class TestTarballPatch(SDistTest):
     name = 'tarball-patch'
     deploy = True
@@ -140,7 +219,7 @@ class TestTarballPatch(SDistTest):
         ])
         self.check_list_files([config])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -185,7 +264,7 @@ class TestGit(SDistTest):
                                     'mopack.yml')
         self.check_list_files([config], [implicit_cfg])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
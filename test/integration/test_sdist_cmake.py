@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.path import pushd
@@ -36,7 +35,7 @@ class TestInnerCMake(IntegrationTest):
                                include_path=[include_hello],
                                library_path=[library_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
@@ -107,7 +106,7 @@ class TestOuterCMake(IntegrationTest):
         self.assertPkgConfigLinkage('hello', include_path=[include_hello],
                                     library_path=[library_hello])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_dirs': {'prefix': self.prefix}},
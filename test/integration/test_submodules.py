@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -27,7 +26,7 @@ class TestSubmodules(IntegrationTest):
             )
         self.assertLinkage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -75,7 +74,7 @@ class TestSubmodulesPath(IntegrationTest):
             )
         self.assertLinkage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata()
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -6,6 +6,7 @@ from .. import mock_open_log, rehydrate_kwargs
 
 from mopack.builders import Builder
 from mopack.builders.b2 import B2Builder
+from mopack.jobserver import JobServer
 from mopack.origins.sdist import DirectoryPackage
 from mopack.shell import ShellArguments
 
@@ -17,7 +18,6 @@ class TestB2Builder(BuilderTest):
         builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         stagedir = os.path.join(builddir, 'stage')
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.b2.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -25,13 +25,12 @@ class TestB2Builder(BuilderTest):
             ), 'a')
             mcall.assert_called_with([
                 'b2', '--build-dir=' + builddir, '--stagedir=' + stagedir
-            ] + extra_args, env=env)
+            ] + extra_args, env=env, cwd=self.srcdir)
 
     def check_deploy(self, pkg, extra_args=[], env={}):
         builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         stagedir = os.path.join(builddir, 'stage')
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.b2.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -40,7 +39,7 @@ class TestB2Builder(BuilderTest):
             mcall.assert_called_with([
                 'b2', 'install', '--build-dir=' + builddir,
                 '--stagedir=' + stagedir
-            ] + extra_args, env=env)
+            ] + extra_args, env=env, cwd=self.srcdir)
 
     def test_basic(self):
         pkg = self.make_package_and_builder('foo')
@@ -49,6 +48,20 @@ class TestB2Builder(BuilderTest):
         self.check_build(pkg)
         self.check_deploy(pkg)
 
+    def test_jobserver(self):
+        pkg = self.make_package_and_builder('foo')
+        builddir = os.path.join(self.pkgdir, 'build', pkg.name)
+        stagedir = os.path.join(builddir, 'stage')
+        with JobServer(2) as jobserver, \
+             mock.patch('mopack.log.LogFile.jobserver', jobserver), \
+             mock_open_log(), \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.builder.build(self.metadata, pkg)
+            mcall.assert_called_with([
+                'b2', '-j2', '--build-dir=' + builddir,
+                '--stagedir=' + stagedir
+            ], env={}, cwd=self.srcdir)
+
     def test_env(self):
         pkg = self.make_package_and_builder(
             'foo', env={'VAR': 'value'}, pkg_args={'env': {'PKG': 'package'}},
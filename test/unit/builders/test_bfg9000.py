@@ -15,11 +15,11 @@ from mopack.objutils import Unset
 class TestBfg9000Builder(BuilderTest):
     builder_type = Bfg9000Builder
 
-    def check_build(self, pkg, extra_args=[], env={}):
+    def check_build(self, pkg, extra_args=[], env={}, ninja_env=None):
+        if ninja_env is None:
+            ninja_env = env
         builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -27,20 +27,20 @@ class TestBfg9000Builder(BuilderTest):
             ), 'a')
             mcall.assert_has_calls([
                 mock.call(['bfg9000', 'configure', builddir] + extra_args,
-                          env=env),
-                mock.call(['ninja'], env=env)
+                          env=env, cwd=self.srcdir),
+                mock.call(['ninja'], env=ninja_env, cwd=builddir)
             ])
 
     def check_deploy(self, pkg, env={}):
+        builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_called_with(['ninja', 'install'], env=env)
+            mcall.assert_called_with(['ninja', 'install'], env=env,
+                                     cwd=builddir)
 
     def test_basic(self):
         pkg = self.make_package_and_builder('foo')
@@ -63,6 +63,22 @@ class TestBfg9000Builder(BuilderTest):
         self.check_build(pkg, env=env)
         self.check_deploy(pkg, env=env)
 
+    def test_compiler_cache(self):
+        pkg = self.make_package_and_builder('foo', common_options={
+            'compiler_cache': 'sccache', 'compiler_cache_dir': 'sccache',
+            'env': {'CC': 'gcc', 'CXX': 'g++'},
+        })
+        # The compilers are only wrapped when configuring, since bfg9000
+        # saves them in the generated build files.
+        cache_dir = os.path.join(self.pkgdir, 'sccache')
+        self.check_build(pkg, env={
+            'CC': 'sccache gcc', 'CXX': 'sccache g++',
+            'SCCACHE_DIR': cache_dir,
+        }, ninja_env={'CC': 'gcc', 'CXX': 'g++', 'SCCACHE_DIR': cache_dir})
+        self.check_deploy(pkg, env={
+            'CC': 'gcc', 'CXX': 'g++', 'SCCACHE_DIR': cache_dir,
+        })
+
     def test_extra_args(self):
         pkg = self.make_package_and_builder('foo', extra_args='--extra args')
         self.assertEqual(pkg.builder.name, 'foo')
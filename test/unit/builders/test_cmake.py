@@ -16,9 +16,9 @@ class TestCMakeBuilder(BuilderTest):
     builder_type = CMakeBuilder
 
     def check_build(self, pkg, extra_args=[], env={}):
+        builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -26,20 +26,20 @@ class TestCMakeBuilder(BuilderTest):
             ), 'a')
             mcall.assert_has_calls([
                 mock.call(['cmake', self.srcdir, '-G', 'Ninja'] + extra_args,
-                          env=env),
-                mock.call(['ninja'], env=env)
+                          env=env, cwd=builddir),
+                mock.call(['ninja'], env=env, cwd=builddir)
             ])
 
     def check_deploy(self, pkg, env={}):
+        builddir = os.path.join(self.pkgdir, 'build', pkg.name)
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_called_with(['ninja', 'install'], env=env)
+            mcall.assert_called_with(['ninja', 'install'], env=env,
+                                     cwd=builddir)
 
     def test_basic(self):
         pkg = self.make_package_and_builder('foo')
@@ -62,6 +62,17 @@ class TestCMakeBuilder(BuilderTest):
         self.check_build(pkg, env=env)
         self.check_deploy(pkg, env=env)
 
+    def test_compiler_cache(self):
+        pkg = self.make_package_and_builder('foo', common_options={
+            'compiler_cache': 'ccache', 'compiler_cache_dir': 'ccache',
+        })
+        env = {'CCACHE_DIR': os.path.join(self.pkgdir, 'ccache')}
+        self.check_build(pkg, extra_args=[
+            '-DCMAKE_C_COMPILER_LAUNCHER=ccache',
+            '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache',
+        ], env=env)
+        self.check_deploy(pkg, env=env)
+
     def test_extra_args(self):
         pkg = self.make_package_and_builder('foo', extra_args='--extra args')
         self.assertEqual(pkg.builder.name, 'foo')
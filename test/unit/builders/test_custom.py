@@ -15,22 +15,24 @@ from mopack.shell import ShellArguments
 class TestCustomBuilder(BuilderTest):
     builder_type = CustomBuilder
 
-    def check_build(self, pkg, build_commands=None, env={}):
+    def check_build(self, pkg, build_commands=None, env={}, cwd=None):
         if build_commands is None:
             builddir = os.path.join(self.pkgdir, 'build', pkg.name)
             build_commands = [i.args({
                 'srcdir': self.srcdir, 'builddir': builddir
             }) for i in pkg.builder.build_commands]
+        if cwd is None:
+            cwd = [self.srcdir] * len(build_commands)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.custom.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', pkg.name + '.log'
             ), 'a')
-            mcall.assert_has_calls([mock.call(i, env=env)
-                                    for i in build_commands])
+            mcall.assert_has_calls([mock.call(i, env=env, cwd=j)
+                                    for i, j in zip(build_commands, cwd)])
 
     def test_basic(self):
         pkg = self.make_package_and_builder('foo', build_commands=[
@@ -62,6 +64,18 @@ class TestCustomBuilder(BuilderTest):
             'GLOBAL': 'global', 'PKG': 'package', 'VAR': 'value'
         })
 
+    def test_compiler_cache(self):
+        pkg = self.make_package_and_builder('foo', build_commands=[
+            'configure', 'make',
+        ], outdir='build', common_options={
+            'compiler_cache': 'ccache', 'compiler_cache_dir': 'ccache',
+            'env': {'CC': 'gcc', 'CXX': 'g++'},
+        })
+        self.check_build(pkg, env={
+            'CC': 'ccache gcc', 'CXX': 'ccache g++',
+            'CCACHE_DIR': os.path.join(self.pkgdir, 'ccache'),
+        })
+
     def test_build_list(self):
         pkg = self.make_package_and_builder('foo', build_commands=[
             ['configure', '--foo'], ['make', '-j2']
@@ -108,13 +122,16 @@ class TestCustomBuilder(BuilderTest):
         self.check_build(pkg)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.custom.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_called_with(['make', 'install'], env={})
+            mcall.assert_called_with(
+                ['make', 'install'], env={},
+                cwd=os.path.join(self.pkgdir, 'build', 'foo')
+            )
 
     def test_cd(self):
         pkg = self.make_package_and_builder('foo', build_commands=[
@@ -129,13 +146,24 @@ class TestCustomBuilder(BuilderTest):
             ShellArguments(['make']),
         ])
 
-        with mock.patch('os.chdir') as mcd:
-            builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        with mock.patch('os.path.isdir', return_value=True) as misdir:
             self.check_build(pkg, build_commands=[
                 ['configure', self.srcdir + '/build'],
                 ['make'],
-            ])
-            mcd.assert_called_once_with(builddir)
+            ], cwd=[self.srcdir, builddir])
+            misdir.assert_called_once_with(builddir)
+
+    def test_cd_missing(self):
+        pkg = self.make_package_and_builder('foo', build_commands=[
+            'cd $builddir',
+        ], outdir='build')
+
+        with mock_open_log(), \
+             mock.patch('os.makedirs'), \
+             mock.patch('os.path.isdir', return_value=False), \
+             self.assertRaises(FileNotFoundError):
+            pkg.builder.build(self.metadata, pkg)
 
     def test_cd_invalid(self):
         pkg = self.make_package_and_builder('foo', build_commands=[
@@ -143,7 +171,7 @@ class TestCustomBuilder(BuilderTest):
         ], outdir='build')
 
         with mock_open_log(), \
-             mock.patch('mopack.builders.custom.pushd'), \
+             mock.patch('os.makedirs'), \
              self.assertRaises(RuntimeError):
             pkg.builder.build(self.metadata, pkg)
 
@@ -6,6 +6,7 @@ from .. import mock_open_log, rehydrate_kwargs
 
 from mopack.builders import Builder
 from mopack.builders.ninja import NinjaBuilder
+from mopack.jobserver import JobServer
 from mopack.shell import ShellArguments
 
 
@@ -14,25 +15,22 @@ class TestNinjaBuilder(BuilderTest):
 
     def check_build(self, pkg, extra_args=[], env={}):
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.ninja.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', pkg.name + '.log'
             ), 'a')
-            mcall.assert_called_with(['ninja'], env=env)
+            mcall.assert_called_with(['ninja'], env=env, cwd=self.srcdir)
 
     def check_deploy(self, pkg, env={}):
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.ninja.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             pkg.builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_called_with(['ninja', 'install'], env=env)
+            mcall.assert_called_with(['ninja', 'install'], env=env,
+                                     cwd=self.srcdir)
 
     def test_basic(self):
         pkg = self.make_package_and_builder('foo')
@@ -55,6 +53,16 @@ class TestNinjaBuilder(BuilderTest):
         self.check_build(pkg, env=env)
         self.check_deploy(pkg, env=env)
 
+    def test_jobserver(self):
+        pkg = self.make_package_and_builder('foo')
+        with JobServer(2) as jobserver, \
+             mock.patch('mopack.log.LogFile.jobserver', jobserver), \
+             mock_open_log(), \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.builder.build(self.metadata, pkg)
+            mcall.assert_called_with(['ninja', '-j2'], env={},
+                                     cwd=self.srcdir)
+
     def test_extra_args(self):
         pkg = self.make_package_and_builder('foo', extra_args='--extra args')
         self.assertEqual(pkg.builder.name, 'foo')
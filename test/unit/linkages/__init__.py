@@ -1,4 +1,5 @@
 import os
+from unittest import mock
 
 from .. import OptionsTest, MockPackage, through_json  # noqa: F401
 
@@ -15,6 +16,12 @@ class LinkageTest(OptionsTest):
         super().setUp()
         self.metadata = Metadata(self.pkgdir)
 
+        # Don't remember pkg-config's search path between tests.
+        for i in ('_default_search_paths', '_indexes'):
+            patcher = mock.patch.dict('mopack.pkg_config.' + i, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def make_linkage(self, *args, **kwargs):
         if len(args) == 1:
             linkage_type = self.linkage_type
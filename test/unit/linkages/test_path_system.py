@@ -1,5 +1,7 @@
 import os
 import shutil
+import subprocess
+import tempfile
 from os.path import abspath
 from textwrap import dedent
 from unittest import mock
@@ -11,9 +13,10 @@ from ... import call_pkg_config, test_stage_dir
 from mopack.dependencies import Dependency
 from mopack.linkages import Linkage
 from mopack.linkages.path_system import PathLinkage, SystemLinkage
-from mopack.options import Options
 from mopack.metadata import Metadata
+from mopack.options import Options
 from mopack.path import Path
+from mopack.pkg_config import PkgConfigIndex, PkgConfigResolver
 from mopack.shell import ShellArguments
 from mopack.types import FieldValueError
 
@@ -78,9 +81,12 @@ class TestPath(LinkageTest):
             pkg = MockPackage()
 
         with mock.patch('subprocess.run', side_effect=OSError()), \
+             mock.patch('mopack.pkg_config.get_index',
+                        side_effect=PkgConfigIndex), \
              mock.patch('mopack.linkages.path_system._system_include_path',
                         return_value=[Path('/mock/include')]), \
-             mock.patch('mopack.linkages.path_system.isfile', mock_isfile), \
+             mock.patch('mopack.path.DirectoryCache.isfile',
+                        staticmethod(mock_isfile)), \
              mock.patch('builtins.open', **open_args):
             self.assertEqual(linkage.version(self.metadata, pkg), expected)
 
@@ -108,8 +114,8 @@ class TestPath(LinkageTest):
                         return_value=[Path('/mock/lib')]), \
              mock.patch('mopack.linkages.path_system._system_lib_names',
                         return_value=['lib{}.so']), \
-             mock.patch('mopack.linkages.path_system.isfile',
-                        mock_isfile), \
+             mock.patch('mopack.path.DirectoryCache.isfile',
+                        staticmethod(mock_isfile)), \
              mock.patch('mopack.log.warning'):
             self.assertEqual(linkage.get_linkage(metadata, pkg, submodules),
                              expected)
@@ -220,6 +226,25 @@ class TestPath(LinkageTest):
         self.check_version(linkage, '1.0', header=uscore_header)
         self.check_version(linkage, None, header=bad_header)
 
+    def test_version_regex_cached(self):
+        with tempfile.TemporaryDirectory() as incdir:
+            header = os.path.join(incdir, 'foo.hpp')
+            with open(header, 'w') as f:
+                f.write('#define VERSION "1.0"\n')
+            os.utime(header, ns=(10**9, 10**9))
+
+            linkage = self.make_linkage('foo', headers=['foo.hpp'],
+                                        include_path=[incdir], version={
+                'type': 'regex',
+                'file': 'foo.hpp',
+                'regex': [r'#define VERSION "([\d\.]+)"']
+            })
+            pkg = MockPackage()
+            self.assertEqual(linkage.version(self.metadata, pkg), '1.0')
+            with mock.patch('builtins.open') as mopen:
+                self.assertEqual(linkage.version(self.metadata, pkg), '1.0')
+                mopen.assert_not_called()
+
     def test_invalid_version(self):
         with self.assertRaises(FieldValueError):
             self.make_linkage('foo', version={'type': 'goofy'})
@@ -236,7 +261,8 @@ class TestPath(LinkageTest):
             'libs': ['-L' + abspath('/mock/lib'), '-lfoo', '-lbar'],
         })
 
-        # Try getting linkage again with a different dependency linkage.
+        # Try getting linkage again with a different dependency linkage. Use
+        # new metadata, since it remembers the linkages it's already computed.
         path = '/mock/pkgconfig'
         dep_linkage = {'name': 'bar', 'type': self.type, 'pcnames': ['bar'],
                        'pkg_config_path': [path]}
@@ -245,7 +271,7 @@ class TestPath(LinkageTest):
             self.check_get_linkage(linkage, 'foo', None, {
                 'name': 'foo', 'type': self.type, 'pcnames': ['foo'],
                 'pkg_config_path': [self.pkgconfdir, path],
-            }, pkg=pkg)
+            }, pkg=pkg, metadata=Metadata(self.pkgdir))
 
     def test_include_path_relative(self):
         pkg = MockPackage(srcdir=self.srcdir, builddir=self.builddir)
@@ -494,6 +520,53 @@ class TestPath(LinkageTest):
             'libs': ['-L' + abspath('/mock/lib'), '-lbar', '-lfoo_sub'],
         })
 
+    def test_prepare(self):
+        pkg = MockPackage('foo', version='1.0', submodules={
+            'sub': {}, 'sub2': {},
+        }, submodule_required=False, _options=self.make_options())
+        linkage = self.make_linkage(pkg, submodule_linkage='$submodule')
+        self.metadata.save()
+
+        def pcpath(submodules=None):
+            return os.path.join(self.pkgconfdir,
+                                str(Dependency('foo', submodules)) + '.pc')
+
+        with mock.patch('mopack.linkages.path_system._system_include_path',
+                        return_value=[Path('/mock/include')]), \
+             mock.patch('mopack.linkages.path_system._system_lib_path',
+                        return_value=[Path('/mock/lib')]), \
+             mock.patch('mopack.linkages.path_system._system_lib_names',
+                        return_value=['lib{}.so']), \
+             mock.patch('mopack.path.DirectoryCache.isfile',
+                        staticmethod(mock_isfile)):
+            linkage.prepare(self.metadata, pkg)
+            for i in (None, ['sub'], ['sub2']):
+                self.assertTrue(os.path.exists(pcpath(i)))
+            self.check_pkg_config('foo', ['sub2'], {
+                'libs': ['-L' + abspath('/mock/lib'), '-lfoo', '-lsub2'],
+                'version': '1.0',
+            })
+
+            # Getting the linkage now only needs to read the .pc files.
+            with mock.patch('mopack.linkages.path_system.write_pkg_config',
+                            side_effect=AssertionError()), \
+                 mock.patch.object(PathLinkage, '_get_version',
+                                   side_effect=AssertionError()):
+                self.assertEqual(
+                    linkage.get_linkage(self.metadata, pkg, ['sub']),
+                    {'name': 'foo[sub]', 'type': self.type,
+                     'pcnames': ['foo[sub]'],
+                     'pkg_config_path': [self.pkgconfdir]}
+                )
+
+    def test_prepare_submodule_required(self):
+        pkg = MockPackage('foo', submodules='*', submodule_required=True,
+                          _options=self.make_options())
+        linkage = self.make_linkage(pkg)
+        with mock.patch.object(PathLinkage, 'get_linkage') as mget_linkage:
+            linkage.prepare(self.metadata, pkg)
+            mget_linkage.assert_not_called()
+
     def test_submodule_linkage(self):
         pkg = MockPackage('foo', submodules='*', submodule_required=True,
                           _options=self.make_options())
@@ -909,6 +982,22 @@ class TestSystem(TestPath):
             'pkg_config_path': [],
         }, find_pkg_config=True)
 
+    def test_pkg_config_in_process(self):
+        with tempfile.TemporaryDirectory() as pcdir:
+            with open(os.path.join(pcdir, 'foo.pc'), 'w') as f:
+                f.write('Name: foo\nDescription: foo\nVersion: 1.0\n')
+
+            linkage = self.make_linkage('foo')
+            pkg = MockPackage('foo', _options=self.make_options())
+            with mock.patch('mopack.linkages.path_system.make_resolver',
+                            return_value=PkgConfigResolver([pcdir])), \
+                 mock.patch('subprocess.run') as mrun:
+                self.assertEqual(linkage.get_linkage(self.metadata, pkg, None),
+                                 {'name': 'foo', 'type': 'system',
+                                  'pcnames': ['foo'], 'pkg_config_path': []})
+                self.assertEqual(linkage.version(self.metadata, pkg), '1.0')
+                mrun.assert_not_called()
+
     def test_pcname(self):
         linkage = self.make_linkage('foo', pcname='foopc')
         self.check_linkage(linkage, pcname='foopc')
@@ -918,6 +1007,40 @@ class TestSystem(TestPath):
             'pkg_config_path': [],
         }, find_pkg_config=True)
 
+    def test_pkg_config_not_found(self):
+        pkg = MockPackage('foo', _options=self.make_options())
+        linkage = self.make_linkage(pkg)
+        error = subprocess.CalledProcessError(
+            1, ['pkg-config'], stderr='Package foo was not found\n'
+        )
+
+        with mock.patch('subprocess.run', side_effect=error), \
+             mock.patch('mopack.linkages.path_system._system_include_path',
+                        return_value=[Path('/mock/include')]), \
+             mock.patch('mopack.linkages.path_system._system_lib_path',
+                        return_value=[Path('/mock/lib')]), \
+             mock.patch('mopack.linkages.path_system._system_lib_names',
+                        return_value=['lib{}.so']), \
+             mock.patch('mopack.path.DirectoryCache.isfile',
+                        staticmethod(mock_isfile)):
+            msg = ("pkg-config failed to find package 'foo':\n" +
+                   '  Package foo was not found')
+            with mock.patch('mopack.log.warning') as mwarn:
+                self.assertEqual(
+                    linkage.get_linkage(self.metadata, pkg, None),
+                    {'name': 'foo', 'type': 'system', 'pcnames': ['foo'],
+                     'pkg_config_path': [self.pkgconfdir]}
+                )
+                mwarn.assert_called_once_with(msg)
+
+            # Preparing the linkage while resolving doesn't warn, since any
+            # problems will be reported when the linkage is used.
+            with mock.patch('mopack.log.warning') as mwarn, \
+                 mock.patch('mopack.log.debug') as mdebug:
+                linkage.prepare(self.metadata, pkg)
+                mwarn.assert_not_called()
+                mdebug.assert_called_once_with(msg)
+
     def test_system_submodule_linkage(self):
         pkg = MockPackage('foo', submodules='*', submodule_required=True,
                           _options=self.make_options())
@@ -24,7 +24,9 @@ class TestPkgConfig(LinkageTest):
         self.assertEqual(linkage.pkg_config_path,
                          [Path('pkgconfig', 'builddir')])
 
-        with mock.patch('subprocess.run') as mrun:
+        with mock.patch('subprocess.run') as mrun, \
+             mock.patch.dict('mopack.pkg_config._default_search_paths',
+                             {('pkg-config',): []}):
             linkage.version(self.metadata, pkg)
             mrun.assert_called_once_with(
                 ['pkg-config', 'foo', '--modversion'],
@@ -32,6 +34,21 @@ class TestPkgConfig(LinkageTest):
                 env={'PKG_CONFIG_PATH': self.pkgconfdir}
             )
 
+        # Read the version from the .pc file if we can find it.
+        def mock_list_pc_files(p):
+            return (1, ['foo']) if p == self.pkgconfdir else (None, [])
+
+        pc_data = 'Name: foo\nDescription: foo\nVersion: 1.0\n'
+        with mock.patch('subprocess.run') as mrun, \
+             mock.patch.dict('mopack.pkg_config._default_search_paths',
+                             {('pkg-config',): []}), \
+             mock.patch.dict('mopack.pkg_config._indexes', clear=True), \
+             mock.patch('mopack.pkg_config._list_pc_files',
+                        mock_list_pc_files), \
+             mock.patch('builtins.open', mock.mock_open(read_data=pc_data)):
+            self.assertEqual(linkage.version(self.metadata, pkg), '1.0')
+            mrun.assert_not_called()
+
         self.assertEqual(
             linkage.get_linkage(self.metadata, pkg, None),
             {'name': 'foo', 'type': 'pkg_config', 'pcnames': ['foo'],
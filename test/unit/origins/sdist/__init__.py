@@ -43,9 +43,8 @@ class SDistTestCase(OriginTest):
 
     def check_resolve(self, pkg, *, extra_args=[], env={}):
         builddir = os.path.join(self.pkgdir, 'build', pkg.name)
+        srcdir = pkg.path_values(self.metadata)['srcdir']
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', pkg.name)]):
                 pkg.resolve(self.metadata)
@@ -54,8 +53,8 @@ class SDistTestCase(OriginTest):
             ), 'a')
             mcall.assert_has_calls([
                 mock.call(['bfg9000', 'configure', builddir] + extra_args,
-                          env=env),
-                mock.call(['ninja'], env=env),
+                          env=env, cwd=srcdir),
+                mock.call(['ninja'], env=env, cwd=builddir),
             ])
 
     def make_builder(self, builder_type, pkg, **kwargs):
@@ -1,5 +1,6 @@
 import os
 import subprocess
+import tempfile
 import yaml
 from io import StringIO
 from textwrap import dedent
@@ -73,6 +74,234 @@ class TestDirectory(SDistTestCase):
             pkg.fetch(self.metadata, self.config)
         self.assertEqual(pkg.builders, [builder])
         self.check_resolve(pkg, env={'BASE': 'base', 'VAR': 'value'})
+
+    def test_resolve_up_to_date(self):
+        with tempfile.TemporaryDirectory() as srcdir:
+            with open(os.path.join(srcdir, 'build.bfg'), 'w'):
+                pass
+            pkg = self.make_package('foo', path=srcdir, build='bfg9000',
+                                    fetch=True)
+            self.assertEqual(pkg.fingerprint, None)
+            with mock.patch('os.path.exists', return_value=True):
+                self.check_resolve(pkg)
+            fingerprint = pkg.fingerprint
+            self.assertNotEqual(fingerprint, None)
+
+            # Same package, same sources.
+            newpkg = self.make_package('foo', path=srcdir, build='bfg9000',
+                                       fetch=True)
+            with mock.patch('mopack.log.pkg_clean'):
+                self.assertEqual(pkg.clean_post(self.metadata, newpkg), False)
+            self.assertEqual(newpkg.fingerprint, fingerprint)
+            with mock.patch('os.path.exists', return_value=True), \
+                 mock.patch('mopack.log.LogFile.check_call') as mcall, \
+                 assert_logging([('resolve', 'foo already up to date')]):
+                newpkg.resolve(self.metadata)
+            mcall.assert_not_called()
+            self.assertEqual(newpkg.fingerprint, fingerprint)
+
+            # Same package, but the build directory is missing.
+            newpkg = self.make_package('foo', path=srcdir, build='bfg9000',
+                                       fetch=True)
+            newpkg.fingerprint = fingerprint
+            with mock.patch('os.path.exists', return_value=False):
+                self.check_resolve(newpkg)
+
+            # Same package, different sources.
+            os.utime(os.path.join(srcdir, 'build.bfg'), ns=(10**9, 10**9))
+            newpkg = self.make_package('foo', path=srcdir, build='bfg9000',
+                                       fetch=True)
+            newpkg.fingerprint = fingerprint
+            with mock.patch('os.path.exists', return_value=True):
+                self.check_resolve(newpkg)
+            self.assertNotEqual(newpkg.fingerprint, fingerprint)
+
+    def test_resolve_up_to_date_in_source(self):
+        # Builders that build in the source directory may not create their
+        # output directory, if they even have one.
+        for outdir in (None, 'build'):
+            with self.subTest(outdir=outdir):
+                self.check_resolve_up_to_date_in_source(outdir)
+
+    def check_resolve_up_to_date_in_source(self, outdir):
+        build = {'type': 'custom', 'build_commands': ['make'],
+                 'outdir': outdir}
+        with tempfile.TemporaryDirectory() as srcdir:
+            with open(os.path.join(srcdir, 'Makefile'), 'w'):
+                pass
+
+            def make(*args, **kwargs):
+                with open(os.path.join(srcdir, 'foo.o'), 'w') as f:
+                    f.write('output')
+
+            pkg = self.make_package('foo', path=srcdir, build=build,
+                                    linkage='path', fetch=True)
+            with mock.patch('mopack.log.LogFile.open') as mopen, \
+                 mock.patch('mopack.log.pkg_resolve'):
+                logfile = mopen.return_value.__enter__.return_value
+                logfile.check_call.side_effect = make
+                pkg.resolve(self.metadata)
+            logfile.check_call.assert_called_once()
+            fingerprint = pkg.fingerprint
+            self.assertNotEqual(fingerprint, None)
+
+            # The build's outputs in the source directory don't make the
+            # package out of date.
+            newpkg = self.make_package('foo', path=srcdir, build=build,
+                                       linkage='path', fetch=True)
+            with mock.patch('mopack.log.pkg_clean'):
+                self.assertEqual(pkg.clean_post(self.metadata, newpkg), False)
+            with mock.patch('mopack.log.LogFile.check_call') as mcall, \
+                 assert_logging([('resolve', 'foo already up to date')]):
+                newpkg.resolve(self.metadata)
+            mcall.assert_not_called()
+            self.assertEqual(newpkg.fingerprint, fingerprint)
+
+    def test_resolve_artifact_cache(self):
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        key = pkg.compute_artifact_key(self.metadata)
+        self.assertNotEqual(key, pkg.compute_fingerprint(self.metadata))
+
+        self.assertEqual(pkg.pending_artifact_key(self.metadata), key)
+
+        # Artifact not found.
+        cache = self.metadata.artifact_cache = mock.Mock()
+        cache.restore.return_value = False
+        self.check_resolve(pkg)
+        cache.restore.assert_called_once_with(key, self.pkgdir)
+        cache.store.assert_called_once_with(key, self.pkgdir, [builddir])
+        self.assertEqual(pkg.fingerprint,
+                         pkg.compute_fingerprint(self.metadata))
+        with mock.patch('os.path.exists', return_value=True):
+            self.assertEqual(pkg.pending_artifact_key(self.metadata), None)
+
+        # Artifact found.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        cache = self.metadata.artifact_cache = mock.Mock()
+        cache.restore.return_value = True
+        with mock.patch('mopack.log.LogFile.check_call') as mcall, \
+             assert_logging([('resolve', 'foo from artifact cache')]):
+            pkg.resolve(self.metadata)
+        mcall.assert_not_called()
+        cache.restore.assert_called_once_with(key, self.pkgdir)
+        cache.store.assert_not_called()
+        self.assertEqual(pkg.fingerprint,
+                         pkg.compute_fingerprint(self.metadata))
+
+        # Error restoring artifact.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        self.assertEqual(pkg.compute_artifact_key(self.metadata), key)
+        cache = self.metadata.artifact_cache = mock.Mock()
+        cache.restore.side_effect = OSError('bad')
+        cache.store.side_effect = OSError('bad')
+        with mock.patch('mopack.log.warning') as mwarn:
+            self.check_resolve(pkg)
+        self.assertEqual(mwarn.call_count, 2)
+
+    def test_resolve_failed(self):
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        with mock.patch('os.path.exists', return_value=True):
+            pkg.fingerprint = pkg.compute_fingerprint(self.metadata)
+        pkg.forget_fingerprint()
+        error = subprocess.CalledProcessError(1, 'ninja')
+        with mock_open_log(), \
+             mock.patch('mopack.log.LogFile.check_call', side_effect=error), \
+             mock.patch('mopack.log.pkg_resolve'), \
+             mock.patch('os.path.exists', return_value=False), \
+             self.assertRaises(subprocess.CalledProcessError):
+            pkg.resolve(self.metadata)
+        self.assertEqual(pkg.fingerprint, None)
+
+    def test_resolve_compiler_cache(self):
+        opts = {'compiler_cache': 'ccache', 'compiler_cache_dir': 'ccache'}
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                common_options=opts, fetch=True)
+        stats = 'mopack.compiler_cache.CompilerCache.stats'
+        with mock_open_log(), \
+             mock.patch('mopack.log.LogFile.check_call'), \
+             mock.patch('mopack.log.LogFile.message') as mmsg, \
+             mock.patch('mopack.log.pkg_resolve'), \
+             mock.patch(stats, side_effect=[(1, 2), (4, 3)]):
+            pkg.resolve(self.metadata)
+        mmsg.assert_called_once_with('compiler cache (ccache): 3 hits, ' +
+                                     '1 misses')
+
+        # Don't report anything if we can't get the stats.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                common_options=opts, fetch=True)
+        with mock_open_log(), \
+             mock.patch('mopack.log.LogFile.check_call'), \
+             mock.patch('mopack.log.LogFile.message') as mmsg, \
+             mock.patch('mopack.log.pkg_resolve'), \
+             mock.patch(stats, return_value=None):
+            pkg.resolve(self.metadata)
+        mmsg.assert_not_called()
+
+    def test_fingerprint(self):
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        fingerprint = pkg.compute_fingerprint(self.metadata)
+        self.assertEqual(pkg.compute_fingerprint(self.metadata), fingerprint)
+
+        # Environment variables unrelated to the build don't affect the
+        # fingerprint...
+        for env in ({'PWD': '/path'}, {'FOO': '1'},
+                    {'SSH_CONNECTION': '10.0.0.1 50000 10.0.0.2 22'}):
+            pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                    common_options={'env': env}, fetch=True)
+            self.assertEqual(pkg.compute_fingerprint(self.metadata),
+                             fingerprint)
+
+        # ... but ones that affect the build do.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                common_options={'env': {'CC': 'clang'}},
+                                fetch=True)
+        self.assertNotEqual(pkg.compute_fingerprint(self.metadata),
+                            fingerprint)
+
+        # Likewise for artifact keys.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        key = pkg.compute_artifact_key(self.metadata)
+        for env in ({'FOO': '1'}, {'HOME': '/home/user', 'USER': 'user'}):
+            pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                    common_options={'env': env}, fetch=True)
+            self.assertEqual(pkg.compute_artifact_key(self.metadata), key)
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                common_options={'env': {'CC': 'clang'}},
+                                fetch=True)
+        self.assertNotEqual(pkg.compute_artifact_key(self.metadata), key)
+
+        # ... but the package's and builders' own environments always do.
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                env={'FOO': '1'}, fetch=True)
+        self.assertNotEqual(pkg.compute_artifact_key(self.metadata), key)
+        self.assertNotEqual(pkg.compute_fingerprint(self.metadata),
+                            fingerprint)
+        pkg = self.make_package('foo', path=self.srcpath, build={
+            'type': 'bfg9000', 'env': {'FOO': '1'},
+        }, fetch=True)
+        self.assertNotEqual(pkg.compute_artifact_key(self.metadata), key)
+        self.assertNotEqual(pkg.compute_fingerprint(self.metadata),
+                            fingerprint)
+
+        # So do the package's dependencies.
+        dep = self.make_package('bar', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
+                                fetch=True)
+        self.metadata.packages['bar'] = dep
+        with mock.patch.object(
+            DirectoryPackage, 'dependency_names', autospec=True,
+            side_effect=lambda self, m: {'bar'} if self is pkg else set()
+        ):
+            self.assertNotEqual(pkg.compute_fingerprint(self.metadata),
+                                fingerprint)
         self.check_linkage(pkg)
 
     def test_build(self):
@@ -172,17 +401,18 @@ class TestDirectory(SDistTestCase):
             ))
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', pkg.name)]):
                 pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'foo.log'
             ), 'a')
+            builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_has_calls([
-                mock.call(['cmake', self.srcpath, '-G', 'Ninja'], env={}),
-                mock.call(['ninja'], env={}),
+                mock.call(['cmake', self.srcpath, '-G', 'Ninja'], env={},
+                          cwd=builddir),
+                mock.call(['ninja'], env={}, cwd=builddir),
             ])
         self.check_linkage(pkg)
 
@@ -437,8 +667,6 @@ class TestDirectory(SDistTestCase):
         self.assertEqual(pkg.should_deploy, True)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', 'foo')]):
                 pkg.resolve(self.metadata)
@@ -448,19 +676,18 @@ class TestDirectory(SDistTestCase):
             builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
-                env={}
+                env={}, cwd=self.srcpath
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('deploy', 'foo')]):
                 pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_any_call(['ninja', 'install'], env={})
+            mcall.assert_any_call(['ninja', 'install'], env={},
+                                  cwd=builddir)
 
         pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
                                 deploy=False)
@@ -631,6 +858,7 @@ class TestDirectory(SDistTestCase):
                 'sub': UnmanagedSubmoduleProps(opts.expr_symbols)
             })
             self.assertEqual(pkg.submodule_required, False)
+            self.assertEqual(pkg.fingerprint, None)
             m.assert_called_once()
 
     def test_builder_types(self):
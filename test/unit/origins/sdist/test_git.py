@@ -1,3 +1,4 @@
+import io
 import os
 import subprocess
 from unittest import mock
@@ -11,7 +12,9 @@ from .... import *
 from mopack.builders.bfg9000 import Bfg9000Builder
 from mopack.builders.none import NoneBuilder
 from mopack.config import Config
+from mopack.download_cache import GitMirrorCache
 from mopack.linkages.path_system import SystemLinkage
+from mopack.metadata import _dump_binary, _load_binary
 from mopack.origins import Package
 from mopack.origins.apt import AptPackage
 from mopack.origins.sdist import GitPackage
@@ -32,41 +35,50 @@ class TestGit(SDistTestCase):
         super().setUp()
         self.config = Config([])
 
+        # Don't use the user's git mirrors when running tests.
+        env_patch = mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': ''})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+
     def package_fetch(self, pkg):
         with mock.patch('mopack.log.pkg_fetch'), \
              mock_open_log(), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch('mopack.log.LogFile.check_call'):
             pkg.fetch(self.metadata, self.config)
 
     def check_fetch(self, pkg, env={}, git_version=Version('2.49.0')):
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
         if pkg.rev[0] == 'branch':
-            git_cmds = [['git', 'clone', pkg.repository, srcdir,
-                         '--single-branch', '--branch', pkg.rev[1]]]
+            git_calls = [mock.call(['git', 'clone', pkg.repository, srcdir,
+                                    '--single-branch', '--branch', pkg.rev[1]],
+                                   env=env)]
         elif pkg.rev[0] == 'tag':
-            git_cmds = [['git', '-c', 'advice.detachedHead=false', 'clone',
-                         pkg.repository, srcdir, '--depth=1', '--branch',
-                         pkg.rev[1]]]
+            git_calls = [mock.call(['git', '-c', 'advice.detachedHead=false',
+                                    'clone', pkg.repository, srcdir,
+                                    '--depth=1', '--branch', pkg.rev[1]],
+                                   env=env)]
         else:  # pkg.rev[0] == 'commit'
             if git_version in SpecifierSet('>=2.49.0'):
-                git_cmds = [['git', '-c', 'advice.detachedHead=false', 'clone',
-                             pkg.repository, srcdir, '--depth=1', '--revision',
-                             pkg.rev[1]]]
+                git_calls = [mock.call(['git', '-c',
+                                        'advice.detachedHead=false', 'clone',
+                                        pkg.repository, srcdir, '--depth=1',
+                                        '--revision', pkg.rev[1]], env=env)]
             else:
-                git_cmds = [['git', 'clone', pkg.repository, srcdir],
-                            ['git', 'checkout', pkg.rev[1]]]
+                git_calls = [
+                    mock.call(['git', 'clone', pkg.repository, srcdir],
+                              env=env),
+                    mock.call(['git', 'checkout', pkg.rev[1]], env=env,
+                              cwd=srcdir),
+                ]
 
         with mock_open_log(), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch.object(GitPackage, '_git_version',
                                return_value=git_version), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('fetch',
                                   'foo from {}'.format(pkg.repository))]):
                 pkg.fetch(self.metadata, self.config)
-            mcall.assert_has_calls([mock.call(i, env=env) for i in git_cmds],
-                                   any_order=True)
+            mcall.assert_has_calls(git_calls, any_order=True)
 
     def test_http(self):
         pkg = self.make_package('foo', repository=self.srcurl, build='bfg9000')
@@ -75,6 +87,8 @@ class TestGit(SDistTestCase):
         self.assertEqual(pkg.repository, self.srcurl)
         self.assertEqual(pkg.rev, ['branch', 'master'])
         self.assertEqual(pkg.srcdir, '.')
+        self.assertEqual(pkg.partial, False)
+        self.assertEqual(pkg.sparse, [])
         self.assertEqual(pkg.pending_builders, 'bfg9000')
         self.assertEqual(pkg.needs_dependencies, True)
         self.assertEqual(pkg.should_deploy, True)
@@ -84,6 +98,109 @@ class TestGit(SDistTestCase):
         self.check_resolve(pkg)
         self.check_linkage(pkg)
 
+    def test_mirror(self):
+        pkg = self.make_package('foo', repository=self.srcurl,
+                                branch='mybranch', build='bfg9000')
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        mirror = os.path.abspath('/cache/git/repo.git')
+
+        with mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': '/cache'}), \
+             mock_open_log(), \
+             mock.patch('mopack.log.pkg_fetch'), \
+             mock.patch.object(GitMirrorCache, 'update',
+                               return_value=mirror) as mupdate, \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.fetch(self.metadata, self.config)
+            mupdate.assert_called_once_with(self.srcurl, mock.ANY, ['git'],
+                                            {})
+            mcall.assert_called_once_with(
+                ['git', 'clone', self.srcurl, srcdir, '--single-branch',
+                 '--branch', 'mybranch', '--reference', mirror,
+                 '--dissociate'], env={}
+            )
+
+    def test_mirror_shallow(self):
+        for rev in ({'tag': 'v1.0'}, {'commit': 'abcdefg'}):
+            pkg = self.make_package('foo', repository=self.srcurl,
+                                    build='bfg9000', **rev)
+            with mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': '/cache'}), \
+                 mock.patch.object(GitMirrorCache, 'update') as mupdate:
+                self.assertEqual(pkg._reference_args(['git'], {}, None), [])
+                mupdate.assert_not_called()
+
+    def test_mirror_partial(self):
+        pkg = self.make_package('foo', repository=self.srcurl, tag='v1.0',
+                                partial=True, build='bfg9000')
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+
+        with mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': '/cache'}), \
+             mock_open_log(), \
+             mock.patch('mopack.log.pkg_fetch'), \
+             mock.patch.object(GitMirrorCache, 'update') as mupdate, \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.fetch(self.metadata, self.config)
+            mupdate.assert_not_called()
+            mcall.assert_called_once_with(
+                ['git', '-c', 'advice.detachedHead=false', 'clone',
+                 self.srcurl, srcdir, '--depth=1', '--branch', 'v1.0',
+                 '--filter=blob:none'], env={}
+            )
+
+        pkg = self.make_package('foo', repository=self.srcurl,
+                                sparse='/include/', build='bfg9000')
+        with mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': '/cache'}), \
+             mock.patch.object(GitMirrorCache, 'update') as mupdate:
+            self.assertEqual(pkg._reference_args(['git'], {}, None), [])
+            mupdate.assert_not_called()
+
+    def test_mirror_local(self):
+        repo = os.path.abspath('/path/to/repo')
+        pkg = self.make_package('foo', repository=repo, build='bfg9000')
+
+        with mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': '/cache'}), \
+             mock.patch.object(GitMirrorCache, 'update') as mupdate:
+            self.assertEqual(pkg._reference_args(['git'], {}, None), [])
+            mupdate.assert_not_called()
+
+    def test_partial(self):
+        pkg = self.make_package('foo', repository=self.srcssh, tag='v1.0',
+                                partial=True, build='bfg9000')
+        self.assertEqual(pkg.partial, True)
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+
+        with mock_open_log(), \
+             mock.patch('mopack.log.pkg_fetch'), \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.fetch(self.metadata, self.config)
+            mcall.assert_called_once_with(
+                ['git', '-c', 'advice.detachedHead=false', 'clone',
+                 self.srcssh, srcdir, '--depth=1', '--branch', 'v1.0',
+                 '--filter=blob:none'], env={}
+            )
+
+    def test_sparse(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                sparse=['/include/', '*.txt'],
+                                srcdir='include', build='bfg9000')
+        self.assertEqual(pkg.sparse, ['/include/', '*.txt'])
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+
+        with mock_open_log(), \
+             mock.patch('mopack.log.pkg_fetch'), \
+             mock.patch('mopack.log.LogFile.check_call') as mcall:
+            pkg.fetch(self.metadata, self.config)
+            self.assertEqual(mcall.mock_calls, [
+                mock.call(['git', 'clone', self.srcssh, srcdir,
+                           '--single-branch', '--branch', 'master',
+                           '--sparse'], env={}),
+                mock.call(['git', 'sparse-checkout', 'set', '--no-cone', '--',
+                           '/include/', '**/*.txt'], env={}, cwd=srcdir),
+            ])
+
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                sparse='/include/', build='bfg9000')
+        self.assertEqual(pkg.sparse, ['/include/'])
+
     def test_ssh(self):
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000')
         builder = self.make_builder(Bfg9000Builder, pkg)
@@ -292,17 +409,18 @@ class TestGit(SDistTestCase):
                 linkage='pkg_config', fetch=True
             ))
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', pkg.name)]):
                 pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'foo.log'
             ), 'a')
+            builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_has_calls([
-                mock.call(['cmake', srcdir, '-G', 'Ninja'], env={}),
-                mock.call(['ninja'], env={}),
+                mock.call(['cmake', srcdir, '-G', 'Ninja'], env={},
+                          cwd=builddir),
+                mock.call(['ninja'], env={}, cwd=builddir),
             ])
         self.check_linkage(pkg)
 
@@ -424,11 +542,13 @@ class TestGit(SDistTestCase):
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([]):
                 pkg.fetch(self.metadata, self.config)
-            mcall.assert_called_once_with(['git', 'pull'], env={})
+            mcall.assert_called_once_with(
+                ['git', 'pull'], env={},
+                cwd=os.path.join(self.pkgdir, 'src', 'foo')
+            )
         self.check_resolve(pkg)
         self.check_linkage(pkg)
 
@@ -440,7 +560,6 @@ class TestGit(SDistTestCase):
                                 build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             with assert_logging([]):
                 pkg.fetch(self.metadata, self.config)
@@ -456,7 +575,6 @@ class TestGit(SDistTestCase):
                                 commit='abcdefg', build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             with assert_logging([]):
                 pkg.fetch(self.metadata, self.config)
@@ -471,8 +589,6 @@ class TestGit(SDistTestCase):
         self.assertEqual(pkg.should_deploy, True)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', 'foo')]):
                 pkg.resolve(self.metadata)
@@ -482,19 +598,18 @@ class TestGit(SDistTestCase):
             builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
-                env={}
+                env={}, cwd=pkg.path_values(self.metadata)['srcdir']
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('deploy', 'foo')]):
                 pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_any_call(['ninja', 'install'], env={})
+            mcall.assert_any_call(['ninja', 'install'], env={},
+                                  cwd=builddir)
 
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000',
                                 deploy=False)
@@ -511,6 +626,12 @@ class TestGit(SDistTestCase):
                                    build='bfg9000')
         newpkg = self.make_package('foo', repository=otherssh, build='bfg9000')
         inferredpkg = self.make_package('foo', repository=self.srcssh)
+        tagpkg = self.make_package('foo', repository=self.srcssh, tag='v1.0',
+                                   build='bfg9000')
+        srcdirpkg = self.make_package('foo', repository=self.srcssh,
+                                      srcdir='sub', build='bfg9000')
+        sparsepkg = self.make_package('foo', repository=self.srcssh,
+                                      sparse='/sub/', build='bfg9000')
         aptpkg = self.make_package(AptPackage, 'foo')
 
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
@@ -537,6 +658,30 @@ class TestGit(SDistTestCase):
             mlog.assert_not_called()
             mrmtree.assert_not_called()
 
+        # Git -> Git (different revision)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, tagpkg), True)
+            mlog.assert_not_called()
+            mrmtree.assert_not_called()
+            self.assertEqual(tagpkg._update_rev, True)
+
+        # Git -> Git (different srcdir)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, srcdirpkg),
+                             False)
+            mlog.assert_not_called()
+            mrmtree.assert_not_called()
+            self.assertFalse(hasattr(srcdirpkg, '_update_rev'))
+
+        # Git -> Git (different sparse checkout)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, sparsepkg), True)
+            mlog.assert_called_once()
+            mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
+
         # Git -> Apt
         with mock.patch('mopack.log.pkg_clean') as mlog, \
              mock.patch('shutil.rmtree') as mrmtree:
@@ -558,6 +703,65 @@ class TestGit(SDistTestCase):
             mlog.assert_not_called()
             mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
 
+    def test_update_rev(self):
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        detached_args = ['git', '-c', 'advice.detachedHead=false']
+
+        def check_update(pkg, git_calls, side_effect=None):
+            pkg._update_rev = True
+            mopen = mock.mock_open(read_data='export:\n  build: bfg9000')
+            with mock_open_log(), \
+                 mock.patch('os.path.exists', return_value=True), \
+                 mock.patch('builtins.open', mopen), \
+                 mock.patch('mopack.log.LogFile.check_call',
+                            side_effect=side_effect) as mcall:
+                with assert_logging([('fetch', 'foo updating to {} {}'
+                                      .format(*pkg.rev))]):
+                    pkg.fetch(self.metadata, self.config)
+                self.assertEqual(mcall.mock_calls, git_calls)
+
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                branch='mybranch', build='bfg9000')
+        check_update(pkg, [
+            mock.call(['git', 'remote', 'set-branches', 'origin', 'mybranch'],
+                      env={}, cwd=srcdir),
+            mock.call(['git', 'fetch', 'origin'], env={}, cwd=srcdir),
+            mock.call(['git', 'checkout', '-B', 'mybranch', '--track',
+                       'origin/mybranch'], env={}, cwd=srcdir),
+        ])
+
+        pkg = self.make_package('foo', repository=self.srcssh, tag='v1.0',
+                                build='bfg9000')
+        check_update(pkg, [
+            mock.call(['git', 'fetch', '--depth=1', 'origin', 'tag', 'v1.0'],
+                      env={}, cwd=srcdir),
+            mock.call(detached_args + ['checkout', 'v1.0'], env={},
+                      cwd=srcdir),
+        ])
+
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                commit='abcdefg', build='bfg9000')
+        check_update(pkg, [
+            mock.call(['git', 'fetch', '--depth=1', 'origin', 'abcdefg'],
+                      env={}, cwd=srcdir),
+            mock.call(detached_args + ['checkout', 'abcdefg'], env={},
+                      cwd=srcdir),
+        ])
+
+        # Fall back to fetching everything if we can't fetch the commit.
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                commit='abcdefg', build='bfg9000')
+        check_update(pkg, [
+            mock.call(['git', 'fetch', '--depth=1', 'origin', 'abcdefg'],
+                      env={}, cwd=srcdir),
+            mock.call(['git', 'fetch', '--depth=2147483647', 'origin',
+                       '+refs/heads/*:refs/remotes/origin/*'],
+                      env={}, cwd=srcdir),
+            mock.call(detached_args + ['checkout', 'abcdefg'], env={},
+                      cwd=srcdir),
+        ], side_effect=[subprocess.CalledProcessError(128, 'git'), None,
+                        None])
+
     def test_clean_post(self):
         otherssh = 'git@github.com:user/other.git'
 
@@ -679,6 +883,26 @@ class TestGit(SDistTestCase):
         with self.assertRaises(ConfigurationError):
             data = pkg.dehydrate()
 
+    def test_pickle(self):
+        opts = self.make_options()
+        pkg = GitPackage('foo', repository=self.srcssh, commit='abcdefg',
+                         build='bfg9000', _options=opts,
+                         config_file=self.config_file)
+        self.package_fetch(pkg)
+
+        # Set some state that's only used while resolving.
+        pkg._update_rev = True
+        with mock.patch('subprocess.run') as mrun:
+            mrun.return_value.stdout = 'git version 2.49.0'
+            pkg._git_version(['git'])
+        pkg.compute_fingerprint(self.metadata)
+
+        json_pkg = Package.rehydrate(through_json(pkg.dehydrate()),
+                                     _options=opts, **rehydrate_kwargs)
+        pickle_pkg = _load_binary(io.BytesIO(_dump_binary(pkg, opts)), opts)
+        self.assertEqual(pickle_pkg, json_pkg)
+        self.assertEqual(vars(pickle_pkg).keys(), vars(json_pkg).keys())
+
     def test_upgrade(self):
         opts = self.make_options()
         data = {
@@ -698,6 +922,8 @@ class TestGit(SDistTestCase):
                 'sub': UnmanagedSubmoduleProps(opts.expr_symbols)
             })
             self.assertEqual(pkg.submodule_required, False)
+            self.assertEqual(pkg.partial, False)
+            self.assertEqual(pkg.sparse, [])
             m.assert_called_once()
 
     def test_builder_types(self):
@@ -1,5 +1,8 @@
+import hashlib
 import os
 import subprocess
+from contextlib import contextmanager
+from io import BytesIO
 from unittest import mock
 
 from . import *
@@ -9,13 +12,14 @@ from .... import *
 from mopack.builders.bfg9000 import Bfg9000Builder
 from mopack.builders.none import NoneBuilder
 from mopack.config import Config
+from mopack.download_cache import DownloadCache, format_size
 from mopack.linkages.path_system import SystemLinkage
 from mopack.origins import Package
 from mopack.origins.apt import AptPackage
 from mopack.origins.sdist import TarballPackage
 from mopack.origins.submodules import UnmanagedSubmoduleProps
 from mopack.path import Path
-from mopack.types import ConfigurationError, Unset
+from mopack.types import ConfigurationError, FieldValueError, Unset
 
 
 def mock_exists(p):
@@ -32,6 +36,11 @@ class TestTarball(SDistTestCase):
         self.config = Config([])
         self.realopen = open
 
+        # Don't use the user's download cache when running tests.
+        env_patch = mock.patch.dict(os.environ, {'MOPACK_CACHE_DIR': ''})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+
     def mock_open(self, url, mode='rb'):
         return self.realopen(self.srcpath, mode)
 
@@ -44,15 +53,29 @@ class TestTarball(SDistTestCase):
              mock.patch('os.path.exists', return_value=False):
             pkg.fetch(self.metadata, self.config)
 
-    def check_fetch(self, pkg):
+    def check_fetch(self, pkg, download=None):
+        if download is None:
+            download = bool(pkg.url)
+
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
         where = pkg.url or pkg.path.string()
+        logs = [('fetch', 'foo from {}'.format(where))]
+        if download:
+            size = format_size(os.path.getsize(self.srcpath))
+            rate = format_size(os.path.getsize(self.srcpath) // 2)
+            logs.append(('DEBUG', (
+                'downloaded {} ({}) in 2.00s ({}/s; peak memory: 1.0 MiB)'
+            ).format(pkg.url, size, rate)))
+
         with mock.patch('builtins.open', self.mock_open), \
              mock.patch('mopack.origins.sdist.urlopen', self.mock_open), \
              mock.patch('tarfile.TarFile.extractall') as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
-             mock.patch('os.path.exists', return_value=False):
-            with assert_logging([('fetch', 'foo from {}'.format(where))]):
+             mock.patch('os.path.exists', return_value=False), \
+             mock.patch('time.monotonic', side_effect=[0, 2]), \
+             mock.patch('mopack.origins.sdist.peak_memory',
+                        return_value=1024 ** 2):
+            with assert_logging(logs):
                 pkg.fetch(self.metadata, self.config)
             mtar.assert_called_once_with(srcdir, None)
 
@@ -72,6 +95,95 @@ class TestTarball(SDistTestCase):
         self.check_resolve(pkg)
         self.check_linkage(pkg)
 
+    @property
+    def srcsha256(self):
+        with open(self.srcpath, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def mock_cache_open(self, *results):
+        # Return the given results from `DownloadCache.open`, opening the
+        # source archive for each one that's true.
+        results = iter(results)
+        return lambda url, checksum: (self.realopen(self.srcpath, 'rb')
+                                      if next(results) else None)
+
+    def test_url_cached(self):
+        pkg = self.make_package('foo', url=self.srcurl, sha256=self.srcsha256,
+                                build='bfg9000')
+        cache = DownloadCache(os.path.abspath('/path/to/cache'))
+
+        with mock.patch('mopack.origins.sdist.DownloadCache.from_env',
+                        return_value=cache), \
+             mock.patch.object(DownloadCache, 'open',
+                               side_effect=self.mock_cache_open(True)
+                               ) as mopen, \
+             mock.patch.object(DownloadCache, 'writer') as mwriter, \
+             mock.patch('mopack.origins.sdist.urlopen') as murlopen:
+            self.check_fetch(pkg, download=False)
+            mopen.assert_called_once_with(self.srcurl, pkg.checksum)
+            mwriter.assert_not_called()
+            murlopen.assert_not_called()
+        self.assertEqual(pkg.verified_checksum, pkg.checksum)
+
+    def test_url_uncached(self):
+        pkg = self.make_package('foo', url=self.srcurl, sha256=self.srcsha256,
+                                build='bfg9000')
+        cache = DownloadCache(os.path.abspath('/path/to/cache'))
+
+        written = BytesIO()
+
+        @contextmanager
+        def mock_writer(url, checksum):
+            yield written
+
+        with mock.patch('mopack.origins.sdist.DownloadCache.from_env',
+                        return_value=cache), \
+             mock.patch.object(DownloadCache, 'open',
+                               side_effect=self.mock_cache_open(False, True)
+                               ) as mopen, \
+             mock.patch.object(DownloadCache, 'writer',
+                               side_effect=mock_writer) as mwriter:
+            self.check_fetch(pkg)
+            mopen.assert_has_calls([mock.call(self.srcurl, pkg.checksum)] * 2)
+            mwriter.assert_called_once_with(self.srcurl, pkg.checksum)
+        with open(self.srcpath, 'rb') as f:
+            self.assertEqual(written.getvalue(), f.read())
+
+    def test_url_no_checksum(self):
+        pkg = self.make_package('foo', url=self.srcurl, build='bfg9000')
+
+        # Without a checksum, we can't tell if the file at the URL changed, so
+        # we don't cache it.
+        with mock.patch('mopack.origins.sdist.DownloadCache.from_env') as \
+             mfromenv:
+            self.check_fetch(pkg)
+            mfromenv.assert_not_called()
+
+    def test_url_evicted(self):
+        pkg = self.make_package('foo', url=self.srcurl, sha256=self.srcsha256,
+                                build='bfg9000')
+        cache = DownloadCache(os.path.abspath('/path/to/cache'))
+
+        @contextmanager
+        def mock_writer(url, checksum):
+            yield BytesIO()
+
+        # If our download is removed from the cache before we can open it,
+        # download it again.
+        with mock.patch('mopack.origins.sdist.DownloadCache.from_env',
+                        return_value=cache), \
+             mock.patch.object(DownloadCache, 'open',
+                               side_effect=self.mock_cache_open(False, False)
+                               ), \
+             mock.patch.object(DownloadCache, 'writer',
+                               side_effect=mock_writer), \
+             mock.patch('mopack.origins.sdist.urlopen',
+                        side_effect=self.mock_open) as murlopen:
+            with pkg._urlopen(self.srcurl) as f, \
+                 open(self.srcpath, 'rb') as expected:
+                self.assertEqual(f.read(), expected.read())
+            self.assertEqual(murlopen.call_count, 2)
+
     def test_path(self):
         pkg = self.make_package('foo', path=self.srcpath, build='bfg9000')
         builder = self.make_builder(Bfg9000Builder, pkg)
@@ -129,6 +241,52 @@ class TestTarball(SDistTestCase):
         self.check_resolve(pkg, env={'BASE': 'base', 'VAR': 'value'})
         self.check_linkage(pkg)
 
+    def test_checksum(self):
+        with open(self.srcpath, 'rb') as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        sha512 = hashlib.sha512(data).hexdigest()
+
+        for kwargs in ({'path': self.srcpath}, {'url': self.srcurl}):
+            pkg = self.make_package('foo', sha256=sha256, build='bfg9000',
+                                    **kwargs)
+            self.assertEqual(pkg.sha256, sha256)
+            self.assertEqual(pkg.sha512, None)
+            self.assertEqual(pkg.checksum, 'sha256:' + sha256)
+            self.check_fetch(pkg)
+            self.assertEqual(pkg.verified_checksum, 'sha256:' + sha256)
+
+            pkg = self.make_package('foo', sha256=sha256.upper(),
+                                    sha512=sha512, build='bfg9000', **kwargs)
+            self.assertEqual(pkg.sha256, sha256)
+            self.assertEqual(pkg.sha512, sha512)
+            self.assertEqual(pkg.checksum, 'sha512:' + sha512)
+            self.check_fetch(pkg)
+            self.assertEqual(pkg.verified_checksum, 'sha512:' + sha512)
+
+    def test_checksum_mismatch(self):
+        for kwargs in ({'path': self.srcpath}, {'url': self.srcurl}):
+            pkg = self.make_package('foo', sha256='0' * 64, build='bfg9000',
+                                    **kwargs)
+            with mock.patch('builtins.open', self.mock_open), \
+                 mock.patch('mopack.origins.sdist.urlopen', self.mock_open), \
+                 mock.patch('tarfile.TarFile.extractall') as mtar, \
+                 mock.patch('os.path.exists', return_value=False), \
+                 mock.patch('mopack.log.pkg_fetch'), \
+                 mock.patch('mopack.log.debug'):
+                with self.assertRaisesRegex(ValueError, '^sha256 mismatch'):
+                    pkg.fetch(self.metadata, self.config)
+                mtar.assert_not_called()
+            self.assertEqual(pkg.verified_checksum, None)
+
+    def test_invalid_checksum(self):
+        with self.assertRaises(FieldValueError):
+            self.make_package('foo', path=self.srcpath, sha256='0' * 63,
+                              build='bfg9000')
+        with self.assertRaises(FieldValueError):
+            self.make_package('foo', path=self.srcpath, sha512='0' * 64,
+                              build='bfg9000')
+
     def test_invalid_url_path(self):
         with self.assertRaises(TypeError):
             self.make_package('foo', build='bfg9000')
@@ -161,7 +319,6 @@ class TestTarball(SDistTestCase):
 
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
         with mock.patch('mopack.origins.sdist.urlopen', self.mock_open), \
-             mock.patch('mopack.origins.sdist.pushd'), \
              mock.patch('tarfile.TarFile.extractall') as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
              mock.patch('os.path.exists', return_value=False), \
@@ -175,7 +332,9 @@ class TestTarball(SDistTestCase):
                 pkg.fetch(self.metadata, self.config)
             mtar.assert_called_once_with(srcdir, None)
             mcall.assert_called_once_with(['patch', '-p1'], stdin=mopen(),
-                                          env={})
+                                          env={}, cwd=os.path.join(
+                                              srcdir, 'hello-bfg'
+                                          ))
         self.check_resolve(pkg)
         self.check_linkage(pkg)
 
@@ -262,17 +421,18 @@ class TestTarball(SDistTestCase):
                 fetch=True
             ))
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
+             mock.patch('os.makedirs'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', pkg.name)]):
                 pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'foo.log'
             ), 'a')
+            builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_has_calls([
-                mock.call(['cmake', srcdir, '-G', 'Ninja'], env={}),
-                mock.call(['ninja'], env={}),
+                mock.call(['cmake', srcdir, '-G', 'Ninja'], env={},
+                          cwd=builddir),
+                mock.call(['ninja'], env={}, cwd=builddir),
             ])
         self.check_linkage(pkg)
 
@@ -381,6 +541,39 @@ class TestTarball(SDistTestCase):
         with self.assertRaises(ValueError):
             pkg.get_linkage(self.metadata, ['invalid'])
 
+    def test_prefetch(self):
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000')
+        builder = self.make_builder(Bfg9000Builder, pkg)
+
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        with mock.patch('builtins.open', self.mock_open), \
+             mock.patch('tarfile.TarFile.extractall') as mtar, \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.path.exists', return_value=False):
+            with assert_logging([('fetch',
+                                  'foo from {}'.format(self.srcpath))]):
+                pkg.prefetch(self.metadata)
+                pkg.fetch(self.metadata, self.config)
+            mtar.assert_called_once_with(srcdir, None)
+        self.assertEqual(pkg.builders, [builder])
+        self.check_resolve(pkg)
+        self.check_linkage(pkg)
+
+    def test_prefetch_failure(self):
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000')
+
+        with mock.patch('builtins.open', self.mock_open), \
+             mock.patch('tarfile.TarFile.extractall',
+                        side_effect=RuntimeError()) as mtar, \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.path.exists', return_value=False):
+            with assert_logging([('fetch',
+                                  'foo from {}'.format(self.srcpath))]):
+                pkg.prefetch(self.metadata)
+            with self.assertRaises(RuntimeError):
+                pkg.fetch(self.metadata, self.config)
+            mtar.assert_called_once()
+
     def test_already_fetched(self):
         def mock_exists(p):
             return os.path.basename(p) == 'foo'
@@ -405,8 +598,6 @@ class TestTarball(SDistTestCase):
         self.check_fetch(pkg)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', 'foo')]):
                 pkg.resolve(self.metadata)
@@ -416,19 +607,18 @@ class TestTarball(SDistTestCase):
             builddir = os.path.join(self.pkgdir, 'build', 'foo')
             mcall.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
-                env={}
+                env={}, cwd=pkg.path_values(self.metadata)['srcdir']
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
-             mock.patch('mopack.builders.ninja.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('deploy', 'foo')]):
                 pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'deploy', 'foo.log'
             ), 'a')
-            mcall.assert_any_call(['ninja', 'install'], env={})
+            mcall.assert_any_call(['ninja', 'install'], env={},
+                                  cwd=builddir)
 
         pkg = self.make_package('foo', url='http://example.com',
                                 build='bfg9000', deploy=False)
@@ -490,6 +680,48 @@ class TestTarball(SDistTestCase):
             mlog.assert_not_called()
             mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
 
+    def test_clean_pre_checksum(self):
+        otherpath = os.path.join(test_data_dir, 'other_project.tar.gz')
+
+        oldpkg = self.make_package('foo', path=self.srcpath, sha256='0' * 64,
+                                   build='bfg9000')
+        oldpkg.guessed_srcdir = 'hello-bfg'
+        oldpkg.verified_checksum = 'sha256:' + '0' * 64
+        mirrorpkg = self.make_package('foo', url=self.srcurl, sha256='0' * 64,
+                                      build='bfg9000')
+        changedpkg = self.make_package('foo', path=otherpath, sha256='1' * 64,
+                                       build='bfg9000')
+        filespkg = self.make_package('foo', url=self.srcurl, sha256='0' * 64,
+                                     files='/hello-bfg/include/',
+                                     build='bfg9000')
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+
+        # Tarball -> Tarball (same checksum, different origin)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, mirrorpkg),
+                             False)
+            mlog.assert_not_called()
+            mrmtree.assert_not_called()
+            self.assertEqual(mirrorpkg.guessed_srcdir, 'hello-bfg')
+            self.assertEqual(mirrorpkg.verified_checksum,
+                             'sha256:' + '0' * 64)
+
+        # Tarball -> Tarball (different checksum)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, changedpkg),
+                             True)
+            mlog.assert_called_once()
+            mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
+
+        # Tarball -> Tarball (same checksum, different files)
+        with mock.patch('mopack.log.pkg_clean') as mlog, \
+             mock.patch('shutil.rmtree') as mrmtree:
+            self.assertEqual(oldpkg.clean_pre(self.metadata, filespkg), True)
+            mlog.assert_called_once()
+            mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
+
     def test_clean_post(self):
         otherpath = os.path.join(test_data_dir, 'other_project.tar.gz')
 
@@ -663,6 +895,9 @@ class TestTarball(SDistTestCase):
                 'sub': UnmanagedSubmoduleProps(opts.expr_symbols)
             })
             self.assertEqual(pkg.submodule_required, False)
+            self.assertEqual(pkg.sha256, None)
+            self.assertEqual(pkg.sha512, None)
+            self.assertEqual(pkg.verified_checksum, None)
             m.assert_called_once()
 
     def test_builder_types(self):
@@ -38,7 +38,6 @@ class TestConan(OriginTest):
 
     def check_resolve_all(self, pkgs, conanfile, extra_args=[]):
         with mock_open_log(mock_open_write()) as mopen, \
-             mock.patch('mopack.origins.conan.pushd'), \
              mock.patch('mopack.log.LogFile.check_call') as mcall:
             with assert_logging([('resolve', '{} from conan'.format(i.name))
                                  for i in pkgs]):
@@ -48,7 +47,7 @@ class TestConan(OriginTest):
             conandir = os.path.join(self.pkgdir, 'conan')
             mcall.assert_called_with(
                 ['conan', 'install'] + extra_args + ['--', conandir],
-                env={}
+                env={}, cwd=conandir
             )
 
     def check_linkage(self, pkg, *, submodules=None, linkage=None):
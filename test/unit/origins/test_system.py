@@ -25,6 +25,12 @@ class TestSystemPackage(OriginTest):
         super().setUp()
         self.clear_pkgdir()
 
+        # Don't remember pkg-config's search path between tests.
+        for i in ('_default_search_paths', '_indexes'):
+            patcher = mock.patch.dict('mopack.pkg_config.' + i, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def clear_pkgdir(self):
         if os.path.exists(self.pkgdir):
             shutil.rmtree(self.pkgdir)
@@ -53,8 +59,8 @@ class TestSystemPackage(OriginTest):
                         return_value=[Path('/mock/lib')]), \
              mock.patch('mopack.linkages.path_system._system_lib_names',
                         return_value=['lib{}.so']), \
-             mock.patch('mopack.linkages.path_system.isfile',
-                        mock_isfile):
+             mock.patch('mopack.path.DirectoryCache.isfile',
+                        staticmethod(mock_isfile)):
             self.assertEqual(pkg.get_linkage(self.metadata, submodules),
                              expected)
 
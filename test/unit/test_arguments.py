@@ -116,3 +116,15 @@ class TestConfigOptionAction(TestCase):
             self.action(None, args, 'goat')
         with self.assertRaises(arguments.ArgumentError):
             self.action(None, args, 'goat={')
+
+
+class TestPositiveInt(TestCase):
+    def test_valid(self):
+        self.assertEqual(arguments.positive_int('1'), 1)
+        self.assertEqual(arguments.positive_int('8'), 8)
+
+    def test_invalid(self):
+        with self.assertRaises(arguments.ArgumentTypeError):
+            arguments.positive_int('0')
+        with self.assertRaises(ValueError):
+            arguments.positive_int('goat')
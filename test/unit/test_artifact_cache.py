@@ -0,0 +1,296 @@
+import http.client
+import os
+import tempfile
+import threading
+from io import BytesIO
+from unittest import mock, TestCase
+
+from mopack.artifact_cache import *
+from mopack.artifact_server import ArtifactServer
+
+
+class TestMakeBackend(TestCase):
+    def test_path(self):
+        backend = make_backend('/path/to/cache')
+        self.assertIsInstance(backend, DirectoryBackend)
+        self.assertEqual(backend.path, '/path/to/cache')
+
+    def test_drive(self):
+        backend = make_backend('C:\\path\\to\\cache')
+        self.assertIsInstance(backend, DirectoryBackend)
+        self.assertEqual(backend.path, 'C:\\path\\to\\cache')
+
+    def test_file_url(self):
+        backend = make_backend('file:///path/to/cache')
+        self.assertIsInstance(backend, DirectoryBackend)
+        self.assertEqual(backend.path, '/path/to/cache')
+
+    def test_http(self):
+        backend = make_backend('http://localhost:8000/cache/')
+        self.assertIsInstance(backend, HTTPBackend)
+        self.assertEqual(backend.connection_type, http.client.HTTPConnection)
+        self.assertEqual(backend.netloc, 'localhost:8000')
+        self.assertEqual(backend.path, '/cache')
+
+        backend = make_backend('https://localhost/')
+        self.assertIsInstance(backend, HTTPBackend)
+        self.assertEqual(backend.connection_type, http.client.HTTPSConnection)
+        self.assertEqual(backend.netloc, 'localhost')
+        self.assertEqual(backend.path, '')
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "unknown artifact cache scheme 'foo'"):
+            make_backend('foo://path/to/cache')
+
+
+class TestDirectoryBackend(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.backend = DirectoryBackend(self.tmpdir.name)
+
+    def test_put_get(self):
+        self.backend.put('abcdef', BytesIO(b'data'))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmpdir.name, 'ab', 'abcdef.tar.gz'
+        )))
+
+        f = BytesIO()
+        self.assertTrue(self.backend.get('abcdef', f))
+        self.assertEqual(f.getvalue(), b'data')
+
+    def test_get_missing(self):
+        f = BytesIO()
+        self.assertFalse(self.backend.get('abcdef', f))
+        self.assertEqual(f.getvalue(), b'')
+
+    def test_put_error(self):
+        class BadFile:
+            def read(self, size):
+                raise OSError('bad file')
+
+        with self.assertRaises(OSError):
+            self.backend.put('abcdef', BadFile())
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, 'ab')), [])
+
+
+class TestHTTPBackend(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        self.server = ArtifactServer(('127.0.0.1', 0), self.tmpdir.name)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+
+        def stop():
+            self.server.shutdown()
+            thread.join()
+            self.server.server_close()
+
+        self.addCleanup(stop)
+        self.backend = HTTPBackend(self.server.url)
+        self.addCleanup(self.backend.close)
+
+    def test_put_get(self):
+        self.backend.put('abcdef', BytesIO(b'data'))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmpdir.name, 'ab', 'abcdef.tar.gz'
+        )))
+
+        f = BytesIO()
+        self.assertTrue(self.backend.get('abcdef', f))
+        self.assertEqual(f.getvalue(), b'data')
+
+    def test_get_missing(self):
+        f = BytesIO()
+        self.assertFalse(self.backend.get('abcdef', f))
+        self.assertEqual(f.getvalue(), b'')
+
+    def test_put_invalid(self):
+        with self.assertRaisesRegex(OSError, '^HTTP 404 '):
+            self.backend.put('not-a-key', BytesIO(b'data'))
+
+    def test_reuse_connection(self):
+        with mock.patch.object(
+            self.backend, 'connection_type',
+            side_effect=self.backend.connection_type
+        ) as mconn:
+            self.backend.put('abcdef', BytesIO(b'data'))
+            for i in range(3):
+                self.assertTrue(self.backend.get('abcdef', BytesIO()))
+                self.assertFalse(self.backend.get('012345', BytesIO()))
+            mconn.assert_called_once()
+
+    def test_reconnect(self):
+        self.backend.put('abcdef', BytesIO(b'data'))
+
+        # Simulate the server closing an idle connection.
+        conn = self.backend._connections[0]
+        with mock.patch.object(conn, 'getresponse',
+                               side_effect=http.client.RemoteDisconnected):
+            f = BytesIO()
+            self.assertTrue(self.backend.get('abcdef', f))
+            self.assertEqual(f.getvalue(), b'data')
+        self.assertEqual(len(self.backend._connections), 1)
+        self.assertIsNot(self.backend._connections[0], conn)
+
+
+class TestArtifactCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = ArtifactCache(DirectoryBackend(
+            os.path.join(self.tmpdir.name, 'cache')
+        ))
+        self.pkgdir = os.path.join(self.tmpdir.name, 'one', 'mopack')
+        self.builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        self.write_file(os.path.join(self.builddir, 'foo.pc'),
+                        'prefix={}\n'.format(self.builddir))
+        self.write_file(os.path.join(self.builddir, 'libfoo.so'),
+                        b'\0' + self.builddir.encode('utf-8'))
+
+    def write_file(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_from_env(self):
+        cache = ArtifactCache.from_env({artifact_cache_var: '/path'})
+        self.assertIsInstance(cache.backend, DirectoryBackend)
+        self.assertEqual(cache.backend.path, '/path')
+        self.assertEqual(ArtifactCache.from_env({artifact_cache_var: ''}),
+                         None)
+        self.assertEqual(ArtifactCache.from_env({}), None)
+
+    def test_restore_same_pkgdir(self):
+        self.cache.store('abcdef', self.pkgdir, [self.builddir])
+        self.write_file(os.path.join(self.builddir, 'extra'), 'extra')
+
+        self.assertTrue(self.cache.restore('abcdef', self.pkgdir))
+        self.assertEqual(sorted(os.listdir(self.builddir)),
+                         ['foo.pc', 'libfoo.so'])
+        self.assertEqual(sorted(os.listdir(self.pkgdir)), ['build'])
+        self.assertEqual(
+            self.read_file(os.path.join(self.builddir, 'foo.pc')),
+            'prefix={}\n'.format(self.builddir).encode('utf-8')
+        )
+
+    def test_restore_relocated(self):
+        self.cache.store('abcdef', self.pkgdir, [self.builddir])
+        mtime = os.stat(os.path.join(self.builddir, 'foo.pc')).st_mtime
+
+        pkgdir = os.path.join(self.tmpdir.name, 'two', 'mopack')
+        builddir = os.path.join(pkgdir, 'build', 'foo')
+        self.assertTrue(self.cache.restore('abcdef', pkgdir))
+
+        # Text files are relocated, but binary files are left alone.
+        pcfile = os.path.join(builddir, 'foo.pc')
+        self.assertEqual(self.read_file(pcfile),
+                         'prefix={}\n'.format(builddir).encode('utf-8'))
+        self.assertAlmostEqual(os.stat(pcfile).st_mtime, mtime, delta=1)
+        self.assertEqual(
+            self.read_file(os.path.join(builddir, 'libfoo.so')),
+            b'\0' + self.builddir.encode('utf-8')
+        )
+
+    def test_restore_missing(self):
+        pkgdir = os.path.join(self.tmpdir.name, 'two', 'mopack')
+        self.assertFalse(self.cache.restore('abcdef', pkgdir))
+        self.assertFalse(os.path.exists(pkgdir))
+
+    def test_restore_version_mismatch(self):
+        self.cache.store('abcdef', self.pkgdir, [self.builddir])
+        pkgdir = os.path.join(self.tmpdir.name, 'two', 'mopack')
+        with mock.patch.object(ArtifactCache, 'version', 2):
+            self.assertFalse(self.cache.restore('abcdef', pkgdir))
+        self.assertEqual(os.listdir(pkgdir), [])
+
+    def test_store_outside_pkgdir(self):
+        with self.assertRaisesRegex(ValueError, 'inside package directory'):
+            self.cache.store('abcdef', self.pkgdir, [self.tmpdir.name])
+
+
+class TestRemoteArtifactCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        self.local = ArtifactCache(DirectoryBackend(self.tmpdir.name))
+        self.pkgdir = os.path.join(self.tmpdir.name, 'mopack')
+        self.builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        os.makedirs(self.builddir)
+        with open(os.path.join(self.builddir, 'foo.pc'), 'w') as f:
+            f.write('prefix={}\n'.format(self.builddir))
+        self.local.store('abcdef', self.pkgdir, [self.builddir])
+
+        self.backend = mock.Mock(remote=True,
+                                 get=mock.Mock(side_effect=self.get))
+        self.cache = ArtifactCache(self.backend)
+        self.addCleanup(self.cache.close)
+
+    def get(self, key, file):
+        return self.local.backend.get(key, file)
+
+    def test_prefetch(self):
+        self.cache.prefetch(['abcdef', '012345', 'abcdef'])
+        self.assertEqual(self.backend.get.call_count, 2)
+
+        self.assertTrue(self.cache.restore('abcdef', self.pkgdir))
+        self.assertFalse(self.cache.restore('012345', self.pkgdir))
+        self.assertEqual(self.backend.get.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.builddir, 'foo.pc')))
+
+        # Once restored, prefetched artifacts are fetched again if needed.
+        self.assertTrue(self.cache.restore('abcdef', self.pkgdir))
+        self.assertEqual(self.backend.get.call_count, 3)
+
+    def test_prefetch_local(self):
+        self.backend.remote = False
+        self.cache.prefetch(['abcdef'])
+        self.backend.get.assert_not_called()
+
+    def test_prefetch_error(self):
+        self.backend.get.side_effect = OSError('bad')
+        with mock.patch('mopack.log.warning') as mwarn:
+            self.cache.prefetch(['abcdef', '012345'])
+        self.assertEqual(mwarn.call_count, 2)
+        self.assertFalse(self.cache.restore('abcdef', self.pkgdir))
+        self.assertEqual(self.backend.get.call_count, 2)
+
+    def test_store(self):
+        uploaded = threading.Event()
+        release = threading.Event()
+
+        def put(key, file):
+            uploaded.set()
+            release.wait()
+            self.assertEqual(key, '012345')
+            self.assertGreater(len(file.read()), 0)
+
+        self.backend.put.side_effect = put
+        self.cache.store('012345', self.pkgdir, [self.builddir])
+        uploaded.wait()
+        release.set()
+        self.cache.flush()
+        self.backend.put.assert_called_once()
+
+    def test_store_error(self):
+        self.backend.put.side_effect = OSError('bad')
+        with mock.patch('mopack.log.warning') as mwarn:
+            self.cache.store('012345', self.pkgdir, [self.builddir])
+            self.cache.flush()
+        mwarn.assert_called_once()
+
+    def test_close(self):
+        self.cache.prefetch(['abcdef'])
+        tmpdir = self.cache._tmpdir.name
+        self.assertEqual(len(os.listdir(tmpdir)), 1)
+        self.cache.close()
+        self.assertFalse(os.path.exists(tmpdir))
+        self.backend.close.assert_called_once_with()
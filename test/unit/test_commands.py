@@ -1,12 +1,16 @@
 import os
 from unittest import mock, TestCase
-from textwrap import dedent
 
 from . import mock_open_data
 
 from mopack import commands
 from mopack.config import Config
-from mopack.metadata import Metadata
+from mopack.dependencies import Dependency
+from mopack.jobserver import JobServer
+from mopack.linkage_cache import LinkageCache
+from mopack.log import LogFile
+from mopack.metadata import Metadata, MetadataChangedError
+from mopack.origins import Package
 from mopack.origins.apt import AptPackage
 from mopack.origins.sdist import DirectoryPackage
 
@@ -18,13 +22,11 @@ class CommandsTestCase(TestCase):
         with mock.patch('builtins.open', mock_open_data('')):
             return Config(files)
 
-    def make_apt_config(self):
-        cfg_data = dedent("""\
-          packages:
-            foo:
-              origin: apt
-              remote: libfoo1-dev
-        """)
+    def make_apt_config(self, names=('foo',)):
+        cfg_data = 'packages:\n' + ''.join(
+            '  {0}:\n    origin: apt\n    remote: lib{0}1-dev\n'.format(i)
+            for i in names
+        )
         with mock.patch('builtins.open', mock_open_data(cfg_data)):
             return Config(['mopack.yml'])
 
@@ -97,6 +99,31 @@ class TestFetch(CommandsTestCase):
             mfetch.assert_called_once()
             mclean.assert_called_once()
 
+    def test_parallel(self):
+        cfg = self.make_apt_config(['foo', 'bar'])
+        with mock.patch('os.path.exists', return_value=False), \
+             mock.patch('builtins.open', side_effect=FileNotFoundError()), \
+             mock.patch.object(AptPackage, 'prefetch') as mprefetch, \
+             mock.patch.object(AptPackage, 'fetch') as mfetch:
+            metadata = commands.fetch(cfg, self.pkgdir, jobs=2)
+            self.assertEqual(list(metadata.packages.keys()), ['foo', 'bar'])
+            self.assertEqual(mprefetch.call_count, 2)
+            self.assertEqual(mfetch.call_count, 2)
+
+    def test_parallel_failure(self):
+        cfg = self.make_apt_config(['foo', 'bar'])
+        with mock.patch('os.path.exists', return_value=False), \
+             mock.patch('builtins.open', side_effect=FileNotFoundError()), \
+             mock.patch.object(AptPackage, 'prefetch') as mprefetch, \
+             mock.patch.object(AptPackage, 'fetch',
+                               side_effect=RuntimeError()) as mfetch, \
+             mock.patch.object(AptPackage, 'clean_pre') as mclean:
+            with self.assertRaises(RuntimeError):
+                commands.fetch(cfg, self.pkgdir, jobs=2)
+            self.assertEqual(mprefetch.call_count, 2)
+            mfetch.assert_called_once()
+            self.assertEqual(mclean.call_count, 2)
+
 
 class TestResolve(CommandsTestCase):
     def test_empty(self):
@@ -116,12 +143,19 @@ class TestResolve(CommandsTestCase):
             config_file=os.path.abspath('mopack.yml'),
         ))
 
+        # Record which packages each save would write.
+        saved = []
+
+        def save():
+            saved.append(set(metadata._dirty))
+            metadata._dirty.clear()
+
         with mock.patch('mopack.commands.fetch', return_value=metadata), \
              mock.patch.object(DirectoryPackage, 'resolve') as mresolve, \
-             mock.patch.object(Metadata, 'save') as msave:
+             mock.patch.object(Metadata, 'save', side_effect=save):
             commands.resolve(cfg, self.pkgdir)
             mresolve.assert_called_once()
-            self.assertEqual(msave.call_count, 2)
+            self.assertEqual(saved, [{'foo'}, {'foo'}])
 
     def test_package_no_deps(self):
         cfg = self.make_empty_config(['mopack.yml'])
@@ -163,6 +197,63 @@ class TestResolve(CommandsTestCase):
             mclean.assert_called_once()
             self.assertEqual(msave.call_count, 2)
 
+    def test_prepare_linkage(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(DirectoryPackage(
+            'foo', path='path', build='none', linkage='pkg_config',
+            _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'),
+        ))
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve'), \
+             mock.patch.object(DirectoryPackage, 'prepare_linkage') as mprep, \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+            mprep.assert_called_once_with(metadata)
+
+        # Errors preparing linkage are left for `mopack linkage` to report.
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve'), \
+             mock.patch.object(DirectoryPackage, 'prepare_linkage',
+                               side_effect=FileNotFoundError()) as mprep, \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+            mprep.assert_called_once_with(metadata)
+
+    def test_artifact_cache(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(DirectoryPackage(
+            'foo', path='path', build='none', linkage='pkg_config',
+            _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'),
+        ))
+
+        cache = mock.MagicMock()
+        cache.__enter__.return_value = cache
+
+        def resolve(metadata):
+            self.assertIs(metadata.artifact_cache, cache)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch('mopack.artifact_cache.ArtifactCache.from_env',
+                        return_value=cache), \
+             mock.patch.object(DirectoryPackage, 'pending_artifact_key',
+                               return_value='abcdef'), \
+             mock.patch.object(DirectoryPackage, 'resolve',
+                               side_effect=resolve) as mresolve, \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+            mresolve.assert_called_once()
+            self.assertEqual(list(cache.prefetch.call_args[0][0]),
+                             ['abcdef'])
+            cache.__exit__.assert_called_once()
+            self.assertIs(metadata.artifact_cache, None)
+
     def test_batch_package(self):
         cfg = self.make_empty_config(['mopack.yml'])
 
@@ -198,3 +289,202 @@ class TestResolve(CommandsTestCase):
             mresolve.assert_called_once()
             mclean.assert_called_once()
             msave.assert_called_once()
+
+    def make_parallel_metadata(self, cfg):
+        # These packages aren't finalized, so we can't dehydrate them to
+        # compute their hashes.
+        for cls in (Package, DirectoryPackage):
+            patch = mock.patch.object(cls, '_fingerprint_data',
+                                      return_value={})
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(DirectoryPackage(
+            'foo', path='foo', build='none', linkage='pkg_config',
+            dependencies=['bar'], _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'),
+        ))
+        metadata.add_package(DirectoryPackage(
+            'bar', path='bar', build='none', linkage='pkg_config',
+            dependencies=[], _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'),
+        ))
+        metadata.add_package(AptPackage(
+            'baz', _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'),
+        ))
+        return metadata
+
+    def test_parallel(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = self.make_parallel_metadata(cfg)
+
+        resolved = []
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=lambda self, metadata:
+                               resolved.append(self.name)), \
+             mock.patch.object(AptPackage, 'resolve_all') as mresolve_all, \
+             mock.patch.object(Metadata, 'save') as msave:
+            commands.resolve(cfg, self.pkgdir, jobs=2)
+            self.assertEqual(resolved, ['bar', 'foo'])
+            mresolve_all.assert_called_once_with(
+                metadata, [metadata.packages['baz']]
+            )
+            self.assertEqual(msave.call_count, 3)
+
+    def test_parallel_hashes(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = self.make_parallel_metadata(cfg)
+        bar = metadata.packages['bar']
+
+        cache = mock.MagicMock()
+        cache.__enter__.return_value = cache
+
+        # Package hashes are computed before resolving, so tasks don't modify
+        # other packages while saving the metadata reads them.
+        hashed = {}
+
+        def resolve(self, metadata):
+            hashed[self.name] = all(i in vars(pkg) for pkg in (self, bar)
+                                    for i in ('_fingerprint', '_artifact_key'))
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch('mopack.artifact_cache.ArtifactCache.from_env',
+                        return_value=cache), \
+             mock.patch.object(DirectoryPackage, 'pending_artifact_key',
+                               return_value=None), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=resolve), \
+             mock.patch.object(AptPackage, 'resolve_all'), \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir, jobs=2)
+        self.assertEqual(hashed, {'foo': True, 'bar': True})
+
+    def test_parallel_jobserver(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = self.make_parallel_metadata(cfg)
+
+        jobservers = []
+
+        def resolve(self, metadata):
+            jobservers.append(LogFile.jobserver)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=resolve), \
+             mock.patch.object(AptPackage, 'resolve_all'), \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir, jobs=2)
+        self.assertEqual(len(jobservers), 2)
+        self.assertIsInstance(jobservers[0], JobServer)
+        self.assertEqual(jobservers[0].jobs, 2)
+        self.assertIs(jobservers[0], jobservers[1])
+        self.assertIs(LogFile.jobserver, None)
+
+        # Without `jobs`, there's no jobserver.
+        jobservers.clear()
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=resolve), \
+             mock.patch.object(AptPackage, 'resolve_all'), \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+        self.assertEqual(jobservers, [None, None])
+
+    def test_parallel_failure(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = self.make_parallel_metadata(cfg)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve',
+                               side_effect=RuntimeError()) as mresolve, \
+             mock.patch.object(DirectoryPackage, 'clean_post') as mclean, \
+             mock.patch.object(AptPackage, 'resolve_all'), \
+             mock.patch.object(Metadata, 'save'):
+            with self.assertRaises(RuntimeError):
+                commands.resolve(cfg, self.pkgdir, jobs=2)
+            mresolve.assert_called_once()
+            mclean.assert_called_once()
+
+
+class TestLinkage(CommandsTestCase):
+    linkage = {'name': 'foo', 'type': 'pkg_config', 'pcnames': ['foo'],
+               'pkg_config_path': []}
+
+    def test_cache_miss(self):
+        metadata = Metadata(self.pkgdir)
+        pkg = mock.MagicMock()
+        pkg.get_linkage.return_value = self.linkage
+        dep = Dependency('foo', ['sub'])
+
+        with mock.patch.object(LinkageCache, 'stamp', return_value=[1, 2]), \
+             mock.patch.object(LinkageCache, 'get', return_value=None), \
+             mock.patch.object(LinkageCache, 'put') as mput, \
+             mock.patch.object(Metadata, 'try_load',
+                               return_value=metadata) as mload, \
+             mock.patch.object(Metadata, 'get_package', return_value=pkg):
+            self.assertEqual(commands.linkage(self.pkgdir, dep), self.linkage)
+            mload.assert_called_once_with(self.pkgdir, False)
+            pkg.get_linkage.assert_called_once_with(metadata, ['sub'])
+            mput.assert_called_once_with(dep, [1, 2], self.linkage, False)
+
+    def test_metadata_changed(self):
+        pkg = mock.MagicMock()
+        pkg.get_linkage.side_effect = [MetadataChangedError(), self.linkage]
+
+        with mock.patch.object(LinkageCache, 'stamp', return_value=[1, 2]), \
+             mock.patch.object(LinkageCache, 'get', return_value=None), \
+             mock.patch.object(LinkageCache, 'put') as mput, \
+             mock.patch.object(Metadata, 'try_load',
+                               side_effect=lambda *args:
+                               Metadata(self.pkgdir)) as mload, \
+             mock.patch.object(Metadata, 'get_package', return_value=pkg):
+            # If the metadata changes while we're loading it, load it again.
+            self.assertEqual(commands.linkage(self.pkgdir, Dependency('foo')),
+                             self.linkage)
+            self.assertEqual(mload.call_count, 2)
+            mput.assert_called_once()
+
+            # ... but only a limited number of times.
+            pkg.get_linkage.side_effect = MetadataChangedError()
+            mload.reset_mock()
+            with self.assertRaises(MetadataChangedError):
+                commands.linkage(self.pkgdir, Dependency('foo'))
+            self.assertEqual(mload.call_count, 3)
+
+    def test_cache_hit(self):
+        with mock.patch.object(LinkageCache, 'stamp', return_value=[1, 2]), \
+             mock.patch.object(LinkageCache, 'get',
+                               return_value=self.linkage) as mget, \
+             mock.patch.object(LinkageCache, 'put') as mput, \
+             mock.patch.object(Metadata, 'try_load') as mload:
+            self.assertEqual(commands.linkage(self.pkgdir, Dependency('foo'),
+                                              strict=True), self.linkage)
+            mget.assert_called_once_with(Dependency('foo'), [1, 2], True)
+            mload.assert_not_called()
+            mput.assert_not_called()
+
+    def test_multiple(self):
+        metadata = Metadata(self.pkgdir)
+        foo = mock.MagicMock()
+        foo.get_linkage.return_value = self.linkage
+        cached = dict(self.linkage, name='bar')
+
+        def get(dep, stamp, strict):
+            return cached if dep.package == 'bar' else None
+
+        with mock.patch.object(LinkageCache, 'stamp', return_value=[1, 2]), \
+             mock.patch.object(LinkageCache, 'get', side_effect=get), \
+             mock.patch.object(LinkageCache, 'put') as mput, \
+             mock.patch.object(Metadata, 'try_load',
+                               return_value=metadata) as mload, \
+             mock.patch.object(Metadata, 'get_package', return_value=foo):
+            deps = [Dependency('foo'), Dependency('bar'),
+                    Dependency('foo', ['sub'])]
+            self.assertEqual(commands.linkages(self.pkgdir, deps), {
+                'foo': self.linkage, 'bar': cached, 'foo[sub]': self.linkage,
+            })
+            mload.assert_called_once_with(self.pkgdir, False)
+            self.assertEqual(mput.call_count, 2)
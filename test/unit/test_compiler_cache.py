@@ -0,0 +1,142 @@
+import json
+import os
+import subprocess
+from unittest import mock, TestCase
+
+from mopack.compiler_cache import *
+from mopack.options import CommonOptions
+
+
+def mock_run(stdout):
+    return mock.patch('subprocess.run', return_value=mock.Mock(stdout=stdout))
+
+
+class TestGetCompilerCache(TestCase):
+    pkgdir = os.path.abspath('/path/to/builddir/mopack')
+
+    def make_options(self, env={}, **kwargs):
+        opts = CommonOptions()
+        opts(env=env, **kwargs)
+        with mock.patch('os.environ', {}):
+            opts.finalize()
+        return opts
+
+    def test_none(self):
+        self.assertIs(get_compiler_cache(self.make_options(), self.pkgdir),
+                      None)
+
+    def test_default_dir(self):
+        opts = self.make_options(
+            env={'MOPACK_CACHE_DIR': '/path/to/cache'},
+            compiler_cache='ccache'
+        )
+        cache = get_compiler_cache(opts, self.pkgdir)
+        self.assertIsInstance(cache, compiler_cache_types['ccache'])
+        self.assertEqual(cache.directory,
+                         os.path.join('/path/to/cache', 'compiler', 'ccache'))
+
+    def test_default_dir_no_user_cache(self):
+        opts = self.make_options(env={'MOPACK_CACHE_DIR': ''},
+                                 compiler_cache='sccache')
+        cache = get_compiler_cache(opts, self.pkgdir)
+        self.assertIsInstance(cache, compiler_cache_types['sccache'])
+        self.assertEqual(cache.directory,
+                         os.path.join(self.pkgdir, 'compiler_cache'))
+
+    def test_explicit_dir(self):
+        opts = self.make_options(compiler_cache='ccache',
+                                 compiler_cache_dir='ccache')
+        self.assertEqual(get_compiler_cache(opts, self.pkgdir).directory,
+                         os.path.join(self.pkgdir, 'ccache'))
+
+        shared = os.path.abspath('/path/to/shared')
+        opts = self.make_options(compiler_cache='ccache',
+                                 compiler_cache_dir=shared)
+        self.assertEqual(get_compiler_cache(opts, self.pkgdir).directory,
+                         shared)
+
+
+class TestCCache(TestCase):
+    def setUp(self):
+        self.cache = compiler_cache_types['ccache']('/path/to/cache')
+
+    def test_env(self):
+        self.assertEqual(self.cache.env({}), {'CCACHE_DIR': '/path/to/cache'})
+        self.assertEqual(self.cache.env({'CCACHE_DIR': '/other'}),
+                         {'CCACHE_DIR': '/other'})
+
+    def test_compiler_env(self):
+        with mock.patch('mopack.compiler_cache.platform_name',
+                        return_value='linux'):
+            self.assertEqual(self.cache.compiler_env({}), {
+                'CC': 'ccache cc', 'CXX': 'ccache c++',
+                'CCACHE_DIR': '/path/to/cache',
+            })
+
+        env = {'CCACHE': '/bin/ccache', 'CC': 'gcc',
+               'CXX': '/bin/ccache g++'}
+        self.assertEqual(self.cache.compiler_env(env), {
+            'CCACHE': '/bin/ccache', 'CC': '/bin/ccache gcc',
+            'CXX': '/bin/ccache g++', 'CCACHE_DIR': '/path/to/cache',
+        })
+
+    def test_compiler_env_windows(self):
+        with mock.patch('mopack.compiler_cache.platform_name',
+                        return_value='windows'):
+            self.assertEqual(self.cache.compiler_env({}), {
+                'CC': 'ccache cl', 'CXX': 'ccache cl',
+                'CCACHE_DIR': '/path/to/cache',
+            })
+
+    def test_cmake_args(self):
+        self.assertEqual(self.cache.cmake_args({}), [
+            '-DCMAKE_C_COMPILER_LAUNCHER=ccache',
+            '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache',
+        ])
+        self.assertEqual(self.cache.cmake_args({'CCACHE': 'ccache -d x'}), [
+            '-DCMAKE_C_COMPILER_LAUNCHER=ccache;-d;x',
+            '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache;-d;x',
+        ])
+
+    def test_stats(self):
+        output = ('cache_miss\t3\ndirect_cache_hit\t4\n' +
+                  'preprocessed_cache_hit\t1\n')
+        with mock_run(output) as mrun:
+            self.assertEqual(self.cache.stats({}), (5, 3))
+        mrun.assert_called_once_with(
+            ['ccache', '--print-stats'], env={'CCACHE_DIR': '/path/to/cache'},
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            check=True
+        )
+
+    def test_stats_error(self):
+        with mock.patch('subprocess.run', side_effect=OSError()):
+            self.assertEqual(self.cache.stats({}), None)
+        with mock_run('bad output'):
+            self.assertEqual(self.cache.stats({}), None)
+
+
+class TestSCCache(TestCase):
+    def setUp(self):
+        self.cache = compiler_cache_types['sccache']('/path/to/cache')
+
+    def test_env(self):
+        self.assertEqual(self.cache.env({}),
+                         {'SCCACHE_DIR': '/path/to/cache'})
+
+    def test_stats(self):
+        output = json.dumps({'stats': {
+            'cache_hits': {'counts': {'C/C++': 4, 'Rust': 1}},
+            'cache_misses': {'counts': {'C/C++': 3}},
+        }})
+        with mock_run(output) as mrun:
+            self.assertEqual(self.cache.stats({}), (5, 3))
+        mrun.assert_called_once_with(
+            ['sccache', '--show-stats', '--stats-format=json'],
+            env={'SCCACHE_DIR': '/path/to/cache'}, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, check=True
+        )
+
+    def test_stats_error(self):
+        with mock_run('{}'):
+            self.assertEqual(self.cache.stats({}), None)
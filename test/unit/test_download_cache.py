@@ -0,0 +1,317 @@
+import os
+import subprocess
+import tempfile
+from unittest import mock, TestCase
+
+from mopack.download_cache import *
+from mopack.platforms import platform_name
+
+
+class TestParseSize(TestCase):
+    def test_bytes(self):
+        self.assertEqual(parse_size('0'), 0)
+        self.assertEqual(parse_size('123'), 123)
+        self.assertEqual(parse_size('123B'), 123)
+
+    def test_units(self):
+        self.assertEqual(parse_size('2K'), 2048)
+        self.assertEqual(parse_size('2k'), 2048)
+        self.assertEqual(parse_size('2KiB'), 2048)
+        self.assertEqual(parse_size('3M'), 3 * 1024 ** 2)
+        self.assertEqual(parse_size('4 GB'), 4 * 1024 ** 3)
+        self.assertEqual(parse_size('5T'), 5 * 1024 ** 4)
+
+    def test_invalid(self):
+        for i in ('', 'G', '1.5G', '1X', '-1'):
+            with self.subTest(size=i), self.assertRaises(ValueError):
+                parse_size(i)
+
+
+class TestFormatSize(TestCase):
+    def test_format(self):
+        self.assertEqual(format_size(0), '0 B')
+        self.assertEqual(format_size(1023), '1023 B')
+        self.assertEqual(format_size(1536), '1.5 KiB')
+        self.assertEqual(format_size(3 * 1024 ** 2), '3.0 MiB')
+        self.assertEqual(format_size(2048 * 1024 ** 4), '2048.0 TiB')
+
+
+class TestDefaultCacheDir(TestCase):
+    def test_explicit(self):
+        self.assertEqual(default_cache_dir({cache_dir_var: '/cache'}),
+                         '/cache')
+
+    def test_disabled(self):
+        self.assertEqual(default_cache_dir({cache_dir_var: ''}), None)
+
+    def test_linux(self):
+        with mock.patch('mopack.download_cache.platform_name',
+                        return_value='linux'):
+            self.assertEqual(default_cache_dir({'XDG_CACHE_HOME': '/xdg'}),
+                             os.path.join('/xdg', 'mopack'))
+            self.assertEqual(default_cache_dir({}), os.path.join(
+                os.path.expanduser('~/.cache'), 'mopack'
+            ))
+
+    def test_darwin(self):
+        with mock.patch('mopack.download_cache.platform_name',
+                        return_value='darwin'):
+            self.assertEqual(default_cache_dir({}), os.path.join(
+                os.path.expanduser('~/Library/Caches'), 'mopack'
+            ))
+
+    def test_windows(self):
+        with mock.patch('mopack.download_cache.platform_name',
+                        return_value='windows'):
+            self.assertEqual(default_cache_dir({'LOCALAPPDATA': 'C:\\data'}),
+                             os.path.join('C:\\data', 'mopack'))
+
+
+class TestDownloadCache(TestCase):
+    url = 'http://example.invalid/file.tar.gz'
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = DownloadCache(self.tmpdir.name, max_size=10)
+
+    def test_from_env(self):
+        cache = DownloadCache.from_env({cache_dir_var: '/cache',
+                                        cache_size_var: '1M'})
+        self.assertEqual(cache.path, '/cache')
+        self.assertEqual(cache.max_size, 1024 ** 2)
+
+        cache = DownloadCache.from_env({cache_dir_var: '/cache'})
+        self.assertEqual(cache.max_size, parse_size('2G'))
+
+        self.assertEqual(DownloadCache.from_env({cache_dir_var: ''}), None)
+
+    def test_key(self):
+        self.assertEqual(DownloadCache.key(self.url),
+                         DownloadCache.key(self.url))
+        self.assertNotEqual(DownloadCache.key(self.url),
+                            DownloadCache.key(self.url + '.zip'))
+        self.assertNotEqual(DownloadCache.key(self.url),
+                            DownloadCache.key(self.url, 'sha256:0123'))
+
+    def add(self, url, data, checksum=None):
+        with self.cache.writer(url, checksum) as f:
+            f.write(data)
+        with self.cache.open(url, checksum) as f:
+            return f.name
+
+    def test_writer(self):
+        with self.cache.writer(self.url, 'sha256:0123') as f:
+            f.write(b'data')
+        with self.cache.open(self.url, 'sha256:0123') as f:
+            self.assertEqual(f.read(), b'data')
+
+        self.assertEqual(self.cache.open(self.url), None)
+        self.assertEqual(self.cache.open(self.url, 'sha256:4567'), None)
+
+    def test_writer_failed(self):
+        with self.assertRaises(RuntimeError), \
+             self.cache.writer(self.url) as f:
+            f.write(b'partial')
+            raise RuntimeError()
+        self.assertEqual(self.cache.open(self.url), None)
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name,
+                                                 'downloads')), [])
+
+    def test_open(self):
+        self.assertEqual(self.cache.open(self.url), None)
+
+        path = self.add(self.url, b'data')
+        os.utime(path, (1, 1))
+        with self.cache.open(self.url) as f:
+            # Opening an entry marks it as recently-used.
+            self.assertGreater(os.stat(path).st_mtime, 1)
+
+            # Once it's open, evicting the entry doesn't affect us.
+            if platform_name() != 'windows':
+                self.cache.clear()
+            self.assertEqual(f.read(), b'data')
+
+    def test_entries(self):
+        self.assertEqual(self.cache.entries(), [])
+
+        path = self.add(self.url, b'data', 'sha256:0123')
+        entries = self.cache.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].kind, 'download')
+        self.assertEqual(entries[0].url, self.url)
+        self.assertEqual(entries[0].checksum, 'sha256:0123')
+        self.assertEqual(entries[0].size, 4)
+        self.assertEqual(entries[0].path, path)
+
+    def test_prune(self):
+        first = self.add(self.url + '1', b'1234')
+        second = self.add(self.url + '2', b'1234')
+        os.utime(first, (1, 1))
+        os.utime(second, (2, 2))
+
+        # Adding a third entry should evict the least-recently-used one.
+        self.add(self.url + '3', b'1234')
+        self.assertEqual([i.url for i in self.cache.entries()],
+                         [self.url + '2', self.url + '3'])
+
+        removed = self.cache.prune(4)
+        self.assertEqual([i.url for i in removed], [self.url + '2'])
+        self.assertEqual([i.url for i in self.cache.entries()],
+                         [self.url + '3'])
+
+    def test_prune_recent(self):
+        first = self.add(self.url + '1', b'1234')
+        second = self.add(self.url + '2', b'1234')
+        os.utime(first, (1, 1))
+        os.utime(second, (2, 2))
+
+        # Adding an entry doesn't evict ones used since this run started, since
+        # other processes may still need them.
+        with mock.patch('mopack.download_cache._run_start', 2):
+            self.add(self.url + '3', b'1234')
+        self.assertEqual([i.url for i in self.cache.entries()],
+                         [self.url + '2', self.url + '3'])
+
+        removed = self.cache.prune(4, keep_since=2)
+        self.assertEqual(removed, [])
+        removed = self.cache.prune(4)
+        self.assertEqual([i.url for i in removed], [self.url + '2'])
+
+    def test_prune_oversized(self):
+        path = self.add(self.url, b'0123456789abcdef')
+        self.assertEqual([i.path for i in self.cache.entries()], [path])
+
+        # The newly-added entry is kept even though it's too big, but it will
+        # be evicted on the next prune.
+        removed = self.cache.prune()
+        self.assertEqual([i.path for i in removed], [path])
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_clear(self):
+        self.add(self.url, b'data')
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+        self.assertEqual(self.cache.open(self.url), None)
+
+
+class TestGitMirrorCache(TestCase):
+    url = 'https://example.invalid/repo.git'
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = GitMirrorCache(self.tmpdir.name)
+        self.logfile = mock.MagicMock()
+
+    def test_from_env(self):
+        cache = GitMirrorCache.from_env({cache_dir_var: '/cache',
+                                         cache_size_var: '1M'})
+        self.assertEqual(cache.path, '/cache')
+        self.assertEqual(cache.max_size, 1024 ** 2)
+        self.assertEqual(GitMirrorCache.from_env({cache_dir_var: ''}), None)
+
+    def test_mirror_path(self):
+        self.assertEqual(self.cache.mirror_path(self.url),
+                         self.cache.mirror_path(self.url))
+        self.assertNotEqual(self.cache.mirror_path(self.url),
+                            self.cache.mirror_path(self.url + '2'))
+
+    def test_update(self):
+        def clone(args, env):
+            self.assertEqual(args[:3], ['git', 'clone', '--mirror'])
+            self.assertEqual(args[3], self.url)
+            with open(os.path.join(args[4], 'HEAD'), 'w') as f:
+                f.write('ref: refs/heads/master\n')
+
+        path = self.cache.mirror_path(self.url)
+        self.logfile.check_call.side_effect = clone
+        self.assertEqual(self.cache.update(self.url, self.logfile), path)
+        self.assertTrue(os.path.exists(os.path.join(path, 'HEAD')))
+        self.assertCountEqual(os.listdir(os.path.dirname(path)),
+                              [os.path.basename(path),
+                               os.path.basename(path) + '.json'])
+
+        # The mirror is only updated once per run.
+        self.logfile.check_call.reset_mock()
+        self.assertEqual(self.cache.update(self.url, self.logfile), path)
+        self.logfile.check_call.assert_not_called()
+
+    def test_update_existing(self):
+        path = self.cache.mirror_path(self.url + '-existing')
+        os.makedirs(path)
+        self.assertEqual(self.cache.update(
+            self.url + '-existing', self.logfile, ['mygit'], {'VAR': 'value'}
+        ), path)
+        self.logfile.check_call.assert_called_once_with(
+            ['mygit', 'fetch', '--prune'], env={'VAR': 'value'}, cwd=path
+        )
+
+    def test_update_failed(self):
+        self.logfile.check_call.side_effect = subprocess.CalledProcessError(
+            1, 'git'
+        )
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.cache.update(self.url + '-failed', self.logfile)
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, 'git')),
+                         [])
+
+    def test_update_prune(self):
+        def clone(args, env):
+            with open(os.path.join(args[4], 'HEAD'), 'w') as f:
+                f.write('ref: refs/heads/master\n')
+
+        # Mirrors share the download cache's size limit, so adding a mirror
+        # evicts old downloads...
+        cache = GitMirrorCache(self.tmpdir.name, max_size=30)
+        downloads = DownloadCache(self.tmpdir.name)
+        with downloads.writer('http://example.invalid/file') as f:
+            f.write(b'0123456789')
+        os.utime(downloads.entries()[0].path, (1, 1))
+
+        self.logfile.check_call.side_effect = clone
+        path = cache.update(self.url + '-prune', self.logfile)
+        self.assertEqual([i.path for i in downloads.entries()], [path])
+
+        # ... and vice versa.
+        os.utime(path, (1, 1))
+        with mock.patch('mopack.download_cache._run_start', 2), \
+             DownloadCache(self.tmpdir.name, max_size=30).writer(
+                 'http://example.invalid/file'
+             ) as f:
+            f.write(b'0123456789' * 2)
+        self.assertEqual([i.url for i in downloads.entries()],
+                         ['http://example.invalid/file'])
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.json'))
+
+    def test_entries(self):
+        self.assertEqual(self.cache.entries(), [])
+
+        path = self.cache.mirror_path(self.url)
+        os.makedirs(os.path.join(path, 'objects'))
+        with open(os.path.join(path, 'objects', 'pack'), 'wb') as f:
+            f.write(b'data')
+        with open(path + '.json', 'w') as f:
+            f.write('{"url": "%s"}' % self.url)
+
+        entries = self.cache.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].kind, 'git')
+        self.assertEqual(entries[0].url, self.url)
+        self.assertEqual(entries[0].checksum, None)
+        self.assertEqual(entries[0].path, path)
+        self.assertEqual(entries[0].size, 4)
+
+        # Mirrors are listed along with downloads.
+        downloads = DownloadCache(self.tmpdir.name)
+        self.assertEqual([i.path for i in downloads.entries()], [path])
+        downloads.remove(entries[0])
+        self.assertEqual(self.cache.entries(), [])
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+    def test_clear(self):
+        os.makedirs(self.cache.mirror_path(self.url))
+        self.cache.clear()
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name,
+                                                     'git')))
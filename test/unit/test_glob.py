@@ -123,3 +123,23 @@ class TestFilterGlob(TestCase):
     def test_explicit_glob(self):
         g = Glob('/foo')
         self.assertEqual(self._glob(g), ['foo', 'foo/', 'foo/bar'])
+
+
+class TestGitignorePattern(TestCase):
+    def test_absolute(self):
+        self.assertEqual(gitignore_pattern('/foo'), '/foo')
+        self.assertEqual(gitignore_pattern('/foo/bar/'), '/foo/bar/')
+        self.assertEqual(gitignore_pattern('/foo/*.txt'), '/foo/*.txt')
+
+    def test_relative(self):
+        self.assertEqual(gitignore_pattern('foo'), '**/foo')
+        self.assertEqual(gitignore_pattern('foo/bar/'), '**/foo/bar/')
+        self.assertEqual(gitignore_pattern('**/foo'), '**/foo')
+        self.assertEqual(gitignore_pattern('**'), '**/**')
+
+    def test_backslash(self):
+        self.assertEqual(gitignore_pattern('\\foo\\bar'), '/foo/bar')
+
+    def test_empty(self):
+        self.assertEqual(gitignore_pattern(''), '/*')
+        self.assertEqual(gitignore_pattern('/'), '/*')
@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import threading
+from unittest import mock, skipIf, TestCase
+
+from mopack.jobserver import *
+from mopack.platforms import platform_name
+
+
+class TestJobServer(TestCase):
+    def setUp(self):
+        self.jobserver = JobServer(3)
+        self.addCleanup(self.jobserver.close)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            JobServer(0)
+
+    def test_slot(self):
+        with self.jobserver.slot() as jobs:
+            self.assertEqual(jobs, 1)
+            # Nested slots on the same thread reuse the slot we hold.
+            with self.jobserver.slot(extra=True) as jobs:
+                self.assertEqual(jobs, 1)
+
+        with self.jobserver.slot(extra=True) as jobs:
+            self.assertEqual(jobs, 3)
+        with self.jobserver.slot(extra=True) as jobs:
+            self.assertEqual(jobs, 3)
+
+    def test_slot_shared(self):
+        acquired = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with self.jobserver.slot(extra=True) as jobs:
+                self.assertEqual(jobs, 2)
+                acquired.set()
+                release.wait()
+
+        with self.jobserver.slot():
+            thread = threading.Thread(target=hold)
+            thread.start()
+            acquired.wait()
+
+            # All the tokens are taken, so other threads have to wait.
+            waited = threading.Event()
+
+            def wait():
+                with self.jobserver.slot() as jobs:
+                    self.assertEqual(jobs, 1)
+                    waited.set()
+
+            waiter = threading.Thread(target=wait)
+            waiter.start()
+            self.assertFalse(waited.wait(0.1))
+            release.set()
+            thread.join()
+            waiter.join()
+            self.assertTrue(waited.is_set())
+
+    def test_slot_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.jobserver.slot(extra=True):
+                raise RuntimeError()
+        with self.jobserver.slot(extra=True) as jobs:
+            self.assertEqual(jobs, 3)
+
+    @skipIf(platform_name() == 'windows', 'jobserver pipe is POSIX-only')
+    def test_env(self):
+        auth = '{},{}'.format(*self.jobserver.pass_fds)
+        self.assertEqual(self.jobserver.env({'FOO': 'foo'}), {
+            'FOO': 'foo',
+            'MAKEFLAGS': '-j3 --jobserver-auth={0} --jobserver-fds={0}'
+                         .format(auth),
+        })
+        self.assertEqual(self.jobserver.env({'MAKEFLAGS': 'k'}), {
+            'MAKEFLAGS': 'k -j3 --jobserver-auth={0} --jobserver-fds={0}'
+                         .format(auth),
+        })
+
+    @skipIf(platform_name() == 'windows', 'jobserver pipe is POSIX-only')
+    def test_child_process(self):
+        # Take a token from the pool in a child process, like make would.
+        script = ('import os; r, w = map(int, os.environ["MAKEFLAGS"]' +
+                  '.split("=")[-1].split(",")); os.write(w, os.read(r, 1)); ' +
+                  'print("ok")')
+        with self.jobserver.slot():
+            output = subprocess.run(
+                [sys.executable, '-c', script],
+                env=self.jobserver.env(os.environ),
+                pass_fds=self.jobserver.pass_fds, stdout=subprocess.PIPE,
+                text=True, check=True
+            ).stdout
+        self.assertEqual(output, 'ok\n')
+        with self.jobserver.slot(extra=True) as jobs:
+            self.assertEqual(jobs, 3)
+
+    def test_windows(self):
+        with mock.patch('mopack.jobserver.platform_name',
+                        return_value='windows'):
+            jobserver = JobServer(2)
+        self.assertEqual(jobserver.pass_fds, ())
+        self.assertEqual(jobserver.env({'FOO': 'foo'}), {'FOO': 'foo'})
+        with jobserver.slot(extra=True) as jobs:
+            self.assertEqual(jobs, 2)
+        with jobserver.slot() as jobs:
+            self.assertEqual(jobs, 1)
+        jobserver.close()
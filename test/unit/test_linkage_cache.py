@@ -0,0 +1,87 @@
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from mopack.dependencies import Dependency
+from mopack.linkage_cache import *
+
+
+class TestLinkageCache(TestCase):
+    linkage = {'name': 'foo', 'type': 'pkg_config', 'pcnames': ['foo'],
+               'pkg_config_path': ['/path/to/pkgconfig']}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = LinkageCache(self.tmpdir.name)
+        self.write_metadata('{}')
+
+    def write_metadata(self, data):
+        with open(os.path.join(self.tmpdir.name, 'mopack.json'), 'w') as f:
+            f.write(data)
+
+    def test_stamp(self):
+        stamp = self.cache.stamp()
+        self.assertEqual(self.cache.stamp(), stamp)
+
+        self.write_metadata('{"changed": true}')
+        self.assertNotEqual(self.cache.stamp(), stamp)
+
+    def test_stamp_missing(self):
+        cache = LinkageCache(os.path.join(self.tmpdir.name, 'nonexist'))
+        self.assertEqual(cache.stamp(), None)
+
+    def test_key(self):
+        foo = Dependency('foo')
+        self.assertEqual(LinkageCache.key(foo), LinkageCache.key(foo))
+        self.assertNotEqual(LinkageCache.key(foo),
+                            LinkageCache.key(Dependency('foo', ['sub'])))
+        self.assertNotEqual(LinkageCache.key(foo),
+                            LinkageCache.key(foo, strict=True))
+
+    def test_put_get(self):
+        foo = Dependency('foo')
+        stamp = self.cache.stamp()
+        self.assertEqual(self.cache.get(foo, stamp), None)
+
+        self.cache.put(foo, stamp, self.linkage)
+        self.assertEqual(self.cache.get(foo, stamp), self.linkage)
+        self.assertEqual(self.cache.get(foo, stamp, strict=True), None)
+        self.assertEqual(self.cache.get(Dependency('bar'), stamp), None)
+        self.assertEqual(self.cache.get(foo, None), None)
+
+    def test_invalidate(self):
+        foo = Dependency('foo')
+        stamp = self.cache.stamp()
+        self.cache.put(foo, stamp, self.linkage)
+
+        self.write_metadata('{"changed": true}')
+        self.assertEqual(self.cache.get(foo, self.cache.stamp()), None)
+
+    def test_put_no_stamp(self):
+        self.cache.put(Dependency('foo'), None, self.linkage)
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_put_error(self):
+        foo = Dependency('foo')
+        stamp = self.cache.stamp()
+        with mock.patch('os.makedirs', side_effect=PermissionError()):
+            self.cache.put(foo, stamp, self.linkage)
+        self.assertEqual(self.cache.get(foo, stamp), None)
+
+    def test_corrupt(self):
+        foo = Dependency('foo')
+        stamp = self.cache.stamp()
+        self.cache.put(foo, stamp, self.linkage)
+        with open(os.path.join(self.cache.path, LinkageCache.key(foo) +
+                               '.json'), 'w') as f:
+            f.write('{')
+        self.assertEqual(self.cache.get(foo, stamp), None)
+
+    def test_clear(self):
+        foo = Dependency('foo')
+        stamp = self.cache.stamp()
+        self.cache.put(foo, stamp, self.linkage)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(foo, stamp), None)
+        self.assertFalse(os.path.exists(self.cache.path))
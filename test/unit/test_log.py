@@ -3,7 +3,7 @@ import logging
 import re
 import warnings
 from io import StringIO
-from subprocess import SubprocessError
+from subprocess import PIPE, STDOUT, SubprocessError
 from unittest import mock, TestCase
 
 from mopack import log
@@ -184,6 +184,33 @@ class TestLogFile(TestCase):
                 output = ''.join(i[-2][0] for i in mopen().write.mock_calls)
                 self.assertEqual(output, '$ cmd --arg\nstdout\nend\n')
 
+    def test_check_call_jobserver(self):
+        jobserver = mock.MagicMock(pass_fds=(3, 4))
+        jobserver.env.return_value = {'MAKEFLAGS': '-j2'}
+        with mock.patch('builtins.open', mock.mock_open()), \
+             mock.patch('subprocess.Popen',
+                        return_value=self.mock_popen(0)) as mpopen, \
+             mock.patch.object(log.LogFile, 'jobserver', jobserver):
+            with log.LogFile.open('pkgdir', 'package') as logfile:
+                logfile.check_call(['cmd', '--arg'], env={})
+            mpopen.assert_called_once_with(
+                ['cmd', '--arg'], text=True, stdout=PIPE, stderr=STDOUT,
+                env={'MAKEFLAGS': '-j2'}, pass_fds=(3, 4)
+            )
+            jobserver.env.assert_called_once_with({})
+            jobserver.slot.assert_called_once_with()
+
+    def test_jobs(self):
+        with mock.patch('builtins.open', mock.mock_open()):
+            with log.LogFile.open('pkgdir', 'package') as logfile:
+                with logfile.jobs() as jobs:
+                    self.assertEqual(jobs, None)
+
+                jobserver = mock.MagicMock()
+                with mock.patch.object(log.LogFile, 'jobserver', jobserver):
+                    logfile.jobs()
+                jobserver.slot.assert_called_once_with(extra=True)
+
     def test_check_call_proc_error_no_output(self):
         msg = "Command 'cmd --arg' returned non-zero exit status 1"
         with mock.patch('builtins.open', mock.mock_open()) as mopen, \
@@ -215,6 +242,13 @@ class TestLogFile(TestCase):
                 output = ''.join(i[-2][0] for i in mopen().write.mock_calls)
                 self.assertEqual(output, '$ cmd --arg\nbad\n')
 
+    def test_message(self):
+        with mock.patch('builtins.open', mock.mock_open()) as mopen:
+            with log.LogFile.open('pkgdir', 'package') as logfile:
+                logfile.message('hello')
+                output = ''.join(i[-2][0] for i in mopen().write.mock_calls)
+                self.assertEqual(output, 'hello\n')
+
     def test_synthetic_command(self):
         with mock.patch('builtins.open', mock.mock_open()) as mopen:
             with log.LogFile.open('pkgdir', 'package') as logfile:
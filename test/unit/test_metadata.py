@@ -1,11 +1,16 @@
 import json
 import os
+import tempfile
 from unittest import mock
 
-from . import OptionsTest, Stream
+from . import OptionsTest
 from .. import test_data_dir
 
-from mopack.metadata import Metadata, MetadataVersionError
+from mopack.dependencies import Dependency
+from mopack.freezedried import rehydrate
+from mopack.metadata import (Metadata, MetadataChangedError,
+                             MetadataVersionError, _dump_package,
+                             _write_atomic)
 from mopack.origins.apt import AptPackage
 from mopack.origins.conan import ConanPackage
 from mopack.origins.system import SystemPackage
@@ -44,22 +49,291 @@ class TestMetadata(OptionsTest):
         with self.assertRaises(KeyError):
             metadata.get_package('foo')
 
-    def test_save(self):
-        out = Stream('')
-        with mock.patch('os.makedirs'), \
-             mock.patch('builtins.open', return_value=out):
-            metadata = Metadata(self.pkgdir)
-            pkg = AptPackage('foo', _options=metadata.options,
+    def test_get_linkage(self):
+        metadata = Metadata(self.pkgdir)
+        pkg = AptPackage('foo', _options=metadata.options,
+                         config_file=self.config_file)
+        pkg.resolved = True
+        metadata.add_package(pkg)
+
+        linkage = {'name': 'foo', 'type': 'system'}
+        with mock.patch.object(AptPackage, 'get_linkage',
+                               return_value=linkage) as mlinkage:
+            self.assertEqual(metadata.get_linkage(Dependency('foo')), linkage)
+            self.assertEqual(metadata.get_linkage(Dependency('foo')), linkage)
+            mlinkage.assert_called_once_with(metadata, None)
+
+            metadata.get_linkage(Dependency('foo', ['sub']))
+            mlinkage.assert_called_with(metadata, ['sub'])
+            self.assertEqual(mlinkage.call_count, 2)
+
+    def make_packages(self, metadata, names):
+        for i in names:
+            pkg = AptPackage(i, _options=metadata.options,
                              config_file=self.config_file)
             pkg.resolved = True
             metadata.add_package(pkg)
+
+    def record_files(self, records):
+        return [j for i in records for j in
+                (i, os.path.splitext(i)[0] + '.pickle')]
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo', 'foo/bar'])
             metadata.save()
 
-        # Test round-tripping a package.
-        with mock.patch('builtins.open',
-                        mock.mock_open(read_data=out.getvalue())):
-            metadata_copy = Metadata.load(self.config_file)
-            self.assertEqual(metadata_copy.get_package('foo'), pkg)
+            with open(metadata.path) as f:
+                index = json.load(f)
+            self.assertEqual(index['version'], Metadata.version)
+            records = index['metadata']['packages']
+            self.assertEqual(list(records), ['foo', 'foo/bar'])
+            self.assertRegex(records['foo'], r'^foo-[0-9a-f]{16}\.json$')
+            self.assertRegex(records['foo/bar'],
+                             r'^foo%2Fbar-[0-9a-f]{16}\.json$')
+            self.assertCountEqual(os.listdir(metadata.packages_path),
+                                  self.record_files(records.values()))
+
+            # Test round-tripping a package via both kinds of records.
+            for binary in (True, False):
+                with mock.patch.object(Metadata, 'binary_records', binary):
+                    metadata_copy = Metadata.load(pkgdir)
+                    foo = metadata_copy.get_package('foo')
+                    self.assertEqual(foo, metadata.packages['foo'])
+                    self.assertIs(foo._options, metadata_copy.options)
+                    self.assertEqual(metadata_copy.get_package('foo/bar'),
+                                     metadata.packages['foo/bar'])
+
+    def test_save_no_binary(self):
+        with tempfile.TemporaryDirectory() as pkgdir, \
+             mock.patch.object(Metadata, 'binary_records', False):
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            metadata.save()
+            self.assertEqual(os.listdir(metadata.packages_path),
+                             list(metadata._records.values()))
+
+    def test_save_changed(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo', 'bar', 'baz'])
+            metadata.save()
+            old_records = dict(metadata._records)
+
+            # Only write the packages that have changed.
+            with mock.patch('mopack.metadata._write_atomic',
+                            wraps=_write_atomic) as mwrite:
+                metadata.packages['bar'].resolved = False
+                metadata.mark_dirty(metadata.packages['bar'])
+                metadata.save()
+                bar = os.path.join(metadata.packages_path,
+                                   metadata._records['bar'])
+                self.assertEqual(mwrite.mock_calls, [
+                    mock.call(bar, mock.ANY),
+                    mock.call(os.path.splitext(bar)[0] + '.pickle', mock.ANY),
+                    mock.call(metadata.path, mock.ANY),
+                ])
+            self.assertNotEqual(metadata._records['bar'], old_records['bar'])
+
+            # Records from the previous save are kept around for one more
+            # save, and then removed.
+            del metadata.packages['baz']
+            metadata.save()
+            self.assertCountEqual(
+                os.listdir(metadata.packages_path),
+                self.record_files([old_records['foo'],
+                                   metadata._records['bar'],
+                                   old_records['baz']])
+            )
+            metadata.save()
+            self.assertCountEqual(
+                os.listdir(metadata.packages_path),
+                self.record_files(metadata._records.values())
+            )
+
+            # A new metadata object reuses existing records.
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            with mock.patch('mopack.metadata._write_atomic',
+                            wraps=_write_atomic) as mwrite:
+                metadata.save()
+                mwrite.assert_called_once_with(metadata.path, mock.ANY)
+            metadata.save()
+            self.assertCountEqual(os.listdir(metadata.packages_path),
+                                  self.record_files([old_records['foo']]))
+
+    def test_stamp(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            self.assertEqual(Metadata.stamp(pkgdir), None)
+
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            metadata.save()
+            stamp = Metadata.stamp(pkgdir)
+            self.assertEqual(Metadata.stamp(pkgdir), stamp)
+
+            # Replacing the index changes the stamp, even if its size and
+            # modification time are the same.
+            stat = os.stat(metadata.path)
+            with open(metadata.path) as f:
+                _write_atomic(metadata.path, f.read())
+            os.utime(metadata.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertNotEqual(Metadata.stamp(pkgdir), stamp)
+
+            # So does changing the package records.
+            stamp = Metadata.stamp(pkgdir)
+            stat = os.stat(metadata.packages_path)
+            os.utime(metadata.packages_path,
+                     ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+            self.assertNotEqual(Metadata.stamp(pkgdir), stamp)
+
+    def test_save_unchanged(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo', 'bar'])
+            with mock.patch('mopack.metadata._dump_package',
+                            wraps=_dump_package) as mdump:
+                metadata.save()
+                self.assertEqual(mdump.call_count, 2)
+
+                # Packages that haven't been marked as changed aren't
+                # serialized again.
+                mdump.reset_mock()
+                metadata.save()
+                mdump.assert_not_called()
+
+                metadata.mark_dirty(metadata.packages['bar'])
+                metadata.save()
+                mdump.assert_called_once_with(metadata.packages['bar'])
+
+    def test_save_interrupted(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            metadata.save()
+
+            metadata.packages['foo'].resolved = False
+            metadata.mark_dirty(metadata.packages['foo'])
+            with mock.patch('os.replace', side_effect=[None, OSError()]), \
+                 self.assertRaises(OSError):
+                metadata.save()
+
+            # Readers still see the metadata as it was before.
+            self.assertTrue(Metadata.load(pkgdir).get_package('foo').resolved)
+            self.assertFalse(any(i.startswith('.tmp-') for i in
+                                 os.listdir(pkgdir)))
+
+    def test_load_while_saving(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            metadata.save()
+
+            # A reader can still load packages after a writer replaces its
+            # index...
+            reader = Metadata.load(pkgdir)
+            metadata.packages['foo'].should_deploy = False
+            metadata.mark_dirty(metadata.packages['foo'])
+            metadata.save()
+            self.assertTrue(reader.get_package('foo').should_deploy)
+
+            # ... but not after its records have been cleaned up.
+            reader = Metadata.load(pkgdir)
+            metadata.packages['foo'].config_file = '/path/to/other.yml'
+            metadata.mark_dirty(metadata.packages['foo'])
+            metadata.save()
+            metadata.packages['foo'].should_deploy = True
+            metadata.mark_dirty(metadata.packages['foo'])
+            metadata.save()
+            with self.assertRaises(MetadataChangedError):
+                reader.get_package('foo')
+
+    def test_load_lazy(self):
+        with tempfile.TemporaryDirectory() as pkgdir, \
+             mock.patch.object(Metadata, 'binary_records', False):
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo', 'bar'])
+            metadata.save()
+
+            with mock.patch('mopack.metadata.rehydrate',
+                            wraps=rehydrate) as mrehydrate:
+                metadata = Metadata.load(pkgdir)
+                self.assertEqual(list(metadata.packages), ['foo', 'bar'])
+                self.assertIn('foo', metadata.packages)
+                mrehydrate.assert_not_called()
+
+                self.assertIsInstance(metadata.get_package('foo'),
+                                      AptPackage)
+                self.assertEqual(mrehydrate.call_count, 1)
+                metadata.get_package('foo')
+                self.assertEqual(mrehydrate.call_count, 1)
+
+            # Unused (and unchanged) packages aren't written again.
+            with mock.patch('mopack.metadata._write_atomic',
+                            wraps=_write_atomic) as mwrite, \
+                 mock.patch('mopack.metadata.rehydrate') as mrehydrate:
+                metadata.save()
+                mrehydrate.assert_not_called()
+                mwrite.assert_called_once_with(metadata.path, mock.ANY)
+
+    def test_save_binary(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            foo = metadata.packages['foo']
+            foo.compute_fingerprint(metadata)
+
+            # Binary records are pickled from the packages in memory, without
+            # any state that's only used while resolving.
+            with mock.patch('mopack.metadata.rehydrate') as mrehydrate:
+                metadata.save()
+                foo_copy = Metadata.load(pkgdir).get_package('foo')
+                mrehydrate.assert_not_called()
+            self.assertEqual(foo_copy, foo)
+            self.assertIn('_fingerprint', vars(foo))
+            self.assertNotIn('_fingerprint', vars(foo_copy))
+
+    def test_load_binary(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = Metadata(pkgdir)
+            self.make_packages(metadata, ['foo'])
+            metadata.save()
+            binpath = os.path.join(metadata.packages_path, os.path.splitext(
+                metadata._records['foo']
+            )[0] + '.pickle')
+
+            # Binary records don't need to be rehydrated.
+            with mock.patch('mopack.metadata.rehydrate') as mrehydrate:
+                metadata_copy = Metadata.load(pkgdir)
+                self.assertEqual(metadata_copy.get_package('foo'),
+                                 metadata.packages['foo'])
+                mrehydrate.assert_not_called()
+
+                # Packages still share the metadata's options.
+                metadata_copy = Metadata.load(pkgdir, strict=True)
+                foo = metadata_copy.get_package('foo')
+                self.assertIs(foo._options, metadata_copy.options)
+                self.assertIs(foo._expr_symbols['env'].maps[0],
+                              metadata_copy.options.common.env)
+                self.assertTrue(foo._options.common.strict)
+                mrehydrate.assert_not_called()
+
+            # Binary records from other versions of mopack are ignored...
+            with mock.patch('mopack.metadata.app_version', '0.0'), \
+                 mock.patch('mopack.metadata.rehydrate',
+                            wraps=rehydrate) as mrehydrate:
+                metadata_copy = Metadata.load(pkgdir)
+                self.assertEqual(metadata_copy.get_package('foo'),
+                                 metadata.packages['foo'])
+                self.assertEqual(mrehydrate.call_count, 1)
+
+            # ... as are invalid ones.
+            with open(binpath, 'wb') as f:
+                f.write(b'garbage')
+            metadata_copy = Metadata.load(pkgdir)
+            self.assertEqual(metadata_copy.get_package('foo'),
+                             metadata.packages['foo'])
 
     def test_load_invalid_version(self):
         data = {
@@ -74,6 +348,7 @@ class TestMetadata(OptionsTest):
 
     def test_upgrade_from_v1(self):
         metadata = Metadata.load(os.path.join(test_data_dir, 'metadata', 'v1'))
+        self.assertEqual(list(metadata.packages), ['zlib'])
         self.assertIsInstance(metadata.get_package('zlib'), ConanPackage)
         self.assertEqual(metadata.options.common.expr_symbols,
                          {'host_platform': mock.ANY,
@@ -81,3 +356,16 @@ class TestMetadata(OptionsTest):
                           'env': {},
                           'deploy_dirs': {},
                           'auto_link': False})
+
+        # Saving the metadata again should store it in the current format.
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata.pkgdir = pkgdir
+            metadata.save()
+            self.assertCountEqual(
+                os.listdir(metadata.packages_path),
+                self.record_files(metadata._records.values())
+            )
+
+            metadata_copy = Metadata.load(pkgdir)
+            self.assertEqual(metadata_copy.get_package('zlib'),
+                             metadata.get_package('zlib'))
@@ -7,6 +7,7 @@ from .. import auto_link_default
 
 from mopack.options import *
 from mopack.environment import Environment
+from mopack.types import FieldValueError
 from mopack.path import Path
 from mopack.placeholder import placeholder
 from mopack.platforms import platform_name
@@ -151,6 +152,29 @@ class TestCommonOptions(TestCase):
         opts.finalize()
         self.assertEqual(opts.target_platform, platform_name())
 
+    def test_compiler_cache(self):
+        opts = CommonOptions()
+        opts.finalize()
+        self.assertEqual(opts.compiler_cache, None)
+        self.assertEqual(opts.compiler_cache_dir, None)
+
+        opts = CommonOptions()
+        opts(compiler_cache='ccache', compiler_cache_dir='cache')
+        opts(compiler_cache='sccache', compiler_cache_dir='other')
+        opts.finalize()
+        self.assertEqual(opts.compiler_cache, 'ccache')
+        self.assertEqual(opts.compiler_cache_dir, 'cache')
+
+        opts = CommonOptions()
+        opts(compiler_cache=None)
+        opts(compiler_cache='ccache')
+        opts.finalize()
+        self.assertEqual(opts.compiler_cache, None)
+
+        opts = CommonOptions()
+        with self.assertRaises(FieldValueError):
+            opts(compiler_cache='goofy')
+
     def test_env(self):
         opts = CommonOptions()
         opts(env={'FOO': 'foo'})
@@ -220,3 +244,5 @@ class TestCommonOptions(TestCase):
             opts = CommonOptions.rehydrate(data)
             self.assertIsInstance(opts, CommonOptions)
             m.assert_called_once()
+            self.assertEqual(opts.compiler_cache, None)
+            self.assertEqual(opts.compiler_cache_dir, None)
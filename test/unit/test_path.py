@@ -1,5 +1,6 @@
 import ntpath
 import os
+import tempfile
 from unittest import mock, TestCase
 
 from mopack.placeholder import PlaceholderString, placeholder
@@ -54,6 +55,59 @@ class TestFileOutdated(TestCase):
             self.assertFalse(file_outdated('foo', 'bar', False))
 
 
+class TestDirectoryCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = self.tmpdir.name
+        os.mkdir(os.path.join(self.root, 'sub'))
+        for i in ('foo.h', os.path.join('sub', 'bar.h')):
+            with open(os.path.join(self.root, i), 'w'):
+                pass
+
+    def test_isfile(self):
+        cache = DirectoryCache()
+        self.assertTrue(cache.isfile(os.path.join(self.root, 'foo.h')))
+        self.assertTrue(cache.isfile(os.path.join(self.root, 'sub', 'bar.h')))
+        self.assertFalse(cache.isfile(os.path.join(self.root, 'bar.h')))
+        self.assertFalse(cache.isfile(os.path.join(self.root, 'sub')))
+        self.assertFalse(cache.isfile(os.path.join(self.root, 'nonexist',
+                                                   'foo.h')))
+        self.assertFalse(cache.isfile(self.root + os.sep))
+
+    def test_isfile_path(self):
+        cache = DirectoryCache()
+        self.assertTrue(cache.isfile(Path('sub/bar.h', 'srcdir'),
+                                     {'srcdir': self.root}))
+        self.assertFalse(cache.isfile(Path('sub/foo.h', 'srcdir'),
+                                      {'srcdir': self.root}))
+
+    def test_scan_once(self):
+        cache = DirectoryCache()
+        with mock.patch('os.scandir', wraps=os.scandir) as mscandir:
+            for i in ('foo.h', 'bar.h', 'baz.h'):
+                cache.isfile(os.path.join(self.root, i))
+            mscandir.assert_called_once_with(self.root)
+
+        # Changes after listing the directory aren't noticed.
+        with open(os.path.join(self.root, 'baz.h'), 'w'):
+            pass
+        self.assertFalse(cache.isfile(os.path.join(self.root, 'baz.h')))
+        self.assertTrue(DirectoryCache().isfile(
+            os.path.join(self.root, 'baz.h')
+        ))
+
+    def test_case_insensitive(self):
+        cache = DirectoryCache()
+        path = os.path.join(self.root, 'FOO.h')
+        with mock.patch('os.path.isfile', return_value=True) as misfile:
+            self.assertTrue(cache.isfile(path))
+            misfile.assert_called_once_with(path)
+        with mock.patch('os.path.isfile') as misfile:
+            self.assertFalse(cache.isfile(os.path.join(self.root, 'BAR.h')))
+            misfile.assert_not_called()
+
+
 class TestPath(TestCase):
     def test_construct(self):
         p = Path('foo', 'cfgdir')
@@ -1,11 +1,14 @@
 import os
 import re
+import subprocess
+import tempfile
+import time
 from io import StringIO
 from textwrap import dedent
-from unittest import TestCase
+from unittest import mock, TestCase
 
 from mopack.path import Path
-from mopack.pkg_config import write_pkg_config
+from mopack.pkg_config import *
 from mopack.placeholder import placeholder as ph
 from mopack.shell import ShellArguments
 
@@ -98,3 +101,348 @@ class TestWritePkgConfig(TestCase):
             write_pkg_config(out, 'mypackage', variables={'srcdir': 1})
         with self.assertRaises(TypeError):
             write_pkg_config(out, 'mypackage', cflags=1)
+
+
+class TestCompareVersions(TestCase):
+    def test_compare(self):
+        self.assertEqual(compare_versions('1.0', '1.0'), 0)
+        self.assertEqual(compare_versions('1.0', '1.00'), 0)
+        self.assertEqual(compare_versions('1.0', '1_0'), 0)
+        self.assertEqual(compare_versions('1.2', '1.10'), -1)
+        self.assertEqual(compare_versions('1.10', '1.2'), 1)
+        self.assertEqual(compare_versions('1.0', '1.0.1'), -1)
+        self.assertEqual(compare_versions('1.0.1', '1.0'), 1)
+        self.assertEqual(compare_versions('1.0a', '1.0b'), -1)
+        self.assertEqual(compare_versions('1.0', '1.a'), 1)
+        self.assertEqual(compare_versions('1.a', '1.0'), -1)
+
+
+class PkgConfigDirTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.pcdir = self.tmpdir.name
+
+    def write_pc(self, name, data):
+        path = os.path.join(self.pcdir, name + '.pc')
+        with open(path, 'w') as f:
+            f.write(dedent(data))
+        return path
+
+
+class TestPkgConfigFile(PkgConfigDirTest):
+    def test_read(self):
+        path = self.write_pc('foo', """\
+          # A comment
+          prefix=/usr
+          includedir=${prefix}/include # Another comment
+          cost=$$5 \\# not a comment
+
+          Name: foo
+          Description: A \\
+            package
+          Version: 1.0
+          Requires: bar >= 1.0, baz
+          Requires.private: quux<2
+          Cflags: -I${includedir}
+        """)
+        pc = PkgConfigFile.read('foo', path)
+        self.assertEqual(pc.name, 'foo')
+        self.assertEqual(pc.path, path)
+        self.assertEqual(pc.variables, {
+            'pcfiledir': self.pcdir, 'pc_sysrootdir': '/', 'prefix': '/usr',
+            'includedir': '/usr/include', 'cost': '$5 # not a comment',
+        })
+        self.assertEqual(pc.fields, {
+            'Name': 'foo', 'Description': 'A    package', 'Version': '1.0',
+            'Requires': 'bar >= 1.0, baz', 'Requires.private': 'quux<2',
+            'Cflags': '-I/usr/include',
+        })
+        self.assertEqual(pc.version, '1.0')
+        self.assertEqual(pc.requires, [
+            ('bar', '>=', '1.0'), ('baz', '', ''), ('quux', '<', '2'),
+        ])
+
+    def test_override_variable(self):
+        path = self.write_pc('foo-bar', """\
+          prefix=/usr
+          libdir=${prefix}/lib
+          Name: foo
+          Description: foo
+          Version: ${prefix}
+        """)
+        pc = PkgConfigFile.read('foo-bar', path, {
+            'PKG_CONFIG_FOO_BAR_PREFIX': '/opt',
+        })
+        self.assertEqual(pc.variables['libdir'], '/opt/lib')
+        self.assertEqual(pc.version, '/opt')
+
+    def test_invalid(self):
+        path = self.write_pc('foo', """\
+          Name: foo
+          Description: foo
+          Version: ${version}
+        """)
+        with self.assertRaisesRegex(ValueError, "'version' not defined"):
+            PkgConfigFile.read('foo', path)
+
+        path = self.write_pc('foo', """\
+          prefix=/usr
+          prefix=/opt
+          Name: foo
+          Description: foo
+          Version: 1.0
+        """)
+        with self.assertRaisesRegex(ValueError, 'duplicate definition'):
+            PkgConfigFile.read('foo', path)
+
+        path = self.write_pc('foo', """\
+          Name: foo
+          Description: foo
+        """)
+        with self.assertRaisesRegex(ValueError, "missing 'Version'"):
+            PkgConfigFile.read('foo', path)
+
+
+class TestPkgConfigResolver(PkgConfigDirTest):
+    def write_simple_pc(self, name, version='1.0', requires=''):
+        return self.write_pc(name, """\
+          Name: {name}
+          Description: {name}
+          Version: {version}
+          Requires: {requires}
+        """.format(name=name, version=version, requires=requires))
+
+    def test_find(self):
+        path = self.write_simple_pc('foo')
+        resolver = PkgConfigResolver([self.pcdir])
+        self.assertEqual(resolver.find('foo').path, path)
+        self.assertIs(resolver.find('foo'), resolver.find('foo'))
+        self.assertEqual(resolver.find('bar'), None)
+        self.assertEqual(resolver.modversion('foo'), '1.0')
+        self.assertEqual(resolver.modversion('bar'), None)
+
+    def test_find_search_order(self):
+        with tempfile.TemporaryDirectory() as pcdir2:
+            path = self.write_simple_pc('foo')
+            path2 = os.path.join(pcdir2, 'foo.pc')
+            os.rename(self.write_simple_pc('foo', '2.0'), path2)
+            self.write_simple_pc('foo')
+
+            resolver = PkgConfigResolver([pcdir2, self.pcdir])
+            self.assertEqual(resolver.find('foo').path, path2)
+            resolver = PkgConfigResolver([self.pcdir, pcdir2])
+            self.assertEqual(resolver.find('foo').path, path)
+
+    def test_find_uninstalled(self):
+        self.write_simple_pc('foo')
+        path = self.write_simple_pc('foo-uninstalled', '2.0')
+
+        resolver = PkgConfigResolver([self.pcdir])
+        self.assertEqual(resolver.find('foo').path, path)
+        self.assertEqual(resolver.modversion('foo'), '2.0')
+
+        resolver = PkgConfigResolver([self.pcdir], {
+            'PKG_CONFIG_DISABLE_UNINSTALLED': '1',
+        })
+        self.assertEqual(resolver.modversion('foo'), '1.0')
+
+    def test_find_invalid(self):
+        self.write_pc('foo', 'Name: foo\n')
+        resolver = PkgConfigResolver([self.pcdir])
+        self.assertEqual(resolver.find('foo'), None)
+
+    def test_exists(self):
+        self.write_simple_pc('foo', requires='bar >= 1.0')
+        self.write_simple_pc('bar', '1.2', requires='foo')
+        self.write_simple_pc('baz', requires='bar > 2, foo')
+        self.write_simple_pc('quux', requires='missing')
+
+        resolver = PkgConfigResolver([self.pcdir])
+        self.assertTrue(resolver.exists(['foo']))
+        self.assertTrue(resolver.exists(['foo', 'bar']))
+        self.assertFalse(resolver.exists(['baz']))
+        self.assertFalse(resolver.exists(['quux']))
+        self.assertFalse(resolver.exists(['foo', 'missing']))
+
+
+class TestSearchPath(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict('mopack.pkg_config._default_search_paths',
+                                  clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_default(self):
+        path = os.pathsep.join(['/usr/lib/pkgconfig', '/usr/share/pkgconfig'])
+        with mock.patch('subprocess.run') as mrun:
+            mrun.return_value.stdout = path + '\n'
+            self.assertEqual(search_path(['pkg-config'], {}), [
+                '/usr/lib/pkgconfig', '/usr/share/pkgconfig',
+            ])
+            self.assertEqual(
+                search_path(['pkg-config'], {'PKG_CONFIG_PATH': '/foo'}),
+                ['/foo', '/usr/lib/pkgconfig', '/usr/share/pkgconfig']
+            )
+            mrun.assert_called_once_with(
+                ['pkg-config', '--variable', 'pc_path', 'pkg-config'],
+                text=True, check=True, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, env={}
+            )
+
+    def test_libdir(self):
+        with mock.patch('subprocess.run') as mrun:
+            self.assertEqual(search_path(['pkg-config'], {
+                'PKG_CONFIG_PATH': '/foo', 'PKG_CONFIG_LIBDIR': '/bar',
+            }), ['/foo', '/bar'])
+            mrun.assert_not_called()
+
+    def test_no_pkg_config(self):
+        with mock.patch('subprocess.run', side_effect=OSError()) as mrun:
+            self.assertEqual(search_path(['pkg-config'], {}), None)
+            self.assertEqual(make_resolver(['pkg-config'], {}), None)
+            mrun.assert_called_once()
+
+    def test_make_resolver(self):
+        resolver = make_resolver(['pkg-config'], {'PKG_CONFIG_LIBDIR': '/foo'})
+        self.assertEqual(resolver.search_path, ['/foo'])
+
+
+class TestPkgConfigIndex(PkgConfigDirTest):
+    def setUp(self):
+        super().setUp()
+        self.pkgdir = os.path.join(self.tmpdir.name, 'mopack')
+        os.mkdir(self.pkgdir)
+        self.pcdir = os.path.join(self.tmpdir.name, 'pkgconfig')
+        os.mkdir(self.pcdir)
+
+        patcher = mock.patch.dict('mopack.pkg_config._default_search_paths',
+                                  clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def touch_pc(self, name, dirname=None, mtime=1):
+        dirname = dirname or self.pcdir
+        with open(os.path.join(dirname, name + '.pc'), 'w'):
+            pass
+        # Make sure the directory looks changed (and isn't racy).
+        os.utime(dirname, ns=(mtime, mtime))
+        return os.path.join(dirname, name + '.pc')
+
+    def test_lookup(self):
+        pcdir2 = os.path.join(self.tmpdir.name, 'pkgconfig2')
+        os.mkdir(pcdir2)
+        foo = self.touch_pc('foo')
+        bar = self.touch_pc('bar')
+        foo2 = self.touch_pc('foo', pcdir2)
+        missing = os.path.join(self.tmpdir.name, 'missing')
+
+        index = PkgConfigIndex()
+        index.refresh([self.pcdir, pcdir2, missing])
+        self.assertEqual(index.lookup([self.pcdir, pcdir2, missing], 'foo'),
+                         foo)
+        self.assertEqual(index.lookup([self.pcdir, pcdir2, missing], 'bar'),
+                         bar)
+        self.assertEqual(index.lookup([self.pcdir, pcdir2, missing], 'baz'),
+                         None)
+        self.assertEqual(index.lookup([pcdir2, self.pcdir], 'foo'), foo2)
+
+    def test_refresh(self):
+        self.touch_pc('foo')
+        index = PkgConfigIndex()
+        index.refresh([self.pcdir])
+        self.assertEqual(index.lookup([self.pcdir], 'bar'), None)
+
+        with mock.patch('os.scandir') as mscandir:
+            index.refresh([self.pcdir])
+            mscandir.assert_not_called()
+
+        bar = self.touch_pc('bar', mtime=2)
+        index.refresh([self.pcdir])
+        self.assertEqual(index.lookup([self.pcdir], 'bar'), bar)
+
+    def test_save_load(self):
+        foo = self.touch_pc('foo')
+        index = PkgConfigIndex(self.pkgdir)
+        index.refresh([self.pcdir])
+        index.save()
+        self.assertTrue(os.path.exists(index.path))
+
+        index = PkgConfigIndex.load(self.pkgdir)
+        with mock.patch('os.scandir') as mscandir:
+            index.refresh([self.pcdir])
+            mscandir.assert_not_called()
+        self.assertEqual(index.lookup([self.pcdir], 'foo'), foo)
+
+    def test_save_racy(self):
+        foo = self.touch_pc('foo', mtime=time.time_ns())
+        index = PkgConfigIndex(self.pkgdir)
+        index.refresh([self.pcdir])
+        self.assertEqual(index.lookup([self.pcdir], 'foo'), foo)
+        index.save()
+
+        index = PkgConfigIndex.load(self.pkgdir)
+        with mock.patch('os.scandir', wraps=os.scandir) as mscandir:
+            index.refresh([self.pcdir])
+            mscandir.assert_called_once_with(self.pcdir)
+
+    def test_save_no_pkgdir(self):
+        pkgdir = os.path.join(self.tmpdir.name, 'nonexist')
+        index = PkgConfigIndex(pkgdir)
+        index.refresh([self.pcdir])
+        index.save()
+        self.assertFalse(os.path.exists(pkgdir))
+
+    def test_load_invalid(self):
+        with open(os.path.join(self.pkgdir, PkgConfigIndex.index_filename),
+                  'w') as f:
+            f.write('{"version": 1, "dirs": [')
+        index = PkgConfigIndex.load(self.pkgdir)
+        self.assertEqual(index.lookup([], 'foo'), None)
+
+    def test_default_search_path(self):
+        exe = os.path.join(self.tmpdir.name, 'pkg-config')
+        with open(exe, 'w'):
+            pass
+
+        index = PkgConfigIndex(self.pkgdir)
+        with mock.patch('shutil.which', return_value=exe), \
+             mock.patch('subprocess.run') as mrun:
+            mrun.return_value.stdout = self.pcdir + '\n'
+            self.assertEqual(index.default_search_path(['pkg-config'], {}),
+                             [self.pcdir])
+            mrun.assert_called_once()
+        index.save()
+
+        # Load the saved default search path.
+        index = PkgConfigIndex.load(self.pkgdir)
+        with mock.patch.dict('mopack.pkg_config._default_search_paths',
+                             clear=True), \
+             mock.patch('shutil.which', return_value=exe), \
+             mock.patch('subprocess.run') as mrun:
+            self.assertEqual(index.default_search_path(['pkg-config'], {}),
+                             [self.pcdir])
+            mrun.assert_not_called()
+
+        # Changing pkg-config invalidates the saved path.
+        with open(exe, 'w') as f:
+            f.write('#!/bin/sh\n')
+        with mock.patch.dict('mopack.pkg_config._default_search_paths',
+                             clear=True), \
+             mock.patch('shutil.which', return_value=exe), \
+             mock.patch('subprocess.run') as mrun:
+            mrun.return_value.stdout = '/usr/lib/pkgconfig\n'
+            self.assertEqual(index.default_search_path(['pkg-config'], {}),
+                             ['/usr/lib/pkgconfig'])
+            mrun.assert_called_once()
+
+    def test_make_resolver(self):
+        self.touch_pc('foo')
+        with mock.patch.dict('mopack.pkg_config._indexes', clear=True):
+            resolver = make_resolver(['pkg-config'],
+                                     {'PKG_CONFIG_LIBDIR': self.pcdir},
+                                     self.pkgdir)
+            self.assertIs(resolver.index, get_index(self.pkgdir))
+            self.assertEqual(resolver._lookup('foo'),
+                             os.path.join(self.pcdir, 'foo.pc'))
+            self.assertTrue(os.path.exists(resolver.index.path))
@@ -45,3 +45,20 @@ class TestPlatformName(TestCase):
     def test_unknown(self):
         with mock.patch('platform.system', return_value='Goofy'):
             self.assertEqual(platforms.platform_name(), 'goofy')
+
+
+class TestPeakMemory(TestCase):
+    def setUp(self):
+        self.rusage = mock.Mock(ru_maxrss=1024)
+
+    def test_linux(self):
+        with mock.patch('mopack.platforms.platform_name',
+                        return_value='linux'), \
+             mock.patch('resource.getrusage', return_value=self.rusage):
+            self.assertEqual(platforms.peak_memory(), 1024 ** 2)
+
+    def test_macos(self):
+        with mock.patch('mopack.platforms.platform_name',
+                        return_value='darwin'), \
+             mock.patch('resource.getrusage', return_value=self.rusage):
+            self.assertEqual(platforms.peak_memory(), 1024)
@@ -0,0 +1,147 @@
+import os
+import socket
+import tempfile
+import threading
+from unittest import mock, skipIf, TestCase
+
+from mopack.commands import PackageTreeItem
+from mopack.dependencies import Dependency
+from mopack.metadata import Metadata, MetadataChangedError
+from mopack.server import *
+
+
+class TestQueryNoServer(TestCase):
+    def test_no_socket(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            self.assertEqual(query(pkgdir, 'list-files'), None)
+
+    def test_unsupported(self):
+        with mock.patch('mopack.server.supported', False), \
+             mock.patch('socket.socket') as msocket:
+            self.assertEqual(query('/path/to/pkgdir', 'list-files'), None)
+            msocket.assert_not_called()
+
+
+@skipIf(not supported, 'Unix domain sockets not supported')
+class TestServer(TestCase):
+    linkage = {'name': 'foo', 'type': 'pkg_config', 'pcnames': ['foo'],
+               'pkg_config_path': []}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.pkgdir = os.path.join(self.tmpdir.name, 'mopack')
+        self.metadata = Metadata(self.pkgdir, files=['mopack.yml'],
+                                 implicit_files=['mopack-implicit.yml'])
+        self.metadata.save()
+
+        self.server = Server(self.pkgdir)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+
+        def stop():
+            self.server.shutdown()
+            thread.join()
+            self.server.server_close()
+
+        self.addCleanup(stop)
+
+    def test_socket(self):
+        self.assertTrue(os.path.exists(socket_path(self.pkgdir)))
+        with self.assertRaisesRegex(ServerError, 'already running'):
+            Server(self.pkgdir)
+
+    def test_linkage(self):
+        with mock.patch.object(Metadata, 'get_linkage',
+                               return_value=self.linkage) as mlinkage:
+            self.assertEqual(query(self.pkgdir, 'linkage',
+                                   dependencies=['foo', 'foo[sub]']),
+                             {'foo': self.linkage, 'foo[sub]': self.linkage})
+            mlinkage.assert_has_calls([
+                mock.call(Dependency('foo')),
+                mock.call(Dependency('foo', ['sub'])),
+            ])
+
+    def test_linkage_error(self):
+        with self.assertRaisesRegex(ServerError,
+                                    "no definition for package 'foo'"):
+            query(self.pkgdir, 'linkage', dependencies=['foo'], strict=True)
+
+    def test_list_files(self):
+        self.assertEqual(query(self.pkgdir, 'list-files'), ['mopack.yml'])
+        self.assertEqual(query(self.pkgdir, 'list-files', implicit=True),
+                         ['mopack.yml', 'mopack-implicit.yml'])
+
+    def test_list_packages(self):
+        pkg = mock.MagicMock(origin='apt')
+        pkg.name = 'foo'
+        pkg.parent = None
+        pkg.version.return_value = '1.0'
+        self.server.metadata().packages['foo'] = pkg
+
+        items = query(self.pkgdir, 'list-packages')
+        self.assertEqual(len(items), 1)
+        self.assertIsInstance(items[0], PackageTreeItem)
+        self.assertEqual(items[0].package.name, 'foo')
+        self.assertEqual(items[0].package.origin, 'apt')
+        self.assertEqual(items[0].version, '1.0')
+        self.assertEqual(items[0].children, [])
+
+    def test_list_packages_missing(self):
+        os.remove(os.path.join(self.pkgdir, Metadata.metadata_filename))
+        with self.assertRaises(ServerError):
+            query(self.pkgdir, 'list-packages')
+
+    def test_reload(self):
+        self.assertEqual(query(self.pkgdir, 'list-files'), ['mopack.yml'])
+        metadata = self.server.metadata()
+        self.assertIs(self.server.metadata(), metadata)
+
+        self.metadata.files = ['mopack.yml', 'mopack-extra.yml']
+        self.metadata.save()
+        self.assertEqual(query(self.pkgdir, 'list-files'),
+                         ['mopack.yml', 'mopack-extra.yml'])
+        self.assertIsNot(self.server.metadata(), metadata)
+
+    def test_metadata_changed(self):
+        metadata = self.server.metadata()
+        with mock.patch.object(Metadata, 'get_linkage', side_effect=[
+            MetadataChangedError(), self.linkage,
+        ]):
+            self.assertEqual(query(self.pkgdir, 'linkage',
+                                   dependencies=['foo']),
+                             {'foo': self.linkage})
+        self.assertIsNot(self.server.metadata(), metadata)
+
+    def test_idle_client(self):
+        # A client that connects but never sends anything doesn't block other
+        # queries forever.
+        result = []
+        with mock.patch('mopack.server._Handler.timeout', 0.1):
+            idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.addCleanup(idle.close)
+            idle.connect(socket_path(self.pkgdir))
+
+            thread = threading.Thread(target=lambda: result.append(
+                query(self.pkgdir, 'list-files')
+            ))
+            thread.start()
+            thread.join(5)
+        self.assertEqual(result, [['mopack.yml']])
+
+    def test_unknown_command(self):
+        with self.assertRaisesRegex(ServerError, "unknown command 'foo'"):
+            query(self.pkgdir, 'foo')
+
+
+@skipIf(not supported, 'Unix domain sockets not supported')
+class TestServerLifetime(TestCase):
+    def test_stale_socket(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            with open(socket_path(pkgdir), 'w'):
+                pass
+            self.assertEqual(query(pkgdir, 'list-files'), None)
+
+            with Server(pkgdir):
+                self.assertTrue(os.path.exists(socket_path(pkgdir)))
+            self.assertFalse(os.path.exists(socket_path(pkgdir)))
@@ -604,6 +604,17 @@ class TestUrl(TypeTestCase):
                 url('field', i)
 
 
+class TestHexString(TypeTestCase):
+    def test_valid(self):
+        self.assertEqual(hex_string(4)('field', '09af'), '09af')
+        self.assertEqual(hex_string(4)('field', '09AF'), '09af')
+
+    def test_invalid(self):
+        for i in ['09a', '09afe', '09ag', 1234]:
+            with self.assertFieldError(('field',)):
+                hex_string(4)('field', i)
+
+
 class TestDependency(TypeTestCase):
     def test_package(self):
         self.assertEqual(dependency('field', 'package'),
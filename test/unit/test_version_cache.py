@@ -0,0 +1,94 @@
+import os
+import tempfile
+import time
+from unittest import mock, TestCase
+
+from mopack.version_cache import *
+
+
+class TestVersionCache(TestCase):
+    patterns = [r'#define VERSION "([\d\.]+)"']
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = VersionCache(self.tmpdir.name)
+        self.header = os.path.join(self.tmpdir.name, 'foo.hpp')
+        self.write_header('1.0')
+
+    def write_header(self, version, mtime=10**9):
+        with open(self.header, 'w') as f:
+            f.write(version)
+        os.utime(self.header, ns=(mtime, mtime))
+
+    def extract(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_key(self):
+        self.assertEqual(VersionCache.key(self.patterns),
+                         VersionCache.key(list(self.patterns)))
+        self.assertNotEqual(VersionCache.key(self.patterns),
+                            VersionCache.key(self.patterns + [['_', '.']]))
+
+    def test_get(self):
+        extract = mock.Mock(side_effect=self.extract)
+        self.assertEqual(self.cache.get(self.header, self.patterns, extract),
+                         '1.0')
+        self.assertEqual(self.cache.get(self.header, self.patterns, extract),
+                         '1.0')
+        extract.assert_called_once_with(self.header)
+
+        # Different patterns get their own entries.
+        self.assertEqual(self.cache.get(self.header, [], extract), '1.0')
+        self.assertEqual(extract.call_count, 2)
+
+    def test_get_none(self):
+        extract = mock.Mock(return_value=None)
+        self.assertEqual(self.cache.get(self.header, self.patterns, extract),
+                         None)
+        self.assertEqual(self.cache.get(self.header, self.patterns, extract),
+                         None)
+        extract.assert_called_once_with(self.header)
+
+    def test_get_missing(self):
+        missing = os.path.join(self.tmpdir.name, 'missing.hpp')
+        with self.assertRaises(FileNotFoundError):
+            self.cache.get(missing, self.patterns, self.extract)
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_invalidate(self):
+        self.assertEqual(self.cache.get(self.header, self.patterns,
+                                        self.extract), '1.0')
+        self.write_header('2.0', mtime=2 * 10**9)
+        self.assertEqual(self.cache.get(self.header, self.patterns,
+                                        self.extract), '2.0')
+
+    def test_save(self):
+        self.cache.get(self.header, self.patterns, self.extract)
+        self.assertTrue(os.path.exists(self.cache.path))
+
+        extract = mock.Mock()
+        cache = VersionCache(self.tmpdir.name)
+        self.assertEqual(cache.get(self.header, self.patterns, extract),
+                         '1.0')
+        extract.assert_not_called()
+
+    def test_save_racy(self):
+        self.write_header('1.0', mtime=time.time_ns())
+        self.assertEqual(self.cache.get(self.header, self.patterns,
+                                        self.extract), '1.0')
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def test_save_no_pkgdir(self):
+        pkgdir = os.path.join(self.tmpdir.name, 'nonexist')
+        cache = VersionCache(pkgdir)
+        self.assertEqual(cache.get(self.header, self.patterns, self.extract),
+                         '1.0')
+        self.assertFalse(os.path.exists(pkgdir))
+
+    def test_load_invalid(self):
+        with open(self.cache.path, 'w') as f:
+            f.write('{"version": 1, "entries": [')
+        self.assertEqual(self.cache.get(self.header, self.patterns,
+                                        self.extract), '1.0')